@@ -0,0 +1,6 @@
+import os
+
+# Lets child processes (e.g. the benchmark's spawned workers) pick up the emulated kp backend
+if os.environ.get('DEMOGUI_KP_BACKEND', '').lower() == 'emulator':
+    from demogui.kp_emulator import install_from_environment
+    install_from_environment()
@@ -0,0 +1,284 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import types
+import cv2
+import numpy as np
+from demogui.utils import (SIMILARITY_BLOCK_SIZE, FrameBufferPool, cluster_images_with_dbscan,
+                           compare_images_cosine_similarity, list_image_files, perform_inference,
+                           post_process_inference, preprocess_image_for_model)
+
+IMAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'external', 'res', 'images')
+ALBUM_SIZES = [100, 1000, 10000, 100000]
+CASES = ['preprocess_image_for_model', 'perform_inference', 'post_process_inference',
+         'compare_images_cosine_similarity', 'cluster_images_with_dbscan']
+FEATURE_DIM = 128
+GROUP_SIZE = 4
+INPUT_SIZE = [224, 224]
+CALLS = 500
+REPEAT = 3
+MAX_DENSE_BYTES = 2 << 30
+POST_PROCESS_SHAPES = [(1, 1, 1), (512, 1, 1), (255, 20, 20)]
+RESULTS_VERSION = 1
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_features(num_images, dim=FEATURE_DIM, group_size=GROUP_SIZE, noise=0.05, seed=0):
+    """Feature vectors that form groups of group_size near-duplicates, like burst shots in an album."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((-(-num_images // group_size), dim)).astype(np.float32)
+    features = np.repeat(centers, group_size, axis=0)[:num_images]
+    features += noise * rng.standard_normal(features.shape).astype(np.float32)
+    return features
+
+
+def summarize(name, latencies, items, album_size=None, rss_before=None, **extra):
+    """Turn per-call latencies (seconds) into a result record."""
+    latencies = np.asarray(latencies)
+    total = float(latencies.sum())
+    result = {
+        'name': name,
+        'album_size': album_size,
+        'calls': len(latencies),
+        'items': items,
+        'seconds': total,
+        'throughput_per_s': items / total if total > 0 else None,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if rss_before is not None:
+        result['peak_rss_growth_mb'] = max(0.0, result['peak_rss_mb'] - rss_before)
+    result.update(extra)
+    return result
+
+
+def skipped(name, reason, album_size=None, **extra):
+    result = {'name': name, 'album_size': album_size, 'skipped': reason}
+    result.update(extra)
+    return result
+
+
+def time_calls(func, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_preprocess_image_for_model(options):
+    """Time the decode, resize and BGR565 conversion every pipeline runs, recycling buffers as the pipelines do."""
+    image_file_paths = list_image_files(options.image_directory)
+    if not image_file_paths:
+        return [skipped('preprocess_image_for_model', f"no images in {options.image_directory}")]
+    width, height = options.input_size
+    buffer_pool = FrameBufferPool()
+
+    def preprocess(image_file_path):
+        buffer_pool.release(preprocess_image_for_model(image_file_path, width, height, buffer_pool))
+
+    rss_before = peak_rss_mb()
+    calls = [(image_file_paths[i % len(image_file_paths)],) for i in range(options.calls)]
+    latencies = time_calls(preprocess, calls)
+    return [summarize('preprocess_image_for_model', latencies, len(calls), rss_before=rss_before,
+                      distinct_images=len(image_file_paths), input_size=[width, height])]
+
+
+def bench_post_process_inference(options):
+    results = []
+    rng = np.random.default_rng(0)
+    for channel, height, width in POST_PROCESS_SHAPES:
+        node = types.SimpleNamespace(ndarray=rng.standard_normal((1, channel, height, width)).astype(np.float32),
+                                     channel=channel, height=height, width=width)
+        rss_before = peak_rss_mb()
+        latencies = time_calls(post_process_inference, [([node],)] * options.calls)
+        results.append(summarize('post_process_inference', latencies, options.calls, rss_before=rss_before,
+                                 output_shape=[channel, height, width]))
+    return results
+
+
+def bench_perform_inference(options):
+    if not options.model:
+        return [skipped('perform_inference', "no --model given; round-trips need a dongle or an emulated backend")]
+    from demogui.device_pool import DevicePool
+    from demogui.utils import model_preprocessor
+
+    image_file_paths = list_image_files(options.image_directory)
+    if not image_file_paths:
+        return [skipped('perform_inference', f"no images in {options.image_directory}")]
+    with DevicePool() as device_pool:
+        device_pool.load_model(options.model)
+        device = device_pool.devices[0]
+        preprocess = model_preprocessor(device.model_nef_descriptor)
+        buffers = [preprocess(image_file_path) for image_file_path in image_file_paths]
+        rss_before = peak_rss_mb()
+        calls = [(device.device_group, device.model_nef_descriptor, buffers[i % len(buffers)], False)
+                 for i in range(options.calls)]
+        latencies = time_calls(perform_inference, calls)
+    return [summarize('perform_inference', latencies, len(calls), rss_before=rss_before,
+                      model=os.path.basename(options.model))]
+
+
+def bench_compare_images_cosine_similarity(options):
+    results = []
+    for album_size in options.sizes:
+        image_paths = [f"image_{i}.jpg" for i in range(album_size)]
+        features = synthetic_features(album_size, options.feature_dim)
+        rss_before = peak_rss_mb()
+        latencies = time_calls(lambda: compare_images_cosine_similarity(
+            image_paths, None, None, features=features, similarity_threshold=options.threshold), [()] * options.repeat)
+        results.append(summarize('compare_images_cosine_similarity', latencies, album_size * options.repeat,
+                                 album_size, rss_before, variant='threshold_pairs'))
+
+        if album_size * album_size * 4 > options.max_dense_bytes:
+            results.append(skipped('compare_images_cosine_similarity',
+                                   f"dense matrix would need {album_size * album_size * 4 / (1 << 30):.1f} GiB",
+                                   album_size, variant='dense_matrix'))
+            continue
+        rss_before = peak_rss_mb()
+        latencies = time_calls(lambda: compare_images_cosine_similarity(
+            image_paths, None, None, features=features, upper_triangle=True), [()] * options.repeat)
+        results.append(summarize('compare_images_cosine_similarity', latencies, album_size * options.repeat,
+                                 album_size, rss_before, variant='dense_matrix'))
+    return results
+
+
+def bench_cluster_images_with_dbscan(options):
+    results = []
+    for album_size in options.sizes:
+        image_paths = [f"image_{i}.jpg" for i in range(album_size)]
+        features = synthetic_features(album_size, options.feature_dim)
+        for variant, kwargs in [('sparse_dbscan', {'sparse_graph': True}),
+                                ('sparse_components', {'sparse_graph': True, 'method': 'components'}),
+                                ('dense_dbscan', {})]:
+            if not kwargs and album_size * album_size * 16 > options.max_dense_bytes:
+                results.append(skipped('cluster_images_with_dbscan',
+                                       f"dense distance matrices would need "
+                                       f"{album_size * album_size * 16 / (1 << 30):.1f} GiB",
+                                       album_size, variant=variant))
+                continue
+            rss_before = peak_rss_mb()
+            clusters = []
+            latencies = time_calls(lambda: clusters.append(cluster_images_with_dbscan(
+                image_paths, None, None, similarity_threshold=options.threshold, features=features, **kwargs)),
+                [()] * options.repeat)
+            results.append(summarize('cluster_images_with_dbscan', latencies, album_size * options.repeat,
+                                     album_size, rss_before, variant=variant, clusters=len(clusters[-1])))
+    return results
+
+
+BENCHMARKS = {
+    'preprocess_image_for_model': bench_preprocess_image_for_model,
+    'perform_inference': bench_perform_inference,
+    'post_process_inference': bench_post_process_inference,
+    'compare_images_cosine_similarity': bench_compare_images_cosine_similarity,
+    'cluster_images_with_dbscan': bench_cluster_images_with_dbscan,
+}
+
+
+def run_case(case, options):
+    try:
+        return BENCHMARKS[case](options)
+    except MemoryError:
+        return [skipped(case, "out of memory")]
+
+
+def run_case_isolated(case, options):
+    """Run one case in a fresh interpreter so its peak RSS is not inflated by the cases before it."""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, (case, options))
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def compare_results(old, new):
+    """Print the throughput of every case in new relative to the same case in old."""
+    def key(result):
+        return result['name'], result.get('album_size'), result.get('variant'), str(result.get('output_shape'))
+
+    previous = {key(result): result for result in old['results'] if 'skipped' not in result}
+    for result in new['results']:
+        before = previous.get(key(result))
+        if 'skipped' in result or before is None or not before['throughput_per_s']:
+            continue
+        ratio = result['throughput_per_s'] / before['throughput_per_s']
+        label = ' '.join(str(part) for part in key(result) if part not in (None, 'None'))
+        print(f"{label:70s} {ratio:6.2f}x  p99 {before['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing, inference and clustering hot paths.")
+    parser.add_argument('-o', '--output', default='-', help="JSON results file, '-' for stdout (default)")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES, help="cases to run (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=ALBUM_SIZES,
+                        help=f"album sizes for the similarity and clustering cases (default {ALBUM_SIZES})")
+    parser.add_argument('--calls', type=int, default=CALLS, help="calls per single-image case")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="repetitions per album-size case")
+    parser.add_argument('--feature-dim', type=int, default=FEATURE_DIM, help="length of the synthetic features")
+    parser.add_argument('--threshold', type=float, default=0.8, help="cosine similarity threshold")
+    parser.add_argument('--max-dense-bytes', type=int, default=MAX_DENSE_BYTES,
+                        help="skip dense n x n variants that would need more memory than this")
+    parser.add_argument('--image-directory', default=IMAGE_DIRECTORY, help="images for preprocessing and inference")
+    parser.add_argument('--input-size', nargs=2, type=int, default=INPUT_SIZE, metavar=('WIDTH', 'HEIGHT'),
+                        help=f"model input size the preprocessing case resizes to (default {INPUT_SIZE})")
+    parser.add_argument('--model', help="NEF to time perform_inference round-trips with")
+    parser.add_argument('--no-isolate', dest='isolate', action='store_false',
+                        help="run every case in this process instead of a fresh one each")
+    parser.add_argument('--compare', metavar='BASELINE', help="print throughput relative to an earlier results file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    results = []
+    for case in options.cases:
+        print(f"running {case}", file=sys.stderr, flush=True)
+        results.extend(run_case_isolated(case, options) if options.isolate else run_case(case, options))
+
+    report = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': environment(),
+        'settings': {'calls': options.calls, 'repeat': options.repeat, 'feature_dim': options.feature_dim,
+                     'threshold': options.threshold, 'block_size': SIMILARITY_BLOCK_SIZE},
+        'results': results,
+    }
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            compare_results(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,590 @@
+import contextlib
+import csv
+import errno
+import itertools
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from demogui import tracing
+from demogui.device_pool import DevicePool
+from demogui.embedding_store import EmbeddingStore
+from demogui.fused_pipeline import score_and_embed_album
+from demogui.incremental_cluster import IncrementalClusterer
+from demogui.model_registry import ModelRegistry
+from demogui.phash import NEAR_DUPLICATE_DISTANCE, NearDuplicateGrouper, PerceptualHashIndex
+from demogui.result_cache import DEFAULT_CACHE_DIRECTORY, ResultCache
+from demogui.utils import PREPROCESS_PARAMS, cluster_radius_graph, radius_graph_from_pairs, scan_image_files
+
+DECLUTTER_MODEL_FILE_PATH = './resnet34_feature_extractor.nef'
+PHOTO_QUALITY_SCORER_PATH = './photo_scorer_520.nef'
+LOW_QUALITY_THRESHOLD = 0.5
+KEEP_PER_CLUSTER = 2
+SIMILARITY_THRESHOLD = 0.8
+EMBEDDING_DTYPE = 'int8'
+PLACEMENT_MODES = ['copy', 'hardlink', 'symlink', 'reflink', 'manifest']
+DEFAULT_MANIFEST_NAME = 'declutter_manifest.json'
+PLACEMENT_WORKERS = 8
+MANIFEST_VERSION = 1
+FICLONE = 0x40049409  # Linux ioctl that shares a file's extents (Btrfs, XFS, bcachefs)
+
+
+def declutter_photo_album(input_directory, to_keep_directory, to_delete_directory, log=print,
+                          cache_directory=DEFAULT_CACHE_DIRECTORY, known_results=None, on_record=None,
+                          placement='copy', manifest_path=None, duplicate_distance=NEAR_DUPLICATE_DISTANCE,
+                          embedding_dtype=EMBEDDING_DTYPE):
+    """Sort the photos of input_directory into to_keep_directory and to_delete_directory.
+
+    Photos in subfolders are included and placed under the same relative path; the output
+    directories are skipped if they lie inside input_directory. Low-quality photos go to the
+    delete directory; near-duplicates are grouped into cluster_<n> folders there, and the best
+    KEEP_PER_CLUSTER of each cluster are kept.
+    Photos are compared by the full embedding of the feature extractor, kept quantized to
+    embedding_dtype ('int8' or 'float16') in the on-disk EmbeddingStore; the similarity search runs
+    on the stored rows and no embedding is held in memory. known_results maps image path ->
+    (score, digest) from an earlier run, digest being the content digest its embedding is stored
+    under; those images are not scored again unless their embedding has gone from the store.
+    on_record, if given, receives a dict for every scored image, every cluster and every file
+    placed, in the order they happen.
+
+    placement is one of PLACEMENT_MODES and decides how photos land in the output directories; see
+    PhotoPlacer. manifest_path, if given, receives every decision as JSON or CSV (by extension).
+
+    Before any dongle is involved, photos whose perceptual hashes differ in at most
+    duplicate_distance bits are grouped, and only the first photo of each group is embedded; the
+    others share its feature but still get their own quality score, so the sharpest shot of a burst
+    is the one kept. Pass duplicate_distance=None to embed every photo.
+    To keep sorting an album as photos are added to it, use IncrementalDeclutter.
+    """
+    if placement not in PLACEMENT_MODES:
+        raise ValueError(f"unknown placement {placement!r}, expected one of {PLACEMENT_MODES}")
+    known_results = known_results or {}
+
+    def emit(record):
+        if on_record is not None:
+            on_record(record)
+
+    # Ensure output directories exist
+    os.makedirs(input_directory, exist_ok=True)
+    os.makedirs(to_keep_directory, exist_ok=True)
+    os.makedirs(to_delete_directory, exist_ok=True)
+
+    # The embeddings stay in the store; results maps path -> (score, store row)
+    feature_cache = EmbeddingStore(cache_directory, DECLUTTER_MODEL_FILE_PATH, preprocess_params=PREPROCESS_PARAMS,
+                                   dtype=embedding_dtype, log=log)
+
+    # The album is walked lazily: scoring starts on the first photos found while the rest are listed
+    images = []
+    results = {}
+    stat_results = {}
+
+    with feature_cache:
+        photos = scan_image_files(input_directory, exclude=[to_keep_directory, to_delete_directory], log=log)
+        pending = _unscored_photos(photos, known_results, feature_cache, images, results, stat_results)
+        first_pending = next(pending, None)
+        if first_pending is not None:
+            pending = itertools.chain([first_pending], pending)
+
+            # Only new or modified images are sent to the dongles; everything else comes from the cache
+            quality_cache = ResultCache(cache_directory, PHOTO_QUALITY_SCORER_PATH,
+                                        preprocess_params=PREPROCESS_PARAMS, log=log)
+
+            # Connect every plugged-in dongle and spread the work across them
+            device_pool = _connect_devices(log)
+            if device_pool is None:
+                return False
+            hash_index = PerceptualHashIndex(cache_directory) if duplicate_distance is not None else None
+            grouper = NearDuplicateGrouper(duplicate_distance) if duplicate_distance is not None else None
+            with device_pool, quality_cache, hash_index or contextlib.nullcontext():
+                _score_photos(pending, ModelRegistry(device_pool, log=log), quality_cache, feature_cache, results,
+                              stat_results, log, emit, hash_index, grouper)
+        if len(images) > len(stat_results):
+            log(f"Resumed: {len(images) - len(stat_results)} of {len(images)} images were already scored")
+        if len(results) < len(images):
+            log(f"{len(images) - len(results)} images could not be read and stay where they are")
+            images = [image_file_path for image_file_path in images if image_file_path in results]
+
+        if placement == 'manifest' and manifest_path is None:
+            manifest_path = os.path.join(to_keep_directory, DEFAULT_MANIFEST_NAME)
+        with PhotoPlacer(placement, emit, input_directory=input_directory, log=log) as placer:
+            organize_photo_album(images, results, to_keep_directory, to_delete_directory, log, placer=placer,
+                                 feature_cache=feature_cache)
+        # rows of photos deleted or modified since an earlier run are no longer needed
+        feature_cache.compact(images)
+    if manifest_path is not None:
+        placer.write_manifest(manifest_path, input_directory)
+        log(f"Decisions written to {manifest_path}")
+    return True
+
+
+class IncrementalDeclutter:
+    """Keeps an album sorted while photos are added to it, doing work only for the new photos.
+
+    add() scores and embeds the photos it is given, adds the ones of good quality to an
+    IncrementalClusterer and then places only what changed: the new photos, and older ones whose
+    cluster grew, merged or got a new best photo. A placement that no longer applies is removed.
+    Cluster folders are named cluster_<id> after the clusterer's cluster ids, which stay the same
+    as a cluster grows, so files in them never end up under another cluster's name. The dongles
+    and caches stay open between calls until close(). The other arguments are those of
+    declutter_photo_album; the manifest, if any, is rewritten after every add().
+    """
+
+    def __init__(self, input_directory, to_keep_directory, to_delete_directory, log=print,
+                 cache_directory=DEFAULT_CACHE_DIRECTORY, on_record=None, placement='copy', manifest_path=None,
+                 duplicate_distance=NEAR_DUPLICATE_DISTANCE, embedding_dtype=EMBEDDING_DTYPE):
+        if placement not in PLACEMENT_MODES:
+            raise ValueError(f"unknown placement {placement!r}, expected one of {PLACEMENT_MODES}")
+        os.makedirs(to_keep_directory, exist_ok=True)
+        os.makedirs(to_delete_directory, exist_ok=True)
+        self.input_directory = input_directory
+        self.to_keep_directory = to_keep_directory
+        self.to_delete_directory = to_delete_directory
+        self.log = log
+        self.cache_directory = cache_directory
+        self.on_record = on_record
+        if placement == 'manifest' and manifest_path is None:
+            manifest_path = os.path.join(to_keep_directory, DEFAULT_MANIFEST_NAME)
+        self.manifest_path = manifest_path
+        self.placer = PhotoPlacer(placement, self._emit, input_directory=input_directory, log=log)
+        self.feature_cache = EmbeddingStore(cache_directory, DECLUTTER_MODEL_FILE_PATH,
+                                            preprocess_params=PREPROCESS_PARAMS, dtype=embedding_dtype, log=log)
+        self.quality_cache = ResultCache(cache_directory, PHOTO_QUALITY_SCORER_PATH,
+                                         preprocess_params=PREPROCESS_PARAMS, log=log)
+        self.hash_index = None
+        self.grouper = None
+        if duplicate_distance is not None:
+            self.hash_index = PerceptualHashIndex(cache_directory)
+            self.grouper = NearDuplicateGrouper(duplicate_distance)
+        self.device_pool = None
+        self.model_registry = None
+        self.clusterer = IncrementalClusterer(SIMILARITY_THRESHOLD)
+        self.results = {}  # path -> (score, store row)
+        self.clusters = {}  # cluster id -> paths
+        self.placements = {}  # destination -> (path, directory, action, cluster id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _emit(self, record):
+        if self.on_record is not None:
+            self.on_record(record)
+
+    def add(self, photos, known_results=None):
+        """Sort in photos, an iterable of (image_file_path, stat_result) such as ImageDirectoryWatcher.scan() or poll().
+
+        Photos already added are skipped; known_results is as for declutter_photo_album. Returns
+        False if photos needed scoring and no dongle could be connected.
+        """
+        images = []
+        stat_results = {}
+        photos = ((image_file_path, stat_result) for image_file_path, stat_result in photos
+                  if image_file_path not in self.results)
+        pending = _unscored_photos(photos, known_results or {}, self.feature_cache, images, self.results,
+                                   stat_results)
+        first_pending = next(pending, None)
+        if first_pending is not None:
+            if self.device_pool is None:
+                self.device_pool = _connect_devices(self.log)
+                if self.device_pool is None:
+                    return False
+                self.model_registry = ModelRegistry(self.device_pool, log=self.log)
+            _score_photos(itertools.chain([first_pending], pending), self.model_registry, self.quality_cache,
+                          self.feature_cache, self.results, stat_results, self.log, self._emit, self.hash_index,
+                          self.grouper)
+            self.flush()
+
+        # only the new photos are compared, against each other and the album so far
+        to_cluster = [image_file_path for image_file_path in images
+                      if image_file_path in self.results and self.results[image_file_path][0] <= LOW_QUALITY_THRESHOLD]
+        if to_cluster:
+            rows = [self.results[image_file_path][1] for image_file_path in to_cluster]
+            with tracing.span('declutter.cluster_new'):
+                self.clusterer.add(to_cluster, normalized=self.feature_cache.values[rows],
+                                   row_scales=self.feature_cache.scales[rows])
+        self._place_changes()
+        return True
+
+    def _place_changes(self):
+        clusters = {}
+        for image_file_path, cluster_id in zip(self.clusterer.image_paths, self.clusterer.cluster_ids().tolist()):
+            if cluster_id != -1:
+                clusters.setdefault(cluster_id, []).append(image_file_path)
+        clustered = set(image_file_path for cluster in clusters.values() for image_file_path in cluster)
+
+        placements = {}
+
+        def decide(image_file_path, directory, action, cluster_id=None):
+            placements[self.placer.destination(image_file_path, directory)] = (image_file_path, directory, action,
+                                                                               cluster_id)
+
+        for image_file_path, (score, _) in self.results.items():
+            if score > LOW_QUALITY_THRESHOLD:
+                decide(image_file_path, self.to_delete_directory, 'low_quality')
+            elif image_file_path not in clustered:
+                decide(image_file_path, self.to_keep_directory, 'keep')
+        for cluster_id, cluster in clusters.items():
+            cluster_dir = os.path.join(self.to_delete_directory, f"cluster_{cluster_id}")
+            for image_file_path in cluster:
+                decide(image_file_path, cluster_dir, 'duplicate', cluster_id)
+            for image_file_path in best_in_cluster(cluster, self.results):
+                decide(image_file_path, self.to_keep_directory, 'keep', cluster_id)
+
+        for cluster_id, cluster in clusters.items():
+            if self.clusters.get(cluster_id) != cluster:
+                self.log(f"Cluster #{cluster_id}: {len(cluster)} photos")
+                self.placer.emit_record({'type': 'cluster', 'cluster': cluster_id, 'paths': list(cluster)})
+        removed = [(placement[0], destination) for destination, placement in self.placements.items()
+                   if destination not in placements]
+        for image_file_path, destination_path in removed:
+            self.placer.remove(image_file_path, destination_path)
+        changed = [placement for destination, placement in placements.items()
+                   if self.placements.get(destination) != placement]
+        for image_file_path, directory, action, cluster_id in changed:
+            self.placer.place(image_file_path, directory, action, cluster_id)
+        self.placer.flush()
+        self.clusters = clusters
+        self.placements = placements
+        self.log(f"Placed {len(changed)} and removed {len(removed)} photos")
+        if self.manifest_path is not None:
+            self.placer.write_manifest(self.manifest_path, self.input_directory)
+
+    def compact(self):
+        """Drop the stored embeddings of photos that are not part of the album added so far."""
+        new_rows = self.feature_cache.compact(self.results)
+        if new_rows is not None:
+            self.results = {image_file_path: (score, None if row is None else int(new_rows[row]))
+                            for image_file_path, (score, row) in self.results.items()}
+
+    def flush(self):
+        """Write the caches to disk, so an interruption loses no scored photo."""
+        self.quality_cache.flush()
+        self.feature_cache.flush()
+        if self.hash_index is not None:
+            self.hash_index.flush()
+
+    def close(self):
+        try:
+            self.placer.close()
+        finally:
+            if self.device_pool is not None:
+                self.device_pool.close()
+            self.quality_cache.close()
+            self.feature_cache.close()
+            if self.hash_index is not None:
+                self.hash_index.close()
+
+
+def _unscored_photos(photos, known_results, feature_cache, images, results, stat_results):
+    """Yield the paths of (image_file_path, stat_result) photos that need scoring.
+
+    Every path is appended to images. A photo in known_results whose embedding is still in
+    feature_cache goes straight into results instead; the others have their stat result recorded.
+    """
+    for image_file_path, stat_result in photos:
+        images.append(image_file_path)
+        known = known_results.get(image_file_path)
+        row = feature_cache.rows.get(known[1]) if known is not None else None
+        if row is not None:
+            results[image_file_path] = (known[0], row)
+        else:
+            stat_results[image_file_path] = stat_result
+            yield image_file_path
+
+
+def _connect_devices(log):
+    """A DevicePool of every plugged-in dongle, or None (after logging why) if there is none."""
+    log("CONNECTING DEVICE")
+    try:
+        device_pool = DevicePool(log=log)
+    except RuntimeError as e:
+        log(str(e))
+        return None
+    for device in device_pool.devices:
+        log(f"Device connected at USB port ID: {device.usb_port_id}")
+    return device_pool
+
+
+def _score_photos(pending, model_registry, quality_cache, feature_cache, results, stat_results, log, emit,
+                  hash_index=None, grouper=None):
+    """Score and embed the pending photos into results as (score, store row), emitting an 'image' record each.
+
+    With a hash_index and a NearDuplicateGrouper, a photo close to one the grouper has seen before
+    only goes through the quality model and shares the store row of that representative.
+    """
+    duplicates = {}  # near-identical photo -> the representative embedded in its place
+    if hash_index is not None:
+        def representatives(image_file_paths):
+            for image_file_path, hash_value in hash_index.hash_images(image_file_paths, stat_results):
+                representative = image_file_path if hash_value is None else grouper.add(image_file_path, hash_value)
+                if representative != image_file_path:
+                    duplicates[image_file_path] = representative
+                yield image_file_path
+
+        pending = representatives(pending)
+
+    # Score and embed every image in one decode pass; the embeddings go straight to the store.
+    # Near-identical photos only need the quality model.
+    log("FILTERING LOW QUALITY IMAGES")
+    with tracing.span('declutter.score_and_embed'):
+        for image_file_path, score, _ in score_and_embed_album(pending, model_registry, PHOTO_QUALITY_SCORER_PATH,
+                                                               DECLUTTER_MODEL_FILE_PATH, quality_cache,
+                                                               feature_cache, stat_results, duplicates.__contains__):
+            log(f"Image: {image_file_path}, Score: {score}")
+            if score > LOW_QUALITY_THRESHOLD:
+                log("     Low quality: recommend to delete")
+            else:
+                log("     Accepted quality image")
+            if image_file_path in duplicates:
+                results[image_file_path] = (score, None)
+                continue
+            digest = feature_cache.digest(image_file_path, stat_results.get(image_file_path))
+            results[image_file_path] = (score, feature_cache.rows[digest])
+            emit({'type': 'image', 'path': image_file_path, 'score': score, 'digest': digest})
+
+    if duplicates:
+        log(f"{len(duplicates)} near-identical photos share the feature of the photo they duplicate")
+    for image_file_path, representative in duplicates.items():
+        # the representative may finish after its duplicates, so their rows are filled in last
+        if image_file_path not in results or representative not in results:
+            # one of the two could not be decoded, so there is no embedding to share
+            results.pop(image_file_path, None)
+            continue
+        score = results[image_file_path][0]
+        results[image_file_path] = (score, results[representative][1])
+        emit({'type': 'image', 'path': image_file_path, 'score': score,
+              'digest': feature_cache.digest(representative, stat_results.get(representative)),
+              'duplicate_of': representative})
+
+
+def reflink_file(source_path, destination_path):
+    """Clone source_path into a copy-on-write file sharing its data blocks.
+
+    Raises OSError where the platform or filesystem cannot clone; callers fall back to copying.
+    """
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            try:
+                fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+            except OSError:
+                destination.close()
+                os.remove(destination_path)
+                raise
+    elif sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(source_path), os.fsencode(destination_path), 0) != 0:
+            raise OSError(ctypes.get_errno(), "clonefile failed", source_path)
+    else:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform", source_path)
+    shutil.copystat(source_path, destination_path)
+
+
+class PhotoPlacer:
+    """Puts photos into the output directories according to a placement mode.
+
+    copy duplicates the file, hardlink and symlink only add a directory entry, reflink makes a
+    copy-on-write clone, and manifest touches no files at all and only records the decision.
+    A hardlink across filesystems or a reflink on a filesystem without cloning falls back to a
+    copy, with one warning sent to log. An existing destination from an earlier run is replaced
+    whatever mode created it. File operations run on a thread pool so copies overlap; emit receives
+    one 'placed' record per photo once it is in place, and one 'removed' record per remove(), in the
+    order they were called.
+    """
+
+    def __init__(self, placement='copy', emit=None, max_workers=PLACEMENT_WORKERS, input_directory=None, log=print):
+        self.placement = placement
+        self.input_directory = input_directory
+        self.emit = emit
+        self.log = log
+        self.max_workers = max_workers
+        self.decisions = {}  # destination -> 'placed' record
+        self.pending = []
+        self.fallback_warned = False
+        self.executor = None
+        if placement != 'manifest':
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='place')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _fall_back_to_copy(self, image_file_path, destination_path, error):
+        if not self.fallback_warned:
+            self.fallback_warned = True
+            self.log(f"Warning: {self.placement} is not possible for {image_file_path} ({error}); copying instead")
+        shutil.copy(image_file_path, destination_path)
+
+    def _place_file(self, image_file_path, destination_path):
+        if os.path.abspath(destination_path) == os.path.abspath(image_file_path):
+            return
+        if os.path.lexists(destination_path):
+            # an earlier run may have left a link to the photo itself there, which copying onto would
+            # fail on (or write through a symlink); links and clones need the name free anyway
+            os.remove(destination_path)
+        os.makedirs(os.path.dirname(destination_path) or '.', exist_ok=True)
+        with tracing.span(f'place.{self.placement}'):
+            if self.placement == 'copy':
+                shutil.copy(image_file_path, destination_path)
+            elif self.placement == 'symlink':
+                os.symlink(os.path.abspath(image_file_path), destination_path)
+            elif self.placement == 'hardlink':
+                try:
+                    os.link(image_file_path, destination_path)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    self._fall_back_to_copy(image_file_path, destination_path, e)
+            else:
+                try:
+                    reflink_file(image_file_path, destination_path)
+                except OSError as e:
+                    self._fall_back_to_copy(image_file_path, destination_path, e)
+
+    def _remove_file(self, image_file_path, destination_path):
+        if os.path.abspath(destination_path) != os.path.abspath(image_file_path) and os.path.lexists(destination_path):
+            os.remove(destination_path)
+
+    def destination(self, image_file_path, directory):
+        """Where place() puts image_file_path in directory."""
+        if self.input_directory is None:
+            return os.path.join(directory, os.path.basename(image_file_path))
+        return os.path.join(directory, os.path.relpath(image_file_path, self.input_directory))
+
+    def place(self, image_file_path, directory, action, cluster_index=None):
+        destination_path = self.destination(image_file_path, directory)
+        record = {'type': 'placed', 'path': image_file_path, 'action': action, 'cluster': cluster_index,
+                  'destination': destination_path}
+        self.decisions[destination_path] = record
+        self._submit(self._place_file, image_file_path, destination_path, record)
+
+    def remove(self, image_file_path, destination_path):
+        """Take back an earlier placement of image_file_path, deleting what it put at destination_path."""
+        self.decisions.pop(destination_path, None)
+        record = {'type': 'removed', 'path': image_file_path, 'destination': destination_path}
+        self._submit(self._remove_file, image_file_path, destination_path, record)
+
+    def _submit(self, operation, image_file_path, destination_path, record):
+        if self.executor is None:
+            self._emit(record)
+            return
+        self.pending.append((self.executor.submit(operation, image_file_path, destination_path), record))
+        if len(self.pending) >= 4 * self.max_workers:
+            self._drain(len(self.pending) // 2)
+
+    def emit_record(self, record):
+        """Emit a record other than 'placed' after the placements requested before it."""
+        if self.executor is None:
+            self._emit(record)
+        else:
+            self.pending.append((None, record))
+
+    def _emit(self, record):
+        if self.emit is not None:
+            self.emit(record)
+
+    def _drain(self, count=None):
+        count = len(self.pending) if count is None else count
+        done, self.pending = self.pending[:count], self.pending[count:]
+        for future, record in done:
+            if future is not None:
+                future.result()
+            self._emit(record)
+
+    def flush(self):
+        """Wait until every placement requested so far is done and its record emitted."""
+        self._drain()
+
+    def close(self):
+        if self.executor is None:
+            return
+        try:
+            self._drain()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def write_manifest(self, manifest_path, input_directory=None):
+        """Write every decision so far to manifest_path, as CSV if it ends in .csv and JSON otherwise."""
+        columns = ['path', 'action', 'cluster', 'destination']
+        if manifest_path.lower().endswith('.csv'):
+            with open(manifest_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(self.decisions.values())
+            return
+        manifest = {'version': MANIFEST_VERSION, 'input_directory': input_directory, 'placement': self.placement,
+                    'decisions': [{column: record[column] for column in columns} for record in self.decisions.values()]}
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+
+def best_in_cluster(cluster, results, keep=KEEP_PER_CLUSTER):
+    """The keep best-quality photos of a cluster, from the quality scores already stored in results.
+
+    Lower scores are better (above LOW_QUALITY_THRESHOLD is low quality); ties keep scan order.
+    """
+    return sorted(cluster, key=lambda image_file_path: results[image_file_path][0])[:keep]
+
+
+@tracing.traced('declutter.organize')
+def organize_photo_album(images, results, to_keep_directory, to_delete_directory, log=print, emit=None, placer=None,
+                         feature_cache=None):
+    """Place scored images into the keep/delete directories; results maps path -> (score, row).
+
+    row is the photo's row in feature_cache, the EmbeddingStore whose quantized rows the similarity
+    search runs on. Photos are copied unless a PhotoPlacer with another placement mode is passed.
+    """
+    if placer is None:
+        with PhotoPlacer('copy', emit, log=log) as placer:
+            return organize_photo_album(images, results, to_keep_directory, to_delete_directory, log, placer=placer,
+                                        feature_cache=feature_cache)
+    place = placer.place
+
+    to_keep_images = []
+    for image_file_path in images:
+        if results[image_file_path][0] > LOW_QUALITY_THRESHOLD:
+            place(image_file_path, to_delete_directory, 'low_quality')
+        else:
+            to_keep_images.append(image_file_path)
+
+    # Compare photo similarity
+    log("COMPARING PHOTO SIMILARITY")
+    images = to_keep_images
+    clusters = []
+    if images:
+        store_rows = [results[image_file_path][1] for image_file_path in images]
+        rows, cols, similarities = feature_cache.similar_pairs(store_rows, SIMILARITY_THRESHOLD)
+        graph = radius_graph_from_pairs(len(images), rows, cols, similarities)
+        clusters = cluster_radius_graph(images, graph, SIMILARITY_THRESHOLD)
+
+    # Organize clustered images into directories
+    for cluster_index, cluster in enumerate(clusters):
+        cluster_dir = os.path.join(to_delete_directory, f"cluster_{cluster_index}")
+        if placer.placement != 'manifest':
+            os.makedirs(cluster_dir, exist_ok=True)
+        log(f"Cluster #{cluster_index}")
+        placer.emit_record({'type': 'cluster', 'cluster': cluster_index, 'paths': list(cluster)})
+        for image_file_path in cluster:
+            log(image_file_path)
+            place(image_file_path, cluster_dir, 'duplicate', cluster_index)
+
+    # Move images not in any cluster to 'to_keep' directory
+    clustered = set(img for cluster in clusters for img in cluster)
+    for image_file_path in images:
+        if image_file_path not in clustered:
+            place(image_file_path, to_keep_directory, 'keep')
+
+    # Decide which photos to keep in clusters
+    log("DECIDING WHICH PHOTO TO KEEP")
+    for cluster_index, cluster in enumerate(clusters):
+        log(f"In cluster {cluster_index}")
+        for image_file_path in best_in_cluster(cluster, results):
+            log(f"Keep image: {image_file_path}")
+            place(image_file_path, to_keep_directory, 'keep', cluster_index)
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from demogui import tracing
+from demogui.declutter import EMBEDDING_DTYPE, PLACEMENT_MODES, IncrementalDeclutter, declutter_photo_album
+from demogui.embedding_store import EMBEDDING_DTYPES
+from demogui.phash import NEAR_DUPLICATE_DISTANCE
+from demogui.result_cache import DEFAULT_CACHE_DIRECTORY
+from demogui.utils import WATCH_INTERVAL, ImageDirectoryWatcher
+
+CHECKPOINT_EVERY = 500
+CHECKPOINT_SECONDS = 30.0
+CHECKPOINT_VERSION = 2
+
+
+class JsonLinesJournal:
+    """Streams declutter records as JSON Lines and checkpoints how far the run got.
+
+    The output file doubles as the journal: a checkpoint stores the byte offset of the last
+    complete, synced record together with the run phase. Resuming truncates anything written after
+    that offset and reloads the scored images from the records before it, so an interrupted run
+    only re-scores the images of its last checkpoint interval. Image records carry the score and
+    the content digest the embedding is stored under, not the embedding itself, which the next run
+    reads back from the embedding store.
+    """
+
+    def __init__(self, output_path, checkpoint_path=None, input_directory=None, checkpoint_every=CHECKPOINT_EVERY,
+                 checkpoint_seconds=CHECKPOINT_SECONDS, resume=True):
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path
+        self.input_directory = input_directory
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self.phase = 'scoring'
+        self.known_results = {}
+        self.since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+        if output_path == '-':
+            self.file = sys.stdout
+            return
+        state = self._read_checkpoint() if resume else None
+        if state is None:
+            self.file = open(output_path, 'w', encoding='utf-8')
+            return
+        self.file = open(output_path, 'r+', encoding='utf-8')
+        self.file.truncate(state['offset'])
+        self.phase = state['phase']
+        for line in self.file:
+            record = json.loads(line)
+            if record.get('type') == 'image':
+                self.known_results[record['path']] = (record['score'], record['digest'])
+        self.file.seek(state['offset'])
+
+    def _read_checkpoint(self):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return None
+        if not os.path.exists(self.output_path):
+            raise ValueError(f"checkpoint {self.checkpoint_path} exists but its output {self.output_path} is missing")
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f"unsupported checkpoint version in {self.checkpoint_path}")
+        if state['input_directory'] != self.input_directory:
+            raise ValueError(f"checkpoint {self.checkpoint_path} belongs to {state['input_directory']}, "
+                             f"not {self.input_directory}")
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        if record['type'] == 'image':
+            self.since_checkpoint += 1
+            if (self.since_checkpoint >= self.checkpoint_every
+                    or time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds):
+                self.checkpoint()
+
+    def checkpoint(self, phase=None):
+        """Sync the records written so far and atomically record their end offset."""
+        if phase is not None:
+            self.phase = phase
+        self.since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+        if self.checkpoint_path is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        state = {'version': CHECKPOINT_VERSION, 'input_directory': self.input_directory, 'phase': self.phase,
+                 'offset': self.file.tell(), 'images': len(self.known_results)}
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        if self.file is not sys.stdout and not self.file.closed:
+            self.file.close()
+
+
+def _raise_on_sigterm(signum, frame):
+    # systemd stops services with SIGTERM; unwind normally so caches and the checkpoint are written
+    raise SystemExit(128 + signum)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Declutter a photo album on Kneron dongles without a display.")
+    parser.add_argument('input_directory', help="directory with the photos to sort")
+    parser.add_argument('to_keep_directory', help="directory that receives the photos worth keeping")
+    parser.add_argument('to_delete_directory', help="directory that receives low-quality photos and duplicates")
+    parser.add_argument('-o', '--output', default='-',
+                        help="JSON Lines file for per-image results, '-' for stdout (default)")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: <output>.checkpoint when --output is a file)")
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY,
+                        help=f"checkpoint after this many newly scored images (default {CHECKPOINT_EVERY})")
+    parser.add_argument('--checkpoint-seconds', type=float, default=CHECKPOINT_SECONDS,
+                        help=f"checkpoint at least this often while scoring (default {CHECKPOINT_SECONDS:g})")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint and start over")
+    parser.add_argument('--placement', choices=PLACEMENT_MODES, default='copy',
+                        help="how photos land in the output directories: copies (default), hard or symbolic "
+                             "links, copy-on-write clones, or not at all with only a manifest written")
+    parser.add_argument('--manifest', help="write every placement decision here as JSON, or CSV if it ends in .csv "
+                                           "(default for --placement manifest: <to_keep>/declutter_manifest.json)")
+    parser.add_argument('--duplicate-distance', type=int, default=NEAR_DUPLICATE_DISTANCE,
+                        help="photos whose perceptual hashes differ in at most this many of 64 bits are embedded once "
+                             f"per group (default {NEAR_DUPLICATE_DISTANCE}, 0 for exact matches only)")
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help="embed every photo on the dongles, even near-identical ones")
+    parser.add_argument('--embedding-dtype', choices=sorted(EMBEDDING_DTYPES), default=EMBEDDING_DTYPE,
+                        help=f"storage and similarity precision of the photo embeddings (default {EMBEDDING_DTYPE})")
+    parser.add_argument('--watch', action='store_true',
+                        help="after sorting, keep watching the input directory and sort in photos as they are added")
+    parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL,
+                        help=f"seconds between looks at the input directory in --watch mode "
+                             f"(default {WATCH_INTERVAL:g})")
+    parser.add_argument('--cache-directory', default=DEFAULT_CACHE_DIRECTORY, help="result cache directory")
+    parser.add_argument('--trace', metavar='TRACE_JSON',
+                        help="record per-stage spans and write a Chrome trace here, plus <name>.summary.json")
+    parser.add_argument('-q', '--quiet', action='store_true', help="do not log progress to stderr")
+    args = parser.parse_args(argv)
+    if args.output == '-':
+        if args.checkpoint:
+            parser.error("--checkpoint needs --output to be a file")
+    elif args.checkpoint is None:
+        args.checkpoint = args.output + '.checkpoint'
+    if args.duplicate_distance < 0:
+        parser.error("--duplicate-distance must not be negative")
+    if args.checkpoint_every < 1:
+        parser.error("--checkpoint-every must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    signal.signal(signal.SIGTERM, _raise_on_sigterm)
+
+    def log(message):
+        # one write per line, so messages from placement workers do not interleave
+        if not args.quiet:
+            sys.stderr.write(f"{message}\n")
+            sys.stderr.flush()
+
+    input_directory = os.path.abspath(args.input_directory)
+    try:
+        journal = JsonLinesJournal(args.output, args.checkpoint, input_directory, args.checkpoint_every,
+                                   args.checkpoint_seconds, resume=not args.restart)
+    except (OSError, ValueError) as e:
+        log(f"Error: {e}")
+        return 2
+
+    if args.trace:
+        tracing.enable()
+    try:
+        return _run(args, journal, input_directory, log)
+    finally:
+        if args.trace:
+            tracing.write_chrome_trace(args.trace)
+            tracing.write_summary(os.path.splitext(args.trace)[0] + '.summary.json')
+            log(tracing.format_summary())
+
+
+def _run(args, journal, input_directory, log):
+    with journal:
+        if journal.phase == 'done' and not args.watch:
+            log(f"{args.output} is already complete; use --restart to run again")
+            return 0
+
+        def on_record(record):
+            if record['type'] == 'image':
+                journal.known_results[record['path']] = (record['score'], record['digest'])
+            elif journal.phase == 'scoring':
+                # Scoring is over once placement starts; a resumed run redoes placement from here
+                journal.checkpoint('organizing')
+            journal.write(record)
+
+        if args.watch:
+            return _watch(args, journal, input_directory, log, on_record)
+        try:
+            completed = declutter_photo_album(input_directory, args.to_keep_directory, args.to_delete_directory,
+                                              log=log, cache_directory=args.cache_directory,
+                                              known_results=journal.known_results, on_record=on_record,
+                                              placement=args.placement, manifest_path=args.manifest,
+                                              duplicate_distance=None if args.no_prefilter else args.duplicate_distance,
+                                              embedding_dtype=args.embedding_dtype)
+        except (KeyboardInterrupt, SystemExit):
+            _interrupted(journal, log)
+            raise
+        if not completed:
+            return 1
+        _finished(journal)
+    return 0
+
+
+def _interrupted(journal, log):
+    if journal.phase == 'scoring':
+        journal.checkpoint()
+    log(f"Interrupted; {len(journal.known_results)} images checkpointed")
+
+
+def _finished(journal):
+    journal.write({'type': 'done', 'images': len(journal.known_results)})
+    journal.checkpoint('done')
+
+
+def _watch(args, journal, input_directory, log, on_record):
+    """Sort the album, then sort in new photos whenever they have settled in it, until interrupted.
+
+    The first pass sorts the album as it is scanned; after that only the new photos are scored and
+    clustered, and only the placements they change are made.
+    """
+    watcher = ImageDirectoryWatcher(input_directory, exclude=[args.to_keep_directory, args.to_delete_directory],
+                                    log=log)
+    with IncrementalDeclutter(input_directory, args.to_keep_directory, args.to_delete_directory, log=log,
+                              cache_directory=args.cache_directory, on_record=on_record, placement=args.placement,
+                              manifest_path=args.manifest,
+                              duplicate_distance=None if args.no_prefilter else args.duplicate_distance,
+                              embedding_dtype=args.embedding_dtype) as sorter:
+        # photos added while the first pass runs are on disk before the scan reaches them or are polled after it
+        photos = watcher.scan()
+        first_pass = True
+        try:
+            while True:
+                journal.checkpoint('scoring')
+                try:
+                    if not sorter.add(photos, journal.known_results):
+                        return 1
+                except (KeyboardInterrupt, SystemExit):
+                    _interrupted(journal, log)
+                    raise
+                _finished(journal)
+                if first_pass:
+                    # later passes only add photos, so only the first finds rows of photos gone since the last run
+                    sorter.compact()
+                    first_pass = False
+                log(f"Watching {input_directory} for new photos")
+                photos = []
+                while not photos:
+                    time.sleep(args.watch_interval)
+                    photos = watcher.poll()
+                log(f"{len(photos)} new photos")
+        except KeyboardInterrupt:
+            log("Stopped watching")
+            return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
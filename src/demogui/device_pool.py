@@ -0,0 +1,271 @@
+import collections
+import os
+import queue
+import threading
+import kp
+from demogui.utils import (PREPROCESS_WORKERS, PreprocessPool, connect_device, first_output_value, model_preprocessor,
+                           perform_inference_pipelined)
+
+
+class PoolDevice:
+    """One connected dongle in a DevicePool, with its own work queue."""
+
+    def __init__(self, usb_port_id, product_id, kn_number, device_group):
+        self.usb_port_id = usb_port_id
+        self.product_id = product_id
+        self.kn_number = kn_number
+        self.device_group = device_group
+        self.model_nef_descriptor = None
+        self.model_path = None
+        self.work_queue = collections.deque()
+        self.completed = 0
+        self.stolen = 0
+
+    def __repr__(self):
+        return (f"PoolDevice(usb_port_id={self.usb_port_id}, product_id={hex(self.product_id)}, "
+                f"completed={self.completed})")
+
+
+class DevicePool:
+    """Connects every scanned dongle, loads the same NEF on each and spreads work across them.
+
+    Work is dealt round-robin into per-device queues. A device that drains its own queue steals
+    from the tail of the longest remaining queue, so a slow or busy stick never holds up the rest.
+    """
+
+    def __init__(self, usb_port_ids=None, timeout_ms=5000, devices=None, log=print):
+        self.devices = []
+        self.log = log
+        self.loaded_model_path = None
+        self.lock = threading.Lock()
+        if devices is not None:
+            # already-connected devices, e.g. from a background FirmwareLoader
+            self.devices = list(devices)
+            return
+
+        device_descriptors = kp.core.scan_devices()
+
+        connect_threads = []
+        for device in device_descriptors.device_descriptor_list:
+            if usb_port_ids is not None and device.usb_port_id not in usb_port_ids:
+                continue
+            thread = threading.Thread(target=self._connect, args=(device, timeout_ms))
+            thread.start()
+            connect_threads.append(thread)
+        for thread in connect_threads:
+            thread.join()
+
+        if not self.devices:
+            raise RuntimeError('Error: no Kneron device connected.')
+        self.devices.sort(key=lambda d: d.usb_port_id)
+
+    def _connect(self, device, timeout_ms):
+        try:
+            device_group = connect_device(device.usb_port_id, device.product_id, timeout_ms=timeout_ms)
+        except Exception as e:
+            self.log(f"Error: could not connect device at USB port ID {device.usb_port_id}: {e}")
+            return
+        with self.lock:
+            self.devices.append(PoolDevice(device.usb_port_id, device.product_id, device.kn_number, device_group))
+
+    def add_device(self, device):
+        """Add a connected PoolDevice, loading the pool's current model on it first."""
+        if self.loaded_model_path is not None:
+            device.model_nef_descriptor = kp.core.load_model_from_file(device_group=device.device_group,
+                                                                       file_path=self.loaded_model_path)
+            device.model_path = os.path.abspath(self.loaded_model_path)
+        with self.lock:
+            self.devices.append(device)
+            self.devices.sort(key=lambda d: d.usb_port_id)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for device in self.devices:
+            kp.core.disconnect_devices(device_group=device.device_group)
+        self.devices = []
+
+    def load_model(self, model_path):
+        """Load the same NEF on every device in parallel; returns the descriptor of the first device."""
+        errors = []
+
+        def load(device):
+            try:
+                device.model_path = None
+                device.model_nef_descriptor = kp.core.load_model_from_file(device_group=device.device_group,
+                                                                           file_path=model_path)
+                device.model_path = os.path.abspath(model_path)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load, args=(device,)) for device in self.devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        self.loaded_model_path = model_path
+        return self.devices[0].model_nef_descriptor
+
+    def _next_item(self, device):
+        with self.lock:
+            if device.work_queue:
+                return device.work_queue.popleft()
+            victim = max(self.devices, key=lambda d: len(d.work_queue))
+            if victim.work_queue:
+                device.stolen += 1
+                return victim.work_queue.pop()
+            return None
+
+    def _dispatch(self, items, device_worker, ordered, skipped=()):
+        """Deal items to the device queues and run device_worker(device, next_items) on a thread per device.
+
+        device_worker must yield (index, result) pairs; results are yielded here as they arrive,
+        or in input order when ordered=True. With items=None nothing is dealt and the workers are
+        expected to pull their work from a shared source. skipped holds indices that will never
+        produce a result, such as PreprocessPool.skipped, so ordered output does not wait for them.
+        """
+        with self.lock:
+            for device in self.devices:
+                device.work_queue.clear()
+            for index, item in enumerate(items or []):
+                self.devices[index % len(self.devices)].work_queue.append((index, item))
+
+        results = queue.Queue()
+        done = object()
+
+        def run(device):
+            def next_items():
+                while True:
+                    work = self._next_item(device)
+                    if work is None:
+                        return
+                    yield work
+
+            try:
+                for index, result in device_worker(device, next_items()):
+                    device.completed += 1
+                    results.put((index, result))
+            except Exception as e:
+                with self.lock:
+                    for other in self.devices:
+                        other.work_queue.clear()
+                results.put((done, e))
+                return
+            results.put((done, None))
+
+        threads = [threading.Thread(target=run, args=(device,), daemon=True) for device in self.devices]
+        for thread in threads:
+            thread.start()
+
+        running = len(threads)
+        error = None
+        next_index = 0
+        reorder_buffer = {}
+        try:
+            while running:
+                index, result = results.get()
+                if index is done:
+                    running -= 1
+                    error = error or result
+                    continue
+                if not ordered:
+                    yield index, result
+                    continue
+                reorder_buffer[index] = result
+                while next_index in reorder_buffer or next_index in skipped:
+                    if next_index in reorder_buffer:
+                        yield next_index, reorder_buffer.pop(next_index)
+                    next_index += 1
+            if error is not None:
+                raise error
+            # an index skipped after the last result came back leaves a gap the loop could not pass
+            for index in sorted(reorder_buffer):
+                yield index, reorder_buffer[index]
+        finally:
+            # stop handing out work if the caller stopped early, then let in-flight requests finish
+            with self.lock:
+                for device in self.devices:
+                    device.work_queue.clear()
+            for thread in threads:
+                thread.join()
+
+    def map(self, func, items, ordered=True):
+        """Run func(device, item) for every item across the pool; yields results."""
+        def device_worker(device, work):
+            for index, item in work:
+                yield index, func(device, item)
+
+        for _, result in self._dispatch(items, device_worker, ordered):
+            yield result
+
+    def infer_stream(self, source, preprocess=None, queue_depth=4, ordered=True, buffer_pool=None):
+        """Pool-wide perform_inference_pipelined over a shared source; yields (key, image, inf_node_output_list).
+
+        Every device pulls from source concurrently, so it must hand each item to exactly one
+        consumer, as PreprocessPool and VideoFrameReader do. Items are (index, key, image) with
+        indices counting up from 0. preprocess, if given, turns image into the BGR565 buffer to send
+        and runs on the device's sender thread; the image itself is handed back with its result.
+        """
+        def next_images(device):
+            for index, key, image in source:
+                img_bgr565 = image if preprocess is None else preprocess(image)
+                yield (index, key, image), img_bgr565
+
+        def device_worker(device, work):
+            for (index, key, image), inf_node_output_list in perform_inference_pipelined(
+                    device.device_group, device.model_nef_descriptor, next_images(device),
+                    queue_depth=queue_depth, device_resize=False, buffer_pool=buffer_pool, log=self.log):
+                yield index, (key, image, inf_node_output_list)
+
+        for _, result in self._dispatch(None, device_worker, ordered):
+            yield result
+
+    def process_images(self, image_file_paths, queue_depth=4, ordered=True, preprocess_workers=PREPROCESS_WORKERS):
+        """Pool-wide process_image: yields (image_file_path, number), pipelining requests on each device.
+
+        Images are resized on the host straight to the model input size and sent without device-side resize.
+
+        With preprocess_workers set, images are decoded by a shared PreprocessPool and every device
+        pulls ready buffers from its bounded queue. With preprocess_workers=None each device decodes
+        its own work on its sender thread and idle devices steal paths from busy ones.
+        """
+        image_file_paths = list(image_file_paths)
+        preprocess = model_preprocessor(self.devices[0].model_nef_descriptor)
+
+        if preprocess_workers:
+            preprocess_pool = PreprocessPool(image_file_paths, num_workers=preprocess_workers, preprocess=preprocess,
+                                             log=self.log)
+
+            def next_images(device, work):
+                for index, image_file_path, img_bgr565 in preprocess_pool:
+                    yield (index, image_file_path), img_bgr565
+        else:
+            preprocess_pool = None
+
+            def next_images(device, work):
+                for index, image_file_path in work:
+                    yield (index, image_file_path), preprocess(image_file_path)
+
+        def device_worker(device, work):
+            for (index, image_file_path), inf_node_output_list in perform_inference_pipelined(
+                    device.device_group, device.model_nef_descriptor, next_images(device, work),
+                    queue_depth=queue_depth, device_resize=False, log=self.log):
+                yield index, (image_file_path, first_output_value(inf_node_output_list))
+
+        try:
+            items = None if preprocess_pool is not None else image_file_paths
+            skipped = preprocess_pool.skipped if preprocess_pool is not None else ()
+            for _, result in self._dispatch(items, device_worker, ordered, skipped):
+                yield result
+        finally:
+            if preprocess_pool is not None:
+                preprocess_pool.close()
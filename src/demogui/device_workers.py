@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import kp
+from PyQt5.QtCore import QObject, pyqtSignal
+from demogui.declutter import declutter_photo_album
+from demogui.device_pool import PoolDevice
+from demogui.utils import connect_device
+
+
+class DeviceScanner(QObject):
+    """Runs kp.core.scan_devices off the GUI thread and reports the result through a signal."""
+
+    devices_scanned = pyqtSignal(list)
+    scan_failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def scan(self):
+        if self.is_running():
+            return
+        self.thread = threading.Thread(target=self._run, name="kp-scan", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            device_descriptors = kp.core.scan_devices()
+        except Exception as e:
+            self.scan_failed.emit(str(e))
+            return
+        if device_descriptors.device_descriptor_number > 0:
+            self.devices_scanned.emit(list(device_descriptors.device_descriptor_list))
+        else:
+            self.devices_scanned.emit([])
+
+
+class FirmwareLoader(QObject):
+    """Connects dongles and flashes their firmware in parallel, one worker per dongle.
+
+    Each device is reported through device_ready as soon as it is usable, so the caller does not
+    have to wait for the slowest stick. Given a ModelRegistry, the worker also adds each device to
+    the registry's DevicePool, which loads the pool's current model on it, and starts preloading
+    preload_paths, so the GUI thread never waits on a dongle.
+    """
+
+    device_ready = pyqtSignal(object)       # PoolDevice
+    device_failed = pyqtSignal(int, str)    # usb_port_id, error
+    progress = pyqtSignal(int, int)         # devices done, devices total
+    finished = pyqtSignal()
+
+    def __init__(self, parent=None, timeout_ms=5000):
+        super().__init__(parent)
+        self.timeout_ms = timeout_ms
+        self.thread = None
+
+    def load(self, device_descriptor_list, model_registry=None, preload_paths=()):
+        self.thread = threading.Thread(target=self._run, args=(list(device_descriptor_list), model_registry,
+                                                               list(preload_paths)),
+                                       name="kp-firmware", daemon=True)
+        self.thread.start()
+
+    def _run(self, device_descriptor_list, model_registry, preload_paths):
+        total = len(device_descriptor_list)
+        done = 0
+        lock = threading.Lock()
+
+        def load_one(device):
+            nonlocal done
+            try:
+                device_group = connect_device(device.usb_port_id, device.product_id, timeout_ms=self.timeout_ms)
+                pool_device = PoolDevice(device.usb_port_id, device.product_id, device.kn_number, device_group)
+                if model_registry is not None:
+                    model_registry.device_pool.add_device(pool_device)
+                    if preload_paths:
+                        model_registry.preload(preload_paths)
+                self.device_ready.emit(pool_device)
+            except Exception as e:
+                self.device_failed.emit(device.usb_port_id, str(e))
+            with lock:
+                done += 1
+                self.progress.emit(done, total)
+
+        if total:
+            with ThreadPoolExecutor(max_workers=total) as executor:
+                list(executor.map(load_one, device_descriptor_list))
+        self.finished.emit()
+
+
+class DeclutterWorker(QObject):
+    """Runs declutter_photo_album on a background thread and reports the outcome through signals.
+
+    log is called from the worker thread, so it must be thread-safe, e.g. a LogRingBuffer or QtLogSink.
+    """
+
+    finished = pyqtSignal(bool)   # True if the album was sorted
+    failed = pyqtSignal(str)
+
+    def __init__(self, log, parent=None):
+        super().__init__(parent)
+        self.log = log
+        self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, input_directory, to_keep_directory, to_delete_directory, **kwargs):
+        if self.is_running():
+            return
+        self.thread = threading.Thread(target=self._run, name="declutter", daemon=True,
+                                       args=(input_directory, to_keep_directory, to_delete_directory), kwargs=kwargs)
+        self.thread.start()
+
+    def _run(self, input_directory, to_keep_directory, to_delete_directory, **kwargs):
+        try:
+            completed = declutter_photo_album(input_directory, to_keep_directory, to_delete_directory, log=self.log,
+                                              **kwargs)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(completed)
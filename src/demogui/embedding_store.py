@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from demogui.result_cache import file_digest, model_identity
+from demogui.utils import SIMILARITY_BLOCK_SIZE, similar_pairs
+
+EMBEDDING_DTYPES = {'int8': np.int8, 'float16': np.float16}
+INITIAL_CAPACITY = 1024
+QUANTIZE_CHUNK = 8192
+COMPACT_DEAD_FRACTION = 0.25
+STORE_VERSION = 1
+
+
+def quantize_embeddings(features, dtype='int8'):
+    """Turn feature vectors into (values, row_scales): compact rows whose scaled dot products are cosine similarities.
+
+    int8 rows hold each vector scaled so its largest component is +-127; float16 rows hold the
+    L2-normalized vector. row_scales is the float32 inverse norm of each stored row, so
+    values[i] * row_scales[i] is the unit-length embedding. A zero vector gets scale 0 and is
+    similar to nothing.
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"unknown embedding dtype {dtype!r}, expected one of {sorted(EMBEDDING_DTYPES)}")
+    if len(features) > QUANTIZE_CHUNK:
+        # quantize a chunk at a time so a large album never exists as a float32 matrix
+        chunks = [quantize_embeddings(features[start:start + QUANTIZE_CHUNK], dtype)
+                  for start in range(0, len(features), QUANTIZE_CHUNK)]
+        return np.concatenate([values for values, _ in chunks]), np.concatenate([scales for _, scales in chunks])
+    matrix = np.asarray(features, dtype=np.float32)
+    matrix = matrix.reshape(len(matrix), -1)
+    if dtype == 'int8':
+        peaks = np.abs(matrix).max(axis=1, keepdims=True)
+        peaks[peaks == 0] = 1
+        values = np.rint(matrix * (127 / peaks)).astype(np.int8)
+    elif dtype == 'float16':
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        values = (matrix / norms).astype(np.float16)
+    norms = np.linalg.norm(values.astype(np.float32), axis=1)
+    row_scales = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+    return values, row_scales
+
+
+class EmbeddingStore:
+    """Memory-mapped matrix of quantized feature vectors, one row per image content.
+
+    The drop-in wide counterpart of ResultCache for feature extractors: get() and put() take the same
+    arguments, rows are keyed by image content hash, the NEF model identity and the preprocessing
+    parameters, and a path+size+mtime table skips re-hashing unchanged files. Rows are stored as int8
+    (1 byte per dimension, about 0.5 KiB for a 512-d ResNet34 embedding) or float16 plus one float32
+    scale, so millions of embeddings fit on disk and stream through the page cache. The matrix grows
+    by doubling; stale rows are overwritten when the same content is stored again, and compact()
+    drops the rows of photos that left the album or changed.
+    similar_pairs() runs the blocked similarity search directly on the stored rows. Statistics go to
+    log on close() when one is given.
+    """
+
+    def __init__(self, cache_directory, model_path, preprocess_params=None, dtype='int8', log=None):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"unknown embedding dtype {dtype!r}, expected one of {sorted(EMBEDDING_DTYPES)}")
+        params = json.dumps(preprocess_params or {}, sort_keys=True)
+        namespace = model_identity(model_path)[:16] + '_' + hashlib.blake2b(params.encode(), digest_size=8).hexdigest()
+        self.directory = os.path.join(cache_directory, namespace, f"embeddings_{dtype}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.dtype = dtype
+        self.log = log
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.dim = None
+        self.count = 0
+        self.capacity = 0
+        self.generation = 0  # bumped by compact(), which writes the matrix to new files
+        self.rows = {}  # digest -> row
+        self.stat_digests = {}  # path -> [size, mtime_ns, digest]
+        self.values = None
+        self.scales = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get('version') == STORE_VERSION:
+                self.dim, self.count, self.capacity = index['dim'], index['count'], index['capacity']
+                self.generation = index.get('generation', 0)
+                self.rows = index['rows']
+                self.stat_digests = index['stat_digests']
+        self.values_path, self.scales_path = self._paths(self.generation)
+        if self.dim is not None:
+            self._open('r+')
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _paths(self, generation):
+        suffix = f"_{generation}" if generation else ''
+        return (os.path.join(self.directory, f"values{suffix}.{self.dtype}"),
+                os.path.join(self.directory, f"scales{suffix}.f32"))
+
+    def _open(self, mode):
+        self.values = np.memmap(self.values_path, dtype=EMBEDDING_DTYPES[self.dtype], mode=mode,
+                                shape=(self.capacity, self.dim))
+        self.scales = np.memmap(self.scales_path, dtype=np.float32, mode=mode, shape=(self.capacity,))
+
+    def _grow(self, needed):
+        capacity = max(INITIAL_CAPACITY, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        if self.values is None:
+            self.capacity = capacity
+            self._open('w+')
+            return
+        self.values.flush()
+        self.scales.flush()
+        self.values = self.scales = None
+        itemsize = np.dtype(EMBEDDING_DTYPES[self.dtype]).itemsize
+        with open(self.values_path, 'r+b') as f:
+            f.truncate(capacity * self.dim * itemsize)
+        with open(self.scales_path, 'r+b') as f:
+            f.truncate(capacity * 4)
+        self.capacity = capacity
+        self._open('r+')
+
+    def digest(self, image_file_path, stat_result=None):
+        """Content digest of an image, reusing the stored one when path, size and mtime are unchanged."""
+        if stat_result is None:
+            stat_result = os.stat(image_file_path)
+        known = self.stat_digests.get(image_file_path)
+        if known is not None and known[0] == stat_result.st_size and known[1] == stat_result.st_mtime_ns:
+            return known[2]
+        digest = file_digest(image_file_path)
+        with self.lock:
+            self.stat_digests[image_file_path] = [stat_result.st_size, stat_result.st_mtime_ns, digest]
+        return digest
+
+    def row(self, image_file_path, stat_result=None):
+        """Row index of an image's embedding, or None if it is not stored."""
+        return self.rows.get(self.digest(image_file_path, stat_result))
+
+    def get(self, image_file_path, stat_result=None):
+        """Return the stored embedding of an image as a unit-length float32 vector, or None."""
+        row = self.row(image_file_path, stat_result)
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.values[row].astype(np.float32) * self.scales[row]
+
+    def put(self, image_file_path, values, stat_result=None):
+        """Quantize and store an image's embedding; returns its row."""
+        digest = self.digest(image_file_path, stat_result)
+        quantized, row_scales = quantize_embeddings([values], self.dtype)
+        with self.lock:
+            if self.dim is None:
+                self.dim = quantized.shape[1]
+            elif quantized.shape[1] != self.dim:
+                raise ValueError(f"expected {self.dim} values, got {quantized.shape[1]}")
+            row = self.rows.get(digest)
+            if row is None:
+                if self.count == self.capacity:
+                    self._grow(self.count + 1)
+                row = self.rows[digest] = self.count
+                self.count += 1
+            self.values[row] = quantized[0]
+            self.scales[row] = row_scales[0]
+        return row
+
+    def similar_pairs(self, rows, similarity_threshold, block_size=SIMILARITY_BLOCK_SIZE):
+        """utils.similar_pairs over the given rows, computed on the quantized values.
+
+        The returned indices refer to positions in rows.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.values is None:
+            return similar_pairs(np.zeros((0, 1), dtype=np.float32), similarity_threshold)
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            # consecutive rows, e.g. an album embedded in scan order: search the memmap in place
+            rows = slice(rows[0], rows[0] + len(rows))
+        return similar_pairs(None, similarity_threshold, block_size=block_size, normalized=self.values[rows],
+                             row_scales=self.scales[rows])
+
+    def compact(self, live_paths, dead_fraction=COMPACT_DEAD_FRACTION):
+        """Drop the rows no path in live_paths refers to, once they are over dead_fraction of the store.
+
+        live_paths are the photos still in the album; the rows of deleted photos and the old rows of
+        modified ones go. The kept rows are copied in their current order to new files, which the
+        index switches to atomically, so an interrupted compaction leaves the store as it was.
+        Returns an array mapping each old row to its new row (-1 if dropped), or None if the store
+        was left as it is; rows handed out before must be translated through it.
+        """
+        with self.lock:
+            live_digests = set()
+            for image_file_path in live_paths:
+                known = self.stat_digests.get(image_file_path)
+                if known is not None and known[2] in self.rows:
+                    live_digests.add(known[2])
+            if self.values is None or self.count - len(live_digests) <= dead_fraction * self.count:
+                return None
+            kept = sorted((self.rows[digest], digest) for digest in live_digests)
+            old_rows = np.array([row for row, _ in kept], dtype=np.int64)
+            capacity = INITIAL_CAPACITY
+            while capacity < len(kept):
+                capacity *= 2
+
+            generation = self.generation + 1
+            values_path, scales_path = self._paths(generation)
+            values = np.memmap(values_path, dtype=EMBEDDING_DTYPES[self.dtype], mode='w+',
+                               shape=(capacity, self.dim))
+            scales = np.memmap(scales_path, dtype=np.float32, mode='w+', shape=(capacity,))
+            for start in range(0, len(old_rows), QUANTIZE_CHUNK):
+                chunk = old_rows[start:start + QUANTIZE_CHUNK]
+                values[start:start + len(chunk)] = self.values[chunk]
+                scales[start:start + len(chunk)] = self.scales[chunk]
+            values.flush()
+            scales.flush()
+            del values, scales
+
+            new_rows = np.full(self.count, -1, dtype=np.int64)
+            new_rows[old_rows] = np.arange(len(old_rows))
+            old_paths = (self.values_path, self.scales_path)
+            dropped = self.count - len(kept)
+            self.values = self.scales = None
+            self.rows = {digest: row for row, (_, digest) in enumerate(kept)}
+            self.count, self.capacity, self.generation = len(kept), capacity, generation
+            self.values_path, self.scales_path = values_path, scales_path
+            self._open('r+')
+        self.flush()
+        for path in old_paths:
+            os.remove(path)
+        if self.log is not None:
+            self.log(f"Embedding store {self.directory}: dropped {dropped} rows no photo uses")
+        return new_rows
+
+    def flush(self):
+        with self.lock:
+            if self.values is not None:
+                self.values.flush()
+                self.scales.flush()
+            live = set(self.rows)
+            index = {
+                'version': STORE_VERSION,
+                'dtype': self.dtype,
+                'dim': self.dim,
+                'count': self.count,
+                'capacity': self.capacity,
+                'generation': self.generation,
+                'rows': self.rows,
+                'stat_digests': {path: known for path, known in self.stat_digests.items() if known[2] in live},
+            }
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+        if self.log is not None:
+            self.log(f"Embedding store {self.directory}: {self.hits} hits, {self.misses} misses, "
+                     f"{self.count} embeddings")
@@ -0,0 +1,300 @@
+import contextlib
+import itertools
+import queue
+import threading
+import cv2
+from demogui import tracing
+from demogui.utils import (PREPROCESS_WORKERS, PreprocessPool, embed_images_pipelined, embedding_vector,
+                           first_output_value, get_model_input_size, letterbox_image, perform_inference_pipelined,
+                           process_images_pipelined)
+
+
+class ModelStage:
+    """One model of the fused pipeline: the dongles it runs on and the input size it needs.
+
+    device_groups is one device group or a list of them, all with the same NEF loaded.
+    """
+
+    def __init__(self, device_groups, model_nef_descriptor, model_index=0):
+        self.device_groups = list(device_groups) if isinstance(device_groups, (list, tuple)) else [device_groups]
+        self.model_nef_descriptor = model_nef_descriptor
+        self.model_id = model_nef_descriptor.models[model_index].id
+        self.width, self.height = get_model_input_size(model_nef_descriptor, model_index)
+
+
+def _decode_for_stages(image_file_path, stages):
+    """Decode an image once and letterbox it to the input size of every stage."""
+    with tracing.span('cv2.imread'):
+        img = cv2.imread(filename=image_file_path)
+    if img is None:
+        raise ValueError(f"could not decode image {image_file_path}")
+    buffers = {}
+    for stage in stages:
+        size = (stage.width, stage.height)
+        if size not in buffers:
+            letterboxed = letterbox_image(img, *size)
+            with tracing.span('cv2.cvtColor'):
+                buffers[size] = cv2.cvtColor(src=letterboxed, code=cv2.COLOR_BGR2BGR565)
+    return [buffers[(stage.width, stage.height)] for stage in stages]
+
+
+def _run_on_separate_devices(preprocess_pool, stages, queue_depth, log):
+    """Each model has its own dongles: fan every decoded image out to one feed per model.
+
+    Every dongle of a model runs a pipelined stream pulling from that model's feed, so a faster stick
+    simply takes more of the images.
+    """
+    done = object()
+    stop = threading.Event()
+    feeds = [queue.Queue(maxsize=2 * queue_depth * len(stage.device_groups)) for stage in stages]
+    results = queue.Queue()
+    errors = []
+
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def fan_out():
+        try:
+            for index, image_file_path, buffers in preprocess_pool:
+                if stop.is_set():
+                    break
+                # an image decoded for fewer stages than there are only runs through the first ones
+                for stage_index, (stage, feed, img_bgr565) in enumerate(zip(stages, feeds, buffers)):
+                    put(feed, ((index, image_file_path, stage_index, len(buffers)), img_bgr565, stage.model_id))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for stage, feed in zip(stages, feeds):
+                for _ in stage.device_groups:
+                    put(feed, done)
+
+    def stream(stage, device_group, feed):
+        def requests():
+            while True:
+                try:
+                    item = feed.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        return
+                    continue
+                if item is done:
+                    return
+                yield item
+
+        try:
+            for key, inf_node_output_list in perform_inference_pipelined(device_group, stage.model_nef_descriptor,
+                                                                         requests(), queue_depth=queue_depth,
+                                                                         ordered=False, device_resize=False,
+                                                                         log=log):
+                results.put((key, inf_node_output_list))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            results.put((done, None))
+
+    threads = [threading.Thread(target=fan_out, name="fused-fan-out", daemon=True)]
+    threads += [threading.Thread(target=stream, args=(stage, device_group, feed), name=f"fused-stage-{i}-{j}",
+                                 daemon=True)
+                for i, (stage, feed) in enumerate(zip(stages, feeds))
+                for j, device_group in enumerate(stage.device_groups)]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads) - 1
+        while running:
+            key, inf_node_output_list = results.get()
+            if key is done:
+                running -= 1
+                continue
+            yield key, inf_node_output_list
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        preprocess_pool.close()
+        for thread in threads:
+            thread.join()
+
+
+def score_and_embed_images(image_file_paths, quality_stage, feature_stage, queue_depth=4,
+                           preprocess_workers=PREPROCESS_WORKERS, skip_embedding=None, log=print):
+    """Decode every image once and run both the photo-quality and the feature model on it.
+
+    Yields (image_file_path, score, feature) in input order, where score is the first output value of
+    the quality model and feature the full embedding vector of the feature model. The stages must be
+    on different dongles; the two models run concurrently, one pipelined stream per dongle, and a
+    model with several dongles spreads its images across them.
+    Images for which skip_embedding(image_file_path) is true only go to the quality model and are
+    yielded with feature None. Images that cannot be decoded are skipped with a warning to log.
+    """
+    stages = [quality_stage, feature_stage]
+
+    def preprocess(image_file_path):
+        if skip_embedding is not None and skip_embedding(image_file_path):
+            return _decode_for_stages(image_file_path, stages[:1])
+        return _decode_for_stages(image_file_path, stages)
+
+    if any(device_group in feature_stage.device_groups for device_group in quality_stage.device_groups):
+        raise ValueError("the quality and feature stages must run on different dongles")
+    with PreprocessPool(image_file_paths, num_workers=preprocess_workers, preprocess=preprocess,
+                        log=log) as preprocess_pool:
+        results = _run_on_separate_devices(preprocess_pool, stages, queue_depth, log)
+
+        partial = {}  # index -> [image_file_path, score, feature, stages still to report]
+        next_index = 0
+        postprocess = [first_output_value, embedding_vector]
+        for (index, image_file_path, stage_index, num_stages), inf_node_output_list in results:
+            outputs = partial.setdefault(index, [image_file_path, None, None, num_stages])
+            outputs[1 + stage_index] = postprocess[stage_index](inf_node_output_list)
+            outputs[3] -= 1
+            while next_index in partial or next_index in preprocess_pool.skipped:
+                if next_index in partial:
+                    if partial[next_index][3]:
+                        break
+                    yield tuple(partial.pop(next_index)[:3])
+                next_index += 1
+        # an image skipped after the last result came back leaves a gap the loop could not pass
+        for index in sorted(partial):
+            yield tuple(partial[index][:3])
+
+
+def score_and_embed_album(image_file_paths, model_registry, quality_model_path, feature_model_path,
+                          quality_cache=None, feature_cache=None, stat_results=None, skip_embedding=None,
+                          max_queued=64):
+    """Get the quality score and feature of every image with each model run at most once per image.
+
+    Images missing both results go through score_and_embed_images on every idle dongle of
+    model_registry, shared out between the two models; with a single dongle, which cannot hold
+    both NEFs, each model makes one pipelined pass instead. Yields (image_file_path, score, feature),
+    with the feature as a float32 embedding vector; feature_cache is an EmbeddingStore. Images for
+    which skip_embedding(image_file_path) is true are only scored, never embedded, and are yielded
+    with feature None. stat_results maps paths to stat results the caller already has, so the
+    caches do not stat those files again. Images that cannot be decoded are not yielded; the
+    warning about them goes to model_registry's log.
+
+    image_file_paths may be a generator, e.g. a directory scan still in progress. It is read as the
+    dongles take work, so inference starts on the first uncached images while the rest are still
+    being listed, and cache hits are yielded as they are found. Results therefore come in no
+    particular order; at most max_queued of them wait for the caller.
+    """
+    stat_results = stat_results or {}
+    skip_embedding = skip_embedding or (lambda image_file_path: False)
+    results = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    done = object()
+    errors = []
+    need_quality = []
+    cached_features = {}  # embedded but not scored yet
+    scores = {}  # scored but not embedded yet
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def store(image_file_path, score, feature):
+        if quality_cache is not None:
+            quality_cache.put(image_file_path, [score], stat_results.get(image_file_path))
+        if feature_cache is not None and feature is not None:
+            feature_cache.put(image_file_path, feature, stat_results.get(image_file_path))
+        return put((image_file_path, score, feature))
+
+    def uncached():
+        """The images missing both results; cache hits are handed to the caller on the way."""
+        for image_file_path in image_file_paths:
+            if stop.is_set():
+                return
+            stat_result = stat_results.get(image_file_path)
+            skip = skip_embedding(image_file_path)
+            values = quality_cache.get(image_file_path, stat_result) if quality_cache is not None else None
+            score = float(values[0]) if values is not None else None
+            feature = None
+            if feature_cache is not None and not skip:
+                feature = feature_cache.get(image_file_path, stat_result)
+
+            if score is not None and (skip or feature is not None):
+                put((image_file_path, score, feature))
+            elif score is not None:
+                scores[image_file_path] = score
+            elif feature is not None:
+                cached_features[image_file_path] = feature
+                need_quality.append(image_file_path)
+            else:
+                yield image_file_path
+
+    def run():
+        try:
+            fresh = uncached()
+            first = next(fresh, None)
+            if first is not None and len(model_registry.device_pool) >= 2:
+                # an odd dongle goes to the feature extractor, the heavier of the two models
+                feature_leases, quality_leases = model_registry.acquire_all([feature_model_path, quality_model_path])
+                with contextlib.ExitStack() as leases:
+                    for lease in quality_leases + feature_leases:
+                        leases.enter_context(lease)
+                    quality_stage = ModelStage([lease.device_group for lease in quality_leases],
+                                               quality_leases[0].model_nef_descriptor)
+                    feature_stage = ModelStage([lease.device_group for lease in feature_leases],
+                                               feature_leases[0].model_nef_descriptor)
+                    for image_file_path, score, feature in score_and_embed_images(itertools.chain([first], fresh),
+                                                                                  quality_stage, feature_stage,
+                                                                                  skip_embedding=skip_embedding,
+                                                                                  log=model_registry.log):
+                        if not store(image_file_path, score, feature):
+                            return
+                to_score = iter(need_quality)
+            else:
+                # one dongle: the quality pass streams, the images it scores are embedded after it
+                to_score = itertools.chain([first] if first is not None else [], fresh, need_quality)
+
+            first = next(to_score, None)
+            if first is not None:
+                with model_registry.acquire(quality_model_path) as lease:
+                    for image_file_path, score in process_images_pipelined(lease.device_group,
+                                                                           lease.model_nef_descriptor,
+                                                                           itertools.chain([first], to_score),
+                                                                           log=model_registry.log):
+                        if image_file_path in cached_features:
+                            stored = store(image_file_path, score, cached_features.pop(image_file_path))
+                        elif skip_embedding(image_file_path):
+                            stored = store(image_file_path, score, None)
+                        else:
+                            scores[image_file_path] = score
+                            stored = True
+                        if not stored:
+                            return
+            if scores:
+                with model_registry.acquire(feature_model_path) as lease:
+                    for image_file_path, feature in embed_images_pipelined(lease.device_group,
+                                                                           lease.model_nef_descriptor, list(scores),
+                                                                           log=model_registry.log):
+                        if not store(image_file_path, scores.pop(image_file_path), feature):
+                            return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(done)
+
+    thread = threading.Thread(target=run, name="score-and-embed", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,192 @@
+import os
+import numpy as np
+from demogui.utils import SIMILARITY_BLOCK_SIZE, normalize_features, similar_pairs
+
+
+def _scaled_rows(matrix, row_scales, start, stop):
+    return np.asarray(matrix[start:stop], dtype=np.float32) * row_scales[start:stop, None]
+
+
+class IncrementalClusterer:
+    """DBSCAN-style clustering that grows with an album instead of reclustering it from scratch.
+
+    The normalized embeddings, the epsilon-neighbourhood edges and the union-find forest of core
+    points are kept between runs. Adding k photos to an album of n only computes the k x n and
+    k x k similarity blocks; clusters then grow or merge through the new edges.
+    Core points are merged exactly as DBSCAN does; a border point joins the cluster of its
+    lowest-index core neighbour. Quantized rows from an EmbeddingStore can be added as they are
+    stored, and are then kept in that compact form.
+    """
+
+    def __init__(self, similarity_threshold=0.8, min_samples=2, block_size=SIMILARITY_BLOCK_SIZE):
+        self.similarity_threshold = similarity_threshold
+        self.min_samples = min_samples
+        self.block_size = block_size
+        self.image_paths = []
+        self.path_index = {}
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.row_scales = np.zeros(0, dtype=np.float32)
+        self.neighbours = []
+        self.parent = []
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def _find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _union(self, i, j):
+        root_i, root_j = self._find(i), self._find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def _is_core(self, i):
+        return len(self.neighbours[i]) + 1 >= self.min_samples
+
+    def _append_embeddings(self, normalized, row_scales):
+        num_existing = len(self.image_paths)
+        if num_existing == 0:
+            self.embeddings = np.empty((max(len(normalized), 1024), normalized.shape[1]), dtype=normalized.dtype)
+            self.row_scales = np.empty(len(self.embeddings), dtype=np.float32)
+        elif normalized.shape[1] != self.embeddings.shape[1]:
+            raise ValueError(f"expected {self.embeddings.shape[1]}-dimensional features, got {normalized.shape[1]}")
+        needed = num_existing + len(normalized)
+        if needed > len(self.embeddings):
+            grown = np.empty((max(needed, 2 * len(self.embeddings)), self.embeddings.shape[1]),
+                             dtype=self.embeddings.dtype)
+            grown[:num_existing] = self.embeddings[:num_existing]
+            self.embeddings = grown
+            self.row_scales = np.resize(self.row_scales, len(grown))
+        self.embeddings[num_existing:needed] = normalized
+        self.row_scales[num_existing:needed] = row_scales
+
+    def add(self, image_paths, features=None, normalized=None, row_scales=None):
+        """Add new images and their features; images already known are skipped.
+
+        Pass normalized and row_scales instead of features for rows that are already normalized or
+        quantized, e.g. EmbeddingStore values and scales; see iter_similarity_blocks.
+        """
+        if normalized is None:
+            normalized = normalize_features(features)
+            row_scales = np.ones(len(normalized), dtype=np.float32)
+        elif row_scales is None:
+            row_scales = np.ones(len(normalized), dtype=np.float32)
+        row_scales = np.asarray(row_scales, dtype=np.float32)
+        new = [i for i, image_path in enumerate(image_paths) if image_path not in self.path_index]
+        if not new:
+            return
+        if len(new) < len(normalized):
+            normalized, row_scales = normalized[new], row_scales[new]
+        image_paths = [image_paths[i] for i in new]
+        num_existing = len(self.image_paths)
+        self._append_embeddings(normalized, row_scales)
+        existing = self.embeddings[:num_existing]
+        existing_scales = self.row_scales[:num_existing]
+
+        for image_path in image_paths:
+            self.path_index[image_path] = len(self.image_paths)
+            self.image_paths.append(image_path)
+            self.neighbours.append([])
+            self.parent.append(len(self.parent))
+
+        # new images against existing members, then among themselves
+        edges = []
+        for row_start in range(0, len(normalized), self.block_size):
+            rows = _scaled_rows(normalized, row_scales, row_start, row_start + self.block_size)
+            for col_start in range(0, num_existing, self.block_size):
+                block = rows @ _scaled_rows(existing, existing_scales, col_start, col_start + self.block_size).T
+                block_rows, block_cols = np.nonzero(block >= self.similarity_threshold)
+                edges.extend(zip((block_rows + num_existing + row_start).tolist(), (block_cols + col_start).tolist()))
+        rows, cols, _ = similar_pairs(None, self.similarity_threshold, self.block_size, normalized=normalized,
+                                      row_scales=row_scales)
+        edges.extend(zip((rows + num_existing).tolist(), (cols + num_existing).tolist()))
+
+        was_core = {}
+        for i, j in edges:
+            for point in (i, j):
+                if point not in was_core:
+                    was_core[point] = self._is_core(point) if point < num_existing else False
+            self.neighbours[i].append(j)
+            self.neighbours[j].append(i)
+
+        # points that just became core connect to every core neighbour, old edges included
+        for point, core_before in was_core.items():
+            if not core_before and self._is_core(point):
+                for neighbour in self.neighbours[point]:
+                    if self._is_core(neighbour):
+                        self._union(point, neighbour)
+        for i, j in edges:
+            if self._is_core(i) and self._is_core(j):
+                self._union(i, j)
+
+    def cluster_ids(self):
+        """Per-image cluster ids in insertion order; -1 marks noise.
+
+        A cluster's id is the insertion index of its oldest core image, so it stays the same while
+        the cluster grows and only changes when the cluster merges into an older one.
+        """
+        ids = np.full(len(self.image_paths), -1)
+        for i in range(len(self.image_paths)):
+            if self._is_core(i):
+                ids[i] = self._find(i)
+        for i in range(len(self.image_paths)):
+            if not self._is_core(i):
+                core_neighbours = [j for j in self.neighbours[i] if self._is_core(j)]
+                if core_neighbours:
+                    ids[i] = self._find(min(core_neighbours))
+        return ids
+
+    def labels(self):
+        """Per-image cluster labels in insertion order, numbered from 0 by cluster id; -1 marks noise."""
+        ids = self.cluster_ids()
+        labels = np.full(len(ids), -1)
+        clustered = ids != -1
+        labels[clustered] = np.unique(ids[clustered], return_inverse=True)[1]
+        return labels
+
+    def clusters(self):
+        """Clusters as lists of file paths, in the same format as cluster_images_with_dbscan."""
+        clusters = {}
+        for image_path, label in zip(self.image_paths, self.labels()):
+            if label != -1:
+                clusters.setdefault(label, []).append(image_path)
+        return [clusters[label] for label in sorted(clusters)]
+
+    def save(self, state_path):
+        """Persist embeddings and neighbourhood edges so the next run only handles new images."""
+        edges = [(i, j) for i, neighbours in enumerate(self.neighbours) for j in neighbours if i < j]
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+        tmp_path = state_path + '.tmp.npz'
+        np.savez(tmp_path,
+                 image_paths=np.array(self.image_paths, dtype=str),
+                 embeddings=self.embeddings[:len(self.image_paths)],
+                 row_scales=self.row_scales[:len(self.image_paths)],
+                 edges=edges,
+                 params=np.array([self.similarity_threshold, self.min_samples, self.block_size]))
+        os.replace(tmp_path, state_path)
+
+    @classmethod
+    def load(cls, state_path):
+        state = np.load(state_path)
+        similarity_threshold, min_samples, block_size = state['params']
+        clusterer = cls(float(similarity_threshold), int(min_samples), int(block_size))
+        clusterer.image_paths = state['image_paths'].tolist()
+        clusterer.path_index = {image_path: i for i, image_path in enumerate(clusterer.image_paths)}
+        clusterer.embeddings = np.array(state['embeddings'])
+        if 'row_scales' in state:
+            clusterer.row_scales = np.array(state['row_scales'], dtype=np.float32)
+        else:
+            clusterer.row_scales = np.ones(len(clusterer.embeddings), dtype=np.float32)
+        clusterer.neighbours = [[] for _ in clusterer.image_paths]
+        clusterer.parent = list(range(len(clusterer.image_paths)))
+        for i, j in state['edges'].tolist():
+            clusterer.neighbours[i].append(j)
+            clusterer.neighbours[j].append(i)
+        for i, j in state['edges'].tolist():
+            if clusterer._is_core(i) and clusterer._is_core(j):
+                clusterer._union(i, j)
+        return clusterer
@@ -0,0 +1,606 @@
+"""Emulated KneronPLUS backend for load testing and capacity planning without dongles.
+
+Implements the part of ``kp.core`` and ``kp.inference`` this project uses: scanning and connecting
+devices, firmware and model upload, generic image inference send/receive and float and fixed-point
+node retrieval. Each emulated dongle models USB transfer time from the payload size and link
+bandwidth, NPU time per inference, and a bounded number of requests in flight, so pipelining, work
+stealing and multi-dongle dispatch behave like they do on hardware.
+
+Config (JSON) keys, all optional:
+    devices     list of {"chip" or "product_id", "usb_port_id", "npu_ms", "usb_mb_per_s", "queue_depth",
+                "firmware_load_s", "npu_jitter"}, or just a count; one KL520 by default
+    models      NEF file name (or "default") -> {"input": [w, h], "outputs": [[c, h, w], ...], "npu_ms",
+                "id"}, or {"models": [...]} for a multi-model NEF
+    time_scale  multiplier for every modelled delay; 0 keeps the ordering but drops the waiting
+
+Run any entry point on it with
+
+    python -m demogui.kp_emulator --devices 2 -m demogui.benchmark --model photo_scorer_520.nef
+
+or set DEMOGUI_KP_BACKEND=emulator (and optionally DEMOGUI_KP_EMULATOR_CONFIG to a JSON file or
+string) before demogui is imported; child processes inherit the setting.
+"""
+import argparse
+import enum
+import hashlib
+import itertools
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+import types
+import numpy as np
+
+BACKEND_ENVIRONMENT_VARIABLE = 'DEMOGUI_KP_BACKEND'
+CONFIG_ENVIRONMENT_VARIABLE = 'DEMOGUI_KP_EMULATOR_CONFIG'
+
+# Per-chip defaults; usb_mb_per_s is the effective bulk transfer rate, not the signalling rate
+CHIP_PROFILES = {
+    0x100: {'chip': 'KL520', 'npu_ms': 25.0, 'usb_mb_per_s': 30.0, 'queue_depth': 4, 'firmware_load_s': 0.8},
+    0x720: {'chip': 'KL720', 'npu_ms': 8.0, 'usb_mb_per_s': 250.0, 'queue_depth': 8, 'firmware_load_s': 0.3},
+    0x630: {'chip': 'KL630', 'npu_ms': 10.0, 'usb_mb_per_s': 30.0, 'queue_depth': 8, 'firmware_load_s': 0.5},
+    0x732: {'chip': 'KL730', 'npu_ms': 5.0, 'usb_mb_per_s': 250.0, 'queue_depth': 8, 'firmware_load_s': 0.5},
+}
+CHIP_PRODUCT_IDS = {profile['chip']: product_id for product_id, profile in CHIP_PROFILES.items()}
+USB_TRANSFER_OVERHEAD_MS = 0.2
+DEFAULT_MODEL = {'input': [224, 224], 'outputs': [[1, 1, 1]]}
+SUMMARY_LENGTH = 16
+# The NPU emits int8 outputs; values in (0, 1) use radix 7 so 1.0 maps to 128
+OUTPUT_RADIX = 7
+OUTPUT_SCALE = 1.0
+
+
+class ApiKPException(Exception):
+    """Raised where the real kp raises kp.ApiKPException."""
+
+    def __init__(self, api_return_code, message=''):
+        super().__init__(f"{api_return_code.name}: {message}" if message else api_return_code.name)
+        self.api_return_code = api_return_code
+
+
+class ApiReturnCode(enum.IntEnum):
+    KP_ERROR_DEVICE_NOT_EXIST_10 = 10
+    KP_ERROR_RECV_DATA_TIMEOUT_14 = 14
+    KP_ERROR_FILE_OPEN_FAILED_20 = 20
+    KP_ERROR_MODEL_NOT_LOADED_35 = 35
+    KP_ERROR_INVALID_MODEL_21 = 21
+    KP_ERROR_DEVICE_INCORRECT_RESPONSE_11 = 11
+
+
+ImageFormat = enum.IntEnum('ImageFormat', [
+    'KP_IMAGE_FORMAT_UNKNOWN', 'KP_IMAGE_FORMAT_RGB565', 'KP_IMAGE_FORMAT_RGBA8888', 'KP_IMAGE_FORMAT_YUYV',
+    'KP_IMAGE_FORMAT_YCBCR422_CRY1CBY0', 'KP_IMAGE_FORMAT_YCBCR422_CBY1CRY0', 'KP_IMAGE_FORMAT_YCBCR422_Y1CRY0CB',
+    'KP_IMAGE_FORMAT_YCBCR422_Y1CBY0CR', 'KP_IMAGE_FORMAT_YCBCR422_CRY0CBY1', 'KP_IMAGE_FORMAT_YCBCR422_CBY0CRY1',
+    'KP_IMAGE_FORMAT_YCBCR422_Y0CRY1CB', 'KP_IMAGE_FORMAT_YCBCR422_Y0CBY1CR', 'KP_IMAGE_FORMAT_RAW8',
+    'KP_IMAGE_FORMAT_YUV420', 'KP_IMAGE_FORMAT_RGB'], start=0)
+ResizeMode = enum.IntEnum('ResizeMode', ['KP_RESIZE_DISABLE', 'KP_RESIZE_ENABLE'], start=0)
+PaddingMode = enum.IntEnum('PaddingMode', ['KP_PADDING_DISABLE', 'KP_PADDING_CORNER', 'KP_PADDING_SYMMETRIC'], start=0)
+NormalizeMode = enum.IntEnum('NormalizeMode', ['KP_NORMALIZE_DISABLE', 'KP_NORMALIZE_KNERON',
+                                               'KP_NORMALIZE_TENSOR_FLOW', 'KP_NORMALIZE_YOLO',
+                                               'KP_NORMALIZE_CUSTOMIZED_DEFAULT'], start=0)
+ChannelOrdering = enum.IntEnum('ChannelOrdering', ['KP_CHANNEL_ORDERING_HCW', 'KP_CHANNEL_ORDERING_CHW',
+                                                   'KP_CHANNEL_ORDERING_HWC', 'KP_CHANNEL_ORDERING_DEFAULT'], start=0)
+
+
+# bytes per pixel of the packed formats; YUV420 is planar and only accepted as bytes with a width and height
+IMAGE_FORMAT_CHANNELS = {
+    ImageFormat.KP_IMAGE_FORMAT_RGB565: 2, ImageFormat.KP_IMAGE_FORMAT_RGBA8888: 4, ImageFormat.KP_IMAGE_FORMAT_YUYV: 2,
+    ImageFormat.KP_IMAGE_FORMAT_RAW8: 1, ImageFormat.KP_IMAGE_FORMAT_RGB: 3,
+    **{image_format: 2 for image_format in ImageFormat if image_format.name.startswith('KP_IMAGE_FORMAT_YCBCR422')},
+}
+IMAGE_FORMAT_BYTES_PER_PIXEL = {**IMAGE_FORMAT_CHANNELS, ImageFormat.KP_IMAGE_FORMAT_YUV420: 1.5}
+
+
+class GenericInputNodeImage:
+    """Like kp's: an ndarray carries its own size, a bytes image needs width and height.
+
+    The same checks as kp are applied, so code that passes a layout the real library rejects
+    fails here too: arrays must be uint8, 2-D only for RAW8 and otherwise (height, width, channels)
+    with the format's channel count.
+    """
+
+    def __init__(self, image=None, width=0, height=0, image_format=ImageFormat.KP_IMAGE_FORMAT_RGB565,
+                 resize_mode=ResizeMode.KP_RESIZE_ENABLE, padding_mode=PaddingMode.KP_PADDING_CORNER,
+                 normalize_mode=NormalizeMode.KP_NORMALIZE_KNERON, inference_crop_box_list=None):
+        if image is None:
+            image = np.zeros((1, 1, 2), dtype=np.uint8)
+        if isinstance(image, np.ndarray):
+            if image.dtype != np.uint8:
+                raise ValueError(f"image must be a uint8 array, got {image.dtype}")
+            if image.ndim == 2:
+                if image_format != ImageFormat.KP_IMAGE_FORMAT_RAW8:
+                    raise ValueError(f"2-D image arrays are only valid for RAW8, not {image_format.name}")
+            elif image.ndim != 3 or image.shape[2] != IMAGE_FORMAT_CHANNELS.get(image_format):
+                raise ValueError(f"image array of shape {image.shape} does not match {image_format.name}")
+            height, width = image.shape[:2]
+        elif isinstance(image, bytes):
+            if width <= 0 or height <= 0:
+                raise ValueError("width and height are required for a bytes image")
+            expected_size = int(width * height * IMAGE_FORMAT_BYTES_PER_PIXEL[image_format])
+            if len(image) != expected_size:
+                raise ValueError(f"{len(image)} image bytes do not match {width}x{height} {image_format.name}")
+        else:
+            raise ValueError(f"image must be a numpy.ndarray or bytes, got {type(image).__name__}")
+        self.image = image
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+        self.resize_mode = resize_mode
+        self.padding_mode = padding_mode
+        self.normalize_mode = normalize_mode
+        self.inference_crop_box_list = inference_crop_box_list or []
+
+
+class GenericImageInferenceDescriptor:
+    def __init__(self, model_id=0, inference_number=0, input_node_image_list=None):
+        self.model_id = model_id
+        self.inference_number = inference_number
+        self.input_node_image_list = input_node_image_list or []
+
+
+class Scale:
+    def __init__(self, value=1.0, dtype='KP_DTYPE_FLOAT32'):
+        self.value = value
+        self.dtype = dtype
+
+
+class QuantizedFixedPointDescriptor:
+    def __init__(self, scale=None, radix=0):
+        self.scale = scale or Scale()
+        self.radix = radix
+
+
+class QuantizationParametersV1:
+    def __init__(self, quantized_axis=1, quantized_fixed_point_descriptor_list=None):
+        self.quantized_axis = quantized_axis
+        self.quantized_fixed_point_descriptor_list = quantized_fixed_point_descriptor_list or []
+
+
+class QuantizationParameters:
+    def __init__(self, v1=None):
+        self.version = 'KP_MODEL_QUANTIZATION_PARAMS_VERSION_1'
+        self.v1 = v1 or QuantizationParametersV1()
+
+
+class InferenceFloatNodeOutput:
+    def __init__(self, name, shape, num_data, ndarray, channels_ordering):
+        self.name = name
+        self.shape = shape
+        self.num_data = num_data
+        self.ndarray = ndarray
+        self.channels_ordering = channels_ordering
+
+
+class InferenceFixedNodeOutput:
+    def __init__(self, name, shape, dtype, quantization_parameters, num_data, ndarray, channels_ordering):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.quantization_parameters = quantization_parameters
+        self.num_data = num_data
+        self.ndarray = ndarray
+        self.channels_ordering = channels_ordering
+
+    def to_float_node(self):
+        v1 = self.quantization_parameters.v1
+        factors = np.array([1.0 / (d.scale.value * 2.0 ** d.radix) for d in v1.quantized_fixed_point_descriptor_list],
+                           dtype=np.float32)
+        if len(factors) > 1:
+            factors = factors.reshape([-1 if axis == v1.quantized_axis else 1 for axis in range(self.ndarray.ndim)])
+        return InferenceFloatNodeOutput(self.name, self.shape, self.num_data, self.ndarray * factors,
+                                        self.channels_ordering)
+
+
+class EmulatedModel:
+    """One model of an emulated NEF: its id, input size, output node shapes and NPU time."""
+
+    def __init__(self, model_id, width, height, outputs, npu_ms=None, shape_info_version=1):
+        self.id = model_id
+        self.width = width
+        self.height = height
+        self.outputs = [tuple(shape) for shape in outputs]
+        self.npu_ms = npu_ms
+        self.shape_info_version = shape_info_version
+        self.input_nodes = [self.tensor_descriptor(0, 'input', [1, 3, height, width])]
+        self.output_nodes = [self.tensor_descriptor(i, f'output_{i}', [1, *shape])
+                             for i, shape in enumerate(self.outputs)]
+        self.max_raw_out_size = sum(int(np.prod(shape)) for shape in self.outputs)
+
+    def tensor_descriptor(self, index, name, shape):
+        """kp's TensorDescriptor: KL520/KL720/KL630 NEFs carry V1 shape info (shape_npu), KL730 ones V2 (shape)."""
+        if self.shape_info_version == 2:
+            data = types.SimpleNamespace(shape=shape, stride_onnx=[], stride_npu=[])
+        else:
+            data = types.SimpleNamespace(shape_npu=shape, shape_onnx=shape, axis_permutation_onnx_to_npu=[0, 1, 2, 3])
+        version = f'KP_MODEL_TENSOR_SHAPE_INFO_VERSION_{self.shape_info_version}'
+        tensor_shape_info = types.SimpleNamespace(version=version, data=data)
+        return types.SimpleNamespace(index=index, name=name, data_layout='KP_MODEL_TENSOR_DATA_LAYOUT_4W4C8B',
+                                     tensor_shape_info=tensor_shape_info,
+                                     quantization_parameters=QuantizationParameters())
+
+
+class EmulatedDevice:
+    """One emulated dongle: a USB link shared by both directions and an NPU working through a FIFO."""
+
+    def __init__(self, emulator, usb_port_id, product_id, kn_number, npu_ms=None, usb_mb_per_s=None,
+                 queue_depth=None, firmware_load_s=None, npu_jitter=0.05):
+        profile = CHIP_PROFILES.get(product_id, CHIP_PROFILES[0x100])
+        self.emulator = emulator
+        self.usb_port_id = usb_port_id
+        self.product_id = product_id
+        self.kn_number = kn_number
+        self.chip = profile['chip']
+        self.npu_ms = profile['npu_ms'] if npu_ms is None else npu_ms
+        self.usb_mb_per_s = profile['usb_mb_per_s'] if usb_mb_per_s is None else usb_mb_per_s
+        self.queue_depth = profile['queue_depth'] if queue_depth is None else queue_depth
+        self.firmware_load_s = profile['firmware_load_s'] if firmware_load_s is None else firmware_load_s
+        self.npu_jitter = npu_jitter
+        self.random = np.random.default_rng(usb_port_id)
+        self.connected = False
+        self.firmware_loaded = False
+        self.models = {}
+        self.usb_lock = threading.Lock()
+        self.slots = threading.Semaphore(self.queue_depth)
+        self.condition = threading.Condition()
+        self.pending = []
+        self.results = []
+        self.npu_thread = None
+        self.stats = {'inferences': 0, 'npu_busy_s': 0.0, 'usb_busy_s': 0.0, 'send_wait_s': 0.0,
+                      'bytes_sent': 0, 'bytes_received': 0}
+        self.started = time.perf_counter()
+
+    def descriptor(self):
+        link_speed = 'KP_USB_SPEED_SUPER' if self.usb_mb_per_s > 100 else 'KP_USB_SPEED_HIGH'
+        firmware = 'KDP2 Comp/F' if self.firmware_loaded else 'KDP2 Loader'
+        return types.SimpleNamespace(usb_port_id=self.usb_port_id, vendor_id=0x3231, product_id=self.product_id,
+                                     link_speed=link_speed, kn_number=self.kn_number,
+                                     is_connectable=not self.connected, usb_port_path=f'1-{self.usb_port_id}',
+                                     firmware=firmware)
+
+    def connect(self):
+        with self.condition:
+            if self.connected:
+                raise ApiKPException(ApiReturnCode.KP_ERROR_DEVICE_INCORRECT_RESPONSE_11,
+                                     f"device at USB port {self.usb_port_id} is already connected")
+            self.connected = True
+            self.npu_thread = threading.Thread(target=self._npu, name=f"emulated-npu-{self.usb_port_id}", daemon=True)
+            self.npu_thread.start()
+
+    def disconnect(self):
+        with self.condition:
+            self.connected = False
+            self.firmware_loaded = False
+            self.models = {}
+            self.condition.notify_all()
+        if self.npu_thread is not None:
+            self.npu_thread.join()
+            self.npu_thread = None
+
+    def transfer(self, num_bytes, direction):
+        """Hold the USB link for as long as num_bytes take at the link rate."""
+        seconds = USB_TRANSFER_OVERHEAD_MS / 1000 + num_bytes / (self.usb_mb_per_s * 1e6)
+        with self.usb_lock:
+            self.emulator.sleep(seconds)
+            self.stats['usb_busy_s'] += seconds
+            self.stats[direction] += num_bytes
+
+    def load_firmware(self):
+        self.emulator.sleep(self.firmware_load_s)
+        self.firmware_loaded = True
+
+    def load_models(self, nef_bytes, models):
+        self.transfer(nef_bytes, 'bytes_sent')
+        with self.condition:
+            self.models = {model.id: model for model in models}
+
+    def send(self, descriptor):
+        if not self.connected:
+            raise ApiKPException(ApiReturnCode.KP_ERROR_DEVICE_NOT_EXIST_10)
+        model = self.models.get(descriptor.model_id)
+        if model is None:
+            raise ApiKPException(ApiReturnCode.KP_ERROR_MODEL_NOT_LOADED_35,
+                                 f"model {descriptor.model_id} is not loaded on USB port {self.usb_port_id}")
+        images = [np.frombuffer(node.image, dtype=np.uint8) if isinstance(node.image, bytes)
+                  else np.ascontiguousarray(node.image).ravel() for node in descriptor.input_node_image_list]
+        wait_start = time.perf_counter()
+        self.slots.acquire()
+        self.stats['send_wait_s'] += time.perf_counter() - wait_start
+        self.transfer(sum(image.nbytes for image in images), 'bytes_sent')
+        with self.condition:
+            self.pending.append((descriptor.inference_number, model, images))
+            self.condition.notify_all()
+
+    def _npu(self):
+        while True:
+            with self.condition:
+                while not self.pending and self.connected:
+                    self.condition.wait()
+                if not self.connected:
+                    return
+                inference_number, model, images = self.pending.pop(0)
+            npu_ms = model.npu_ms if model.npu_ms is not None else self.npu_ms
+            seconds = max(0.0, npu_ms * (1 + self.npu_jitter * self.random.standard_normal())) / 1000
+            self.emulator.sleep(seconds)
+            outputs = self.emulator.outputs_for(model, images)
+            with self.condition:
+                self.stats['npu_busy_s'] += seconds
+                self.stats['inferences'] += 1
+                self.results.append((inference_number, model, outputs))
+                self.condition.notify_all()
+
+    def receive(self, timeout_s):
+        deadline = None if not timeout_s else time.monotonic() + timeout_s
+        with self.condition:
+            while not self.results:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not self.connected or (remaining is not None and remaining <= 0):
+                    raise ApiKPException(ApiReturnCode.KP_ERROR_RECV_DATA_TIMEOUT_14)
+                self.condition.wait(remaining)
+            inference_number, model, outputs = self.results.pop(0)
+        self.transfer(sum(output.nbytes for output in outputs), 'bytes_received')
+        self.slots.release()
+        return types.SimpleNamespace(
+            header=types.SimpleNamespace(inference_number=inference_number, model_id=model.id,
+                                         num_output_node=len(outputs), crop_number=0, product_id=self.product_id),
+            raw_result=outputs)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        report = dict(self.stats, usb_port_id=self.usb_port_id, chip=self.chip, elapsed_s=elapsed)
+        scaled = elapsed / self.emulator.time_scale if self.emulator.time_scale else 0
+        report['npu_utilization'] = self.stats['npu_busy_s'] / scaled if scaled else None
+        report['usb_utilization'] = self.stats['usb_busy_s'] / scaled if scaled else None
+        return report
+
+
+class DeviceGroup:
+    """What connect_devices returns; requests to a group of several dongles are spread round-robin."""
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.timeout_s = None
+        self.next_send = itertools.cycle(devices)
+        self.receive_order = []
+        self.lock = threading.Lock()
+
+    @property
+    def content(self):
+        return types.SimpleNamespace(device_descriptor_list=[device.descriptor() for device in self.devices])
+
+
+class Emulator:
+    """The emulated device farm behind the fake kp module; see module docstring for the config format."""
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.time_scale = float(config.get('time_scale', 1.0))
+        self.model_specs = config.get('models', {})
+        self.lock = threading.Lock()
+        self.projections = {}
+        devices = config.get('devices', [{}])
+        if isinstance(devices, int):
+            devices = [{} for _ in range(devices)]
+        self.devices = []
+        for index, spec in enumerate(devices):
+            spec = dict(spec)
+            product_id = spec.pop('product_id', None)
+            if product_id is None:
+                product_id = CHIP_PRODUCT_IDS[spec.pop('chip', 'KL520')]
+            else:
+                spec.pop('chip', None)
+            usb_port_id = spec.pop('usb_port_id', index + 1)
+            kn_number = spec.pop('kn_number', 0x10000000 + usb_port_id)
+            self.devices.append(EmulatedDevice(self, usb_port_id, product_id, kn_number, **spec))
+
+    def sleep(self, seconds):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def device(self, usb_port_id):
+        for device in self.devices:
+            if device.usb_port_id == usb_port_id:
+                return device
+        raise ApiKPException(ApiReturnCode.KP_ERROR_DEVICE_NOT_EXIST_10, f"no device at USB port {usb_port_id}")
+
+    def models_for(self, name, nef_bytes, chip='KL520'):
+        """Build the model list of a NEF from the config entry for its file name, else the 'default' entry.
+
+        kp.core.load_model only sees the NEF bytes, so buffers always use the 'default' entry. Models
+        without a configured id get one derived from the NEF contents, so different NEFs differ.
+        """
+        shape_info_version = 2 if chip == 'KL730' else 1
+        spec = self.model_specs.get(name) or self.model_specs.get('default') or DEFAULT_MODEL
+        first_id = 1 + int.from_bytes(hashlib.blake2b(nef_bytes, digest_size=2).digest(), 'big')
+        models = []
+        for index, model in enumerate(spec.get('models', [spec])):
+            width, height = model.get('input', DEFAULT_MODEL['input'])
+            models.append(EmulatedModel(model.get('id', first_id + index), width, height,
+                                        model.get('outputs', DEFAULT_MODEL['outputs']), model.get('npu_ms'),
+                                        shape_info_version))
+        return models
+
+    def outputs_for(self, model, images):
+        """Deterministic, content-dependent int8 outputs of values in (0, 1): similar inputs give similar outputs."""
+        summary = np.concatenate([[chunk.mean() / 255 for chunk in np.array_split(image, SUMMARY_LENGTH)]
+                                  for image in images]) - 0.5
+        outputs = []
+        for node_index, shape in enumerate(model.outputs):
+            key = (model.id, node_index, len(summary))
+            with self.lock:
+                projection = self.projections.get(key)
+                if projection is None:
+                    rng = np.random.default_rng(key)
+                    projection = rng.standard_normal((len(summary), int(np.prod(shape)))).astype(np.float32)
+                    self.projections[key] = projection
+            values = 1 / (1 + np.exp(-4 * (summary @ projection)))
+            fixed = np.clip(np.rint(values * OUTPUT_SCALE * 2 ** OUTPUT_RADIX), -128, 127).astype(np.int8)
+            outputs.append(fixed.reshape((1, *shape)))
+        return outputs
+
+    def report(self):
+        return [device.report() for device in self.devices]
+
+    # kp.core
+
+    def scan_devices(self):
+        descriptors = [device.descriptor() for device in self.devices]
+        return types.SimpleNamespace(device_descriptor_number=len(descriptors), device_descriptor_list=descriptors)
+
+    def connect_devices(self, usb_port_ids):
+        devices = [self.device(usb_port_id) for usb_port_id in usb_port_ids]
+        for device in devices:
+            device.connect()
+        return DeviceGroup(devices)
+
+    def disconnect_devices(self, device_group):
+        for device in device_group.devices:
+            device.disconnect()
+
+    def set_timeout(self, device_group, milliseconds):
+        device_group.timeout_s = milliseconds / 1000 if milliseconds else None
+
+    def load_firmware_from_file(self, device_group, scpu_fw_path, ncpu_fw_path):
+        for path in (scpu_fw_path, ncpu_fw_path):
+            if not os.path.exists(path):
+                raise ApiKPException(ApiReturnCode.KP_ERROR_FILE_OPEN_FAILED_20, path)
+        for device in device_group.devices:
+            device.load_firmware()
+
+    def load_model(self, device_group, nef_buffer):
+        return self._load_model(device_group, nef_buffer)
+
+    def load_model_from_file(self, device_group, file_path):
+        try:
+            with open(file_path, 'rb') as f:
+                nef_buffer = f.read()
+        except OSError as e:
+            raise ApiKPException(ApiReturnCode.KP_ERROR_FILE_OPEN_FAILED_20, str(e))
+        return self._load_model(device_group, nef_buffer, name=os.path.basename(file_path))
+
+    def _load_model(self, device_group, nef_buffer, name=None):
+        if not nef_buffer:
+            raise ApiKPException(ApiReturnCode.KP_ERROR_INVALID_MODEL_21)
+        chip = device_group.devices[0].chip
+        models = self.models_for(name, nef_buffer, chip)
+        for device in device_group.devices:
+            device.load_models(len(nef_buffer), models)
+        return types.SimpleNamespace(magic=0x5AA55AA5, target_chip=chip,
+                                     crc=hashlib.blake2b(nef_buffer, digest_size=4).hexdigest(), models=models)
+
+    # kp.inference
+
+    def generic_image_inference_send(self, device_group, generic_inference_input_descriptor):
+        with device_group.lock:
+            device = next(device_group.next_send)
+            device_group.receive_order.append(device)
+        device.send(generic_inference_input_descriptor)
+
+    def generic_image_inference_receive(self, device_group):
+        with device_group.lock:
+            if not device_group.receive_order:
+                raise ApiKPException(ApiReturnCode.KP_ERROR_RECV_DATA_TIMEOUT_14, "nothing was sent")
+            device = device_group.receive_order.pop(0)
+        return device.receive(device_group.timeout_s)
+
+    def generic_inference_retrieve_fixed_node(self, node_idx, generic_raw_result, channels_ordering):
+        ndarray = generic_raw_result.raw_result[node_idx]
+        if channels_ordering == ChannelOrdering.KP_CHANNEL_ORDERING_HWC:
+            ndarray = np.ascontiguousarray(ndarray.transpose(0, 2, 3, 1))
+        quantization_parameters = QuantizationParameters(QuantizationParametersV1(
+            quantized_axis=1, quantized_fixed_point_descriptor_list=[
+                QuantizedFixedPointDescriptor(Scale(OUTPUT_SCALE), OUTPUT_RADIX)]))
+        return InferenceFixedNodeOutput(f'output_{node_idx}', list(ndarray.shape), 'KP_FIXED_POINT_DTYPE_INT8',
+                                        quantization_parameters, ndarray.size, ndarray, channels_ordering)
+
+    def generic_inference_retrieve_float_node(self, node_idx, generic_raw_result, channels_ordering):
+        return self.generic_inference_retrieve_fixed_node(node_idx, generic_raw_result,
+                                                          channels_ordering).to_float_node()
+
+
+def build_module(emulator):
+    """A module object with the kp attributes this project uses, backed by emulator."""
+    module = types.ModuleType('kp', "Emulated KneronPLUS backend (demogui.kp_emulator)")
+    module.emulator = emulator
+    module.core = types.SimpleNamespace(
+        scan_devices=emulator.scan_devices, connect_devices=emulator.connect_devices,
+        disconnect_devices=emulator.disconnect_devices, set_timeout=emulator.set_timeout,
+        load_firmware_from_file=emulator.load_firmware_from_file, load_model=emulator.load_model,
+        load_model_from_file=emulator.load_model_from_file)
+    module.inference = types.SimpleNamespace(
+        generic_image_inference_send=emulator.generic_image_inference_send,
+        generic_image_inference_receive=emulator.generic_image_inference_receive,
+        generic_inference_retrieve_float_node=emulator.generic_inference_retrieve_float_node,
+        generic_inference_retrieve_fixed_node=emulator.generic_inference_retrieve_fixed_node)
+    for name in ('ApiKPException', 'ApiReturnCode', 'ImageFormat', 'ResizeMode', 'PaddingMode', 'NormalizeMode',
+                 'ChannelOrdering', 'GenericInputNodeImage', 'GenericImageInferenceDescriptor'):
+        setattr(module, name, globals()[name])
+    return module
+
+
+def load_config(value):
+    """Parse a config given as a JSON string or the path of a JSON file."""
+    if not value:
+        return {}
+    if value.lstrip().startswith('{'):
+        return json.loads(value)
+    with open(value, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def install(config=None):
+    """Make ``import kp`` return the emulated backend; must run before demogui modules import kp."""
+    if 'kp' in sys.modules and not hasattr(sys.modules['kp'], 'emulator'):
+        already = [name for name in sys.modules if name.startswith('demogui.') and name != __name__]
+        if already:
+            raise RuntimeError(f"kp was already imported by {', '.join(sorted(already))}")
+    module = build_module(Emulator(config))
+    sys.modules['kp'] = module
+    return module
+
+
+def install_from_environment():
+    """Install the emulator if DEMOGUI_KP_BACKEND=emulator; returns the kp module in use or None."""
+    if os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, '').lower() != 'emulator':
+        return None
+    if 'kp' in sys.modules and hasattr(sys.modules['kp'], 'emulator'):
+        return sys.modules['kp']
+    return install(load_config(os.environ.get(CONFIG_ENVIRONMENT_VARIABLE)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a demogui entry point on emulated Kneron dongles.")
+    parser.add_argument('--config', help="emulator config as a JSON file or string")
+    parser.add_argument('--devices', type=int, help="number of emulated dongles (overrides the config)")
+    parser.add_argument('--chip', choices=sorted(CHIP_PRODUCT_IDS), default='KL520', help="chip for --devices")
+    parser.add_argument('--time-scale', type=float, help="multiply every modelled delay; 0 runs without delays")
+    parser.add_argument('--report', action='store_true', help="print per-device utilization to stderr on exit")
+    parser.add_argument('-m', dest='module', required=True,
+                        help="module to run, e.g. demogui.benchmark; everything after it is passed to the module")
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Like python -m: the emulator's own options come first, the module's arguments after its name
+    split = argv.index('-m') + 2 if '-m' in argv else len(argv)
+    options = parser.parse_args(argv[:split])
+    module_args = argv[split:]
+
+    config = load_config(options.config)
+    if options.devices is not None:
+        config['devices'] = [{'chip': options.chip} for _ in range(options.devices)]
+    if options.time_scale is not None:
+        config['time_scale'] = options.time_scale
+    os.environ[BACKEND_ENVIRONMENT_VARIABLE] = 'emulator'
+    os.environ[CONFIG_ENVIRONMENT_VARIABLE] = json.dumps(config)
+    module = install(config)
+
+    sys.argv = [options.module] + module_args
+    try:
+        runpy.run_module(options.module, run_name='__main__', alter_sys=True)
+    finally:
+        if options.report:
+            json.dump(module.emulator.report(), sys.stderr, indent=2)
+            print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
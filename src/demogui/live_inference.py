@@ -0,0 +1,150 @@
+import threading
+import time
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage
+from PyQt5.QtMultimedia import QVideoProbe
+from demogui.utils import FrameBufferPool, get_model_input_size, perform_inference, preprocess_frame
+
+
+class LatestFrameSlot:
+    """Single-frame mailbox: put() overwrites whatever is waiting, take() returns the newest frame.
+
+    A slow consumer therefore never builds a backlog; stale frames are counted and dropped.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = (frame, time.perf_counter())
+            self.condition.notify()
+
+    def take(self):
+        """Block until a frame is available; returns (frame, capture_time) or None once closed."""
+        with self.condition:
+            while self.item is None and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def qimage_to_bgr(image, buffer_pool=None):
+    """Convert a QImage to a BGR numpy array, in a pooled buffer when a buffer_pool is given."""
+    image = image.convertToFormat(QImage.Format_RGB888)
+    width, height, bytes_per_line = image.width(), image.height(), image.bytesPerLine()
+    buffer = image.constBits()
+    buffer.setsize(height * bytes_per_line)
+    rgb = np.frombuffer(buffer, dtype=np.uint8).reshape(height, bytes_per_line)[:, :width * 3].reshape(height, width, 3)
+    dst = None if buffer_pool is None else buffer_pool.acquire((height, width, 3))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=dst)
+
+
+class LiveInferenceEngine(QObject):
+    """Runs a model on the live QCamera feed on a worker thread, always on the newest frame.
+
+    Frames are probed from the camera on the GUI thread and only copied into a LatestFrameSlot;
+    conversion, USB transfer and inference happen on the worker. End-to-end latency stays bounded
+    at one frame plus inference time however slow the model is. Conversion buffers come from a
+    FrameBufferPool, so steady-state streaming does not allocate per frame.
+
+    The dongle is leased from model_registry on the worker too, since that may upload and warm up
+    the NEF; model_ready or failed reports the outcome. The lease is released when the worker stops.
+    """
+
+    result_ready = pyqtSignal(object)
+    stats_updated = pyqtSignal(float, float, int)  # fps, latency in ms, dropped frames
+    model_ready = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    STATS_INTERVAL = 1.0
+
+    def __init__(self, camera, model_registry, model_path, parent=None):
+        super().__init__(parent)
+        self.model_registry = model_registry
+        self.model_path = model_path
+        self.device_group = None
+        self.model_nef_descriptor = None
+        self.stopped = threading.Event()
+        self.slot = LatestFrameSlot()
+        self.buffer_pool = FrameBufferPool()
+        self.thread = None
+        self.probe = QVideoProbe(self)
+        if not self.probe.setSource(camera):
+            raise RuntimeError("Camera frames cannot be probed on this platform")
+        self.probe.videoFrameProbed.connect(self.on_frame)
+
+    def on_frame(self, video_frame):
+        image = video_frame.image()
+        if not image.isNull():
+            self.slot.put(image)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="live-inference", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.probe.videoFrameProbed.disconnect(self.on_frame)
+        self.slot.close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        try:
+            lease = self.model_registry.acquire(self.model_path, cancel=self.stopped)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if lease is None:
+            return
+        with lease:
+            self.device_group = lease.device_group
+            self.model_nef_descriptor = lease.model_nef_descriptor
+            input_width, input_height = get_model_input_size(self.model_nef_descriptor)
+            self.model_ready.emit()
+            self._stream(input_width, input_height)
+
+    def _stream(self, input_width, input_height):
+        frames = 0
+        latency_total = 0.0
+        window_start = time.perf_counter()
+        while True:
+            item = self.slot.take()
+            if item is None:
+                return
+            image, capture_time = item
+            img = qimage_to_bgr(image, self.buffer_pool)
+            img_bgr565 = preprocess_frame(img, input_width, input_height, self.buffer_pool)
+            self.buffer_pool.release(img)
+            try:
+                inf_node_output_list = perform_inference(self.device_group, self.model_nef_descriptor, img_bgr565,
+                                                         device_resize=False, buffer_pool=self.buffer_pool)
+            except Exception as e:
+                print(f"Live inference failed: {e}")
+                continue
+            self.result_ready.emit(inf_node_output_list)
+
+            now = time.perf_counter()
+            frames += 1
+            latency_total += now - capture_time
+            if now - window_start >= self.STATS_INTERVAL:
+                self.stats_updated.emit(frames / (now - window_start), 1000 * latency_total / frames, self.slot.dropped)
+                frames = 0
+                latency_total = 0.0
+                window_start = now
@@ -0,0 +1,67 @@
+import collections
+import threading
+from PyQt5.QtCore import QObject, QTimer
+
+LOG_BUFFER_LINES = 1000
+LOG_FLUSH_INTERVAL_MS = 100
+CONSOLE_MAX_LINES = 5000
+
+
+class LogRingBuffer:
+    """Thread-safe bounded buffer of log lines: any thread can write(), one consumer calls drain().
+
+    Once max_lines are waiting, each new line pushes out the oldest one and is counted as dropped,
+    so a burst of logging costs bounded memory and the consumer never has more than max_lines to
+    render. A LogRingBuffer can be passed anywhere a log callable is expected.
+    """
+
+    def __init__(self, max_lines=LOG_BUFFER_LINES):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def __call__(self, message):
+        self.write(message)
+
+    def write(self, message):
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(str(message))
+
+    def drain(self):
+        """Return (lines, dropped): the lines written since the last drain and how many were pushed out."""
+        with self.lock:
+            lines = list(self.lines)
+            self.lines.clear()
+            dropped, self.dropped = self.dropped, 0
+        return lines, dropped
+
+
+class QtLogSink(QObject):
+    """Moves lines from a LogRingBuffer into a QPlainTextEdit, one batch per timer tick.
+
+    The widget is touched once per interval_ms however many lines arrive, and keeps at most
+    max_lines lines, so the cost of logging on the GUI thread stays flat on long runs.
+    """
+
+    def __init__(self, text_edit, buffer=None, interval_ms=LOG_FLUSH_INTERVAL_MS, max_lines=CONSOLE_MAX_LINES,
+                 parent=None):
+        super().__init__(parent)
+        self.text_edit = text_edit
+        self.text_edit.setMaximumBlockCount(max_lines)
+        self.buffer = buffer or LogRingBuffer()
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def __call__(self, message):
+        self.buffer.write(message)
+
+    def flush(self):
+        lines, dropped = self.buffer.drain()
+        if dropped:
+            lines.insert(0, f"... {dropped} lines skipped")
+        if lines:
+            self.text_edit.appendPlainText('\n'.join(lines))
@@ -1,5 +1,4 @@
-import kp
-import cv2, os, shutil, sys
+import cv2, functools, os, shutil, sys
 from enum import Enum
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, 
                              QComboBox, QFileDialog, QMessageBox, QHBoxLayout, QDialog, QListWidget,
@@ -9,7 +8,11 @@ from PyQt5.QtMultimedia import QCamera, QCameraImageCapture, QCameraInfo, QMedia
 from PyQt5.QtMultimediaWidgets import QVideoWidget
 from PyQt5.QtGui import QPixmap, QMovie
 from PyQt5.QtCore import Qt, QTimer, QUrl
-from demogui.utils import perform_inference,preprocess_image #functions from utils.py
+from demogui.utils import perform_inference,model_preprocessor,first_output_value #functions from utils.py
+from demogui.device_pool import DevicePool
+from demogui.device_workers import DeviceScanner, FirmwareLoader
+from demogui.model_registry import ModelRegistry
+from demogui.live_inference import LiveInferenceEngine
 
 # Constants
 UXUI_ASSETS = "../../uxui/"
@@ -35,6 +38,13 @@ BUTTON_STYLE = """
 SQUARE_BUTTON_STYLE = "background: transparent; color: white; border: 1px transparent; border-radius: 10px; "
 POPUP_SIZE_RATIO = 0.67
 NO_DEVICE_GIF = UXUI_ASSETS + "no_device_temp.gif"
+MODEL_DIRECTORY = "../../external/res/models/KL520/"
+LIVE_MODEL_PATHS = {
+    'Face Detection': MODEL_DIRECTORY + "ssd_fd_lm/models_520.nef",
+    'Gender/Age Detection': MODEL_DIRECTORY + "age_gender/models_520.nef",
+    'Object Detection': MODEL_DIRECTORY + "tiny_yolo_v3/models_520.nef",
+    'Mask Detection': MODEL_DIRECTORY + "mask_detection/models_520.nef",
+}
 
 
 class MainWindow(QWidget):
@@ -52,6 +62,14 @@ class MainWindow(QWidget):
 
         self.connected_devices = [
         ]
+        self.device_pool = None
+        self.live_engine = None
+        self.live_model_name = None
+        self.model_registry = None
+        self.scanned_devices = []
+        self.device_popup_shown = False
+        self.firmware_load_requested = False
+        self.main_page_shown = False
 
         self.input_directory = ""
         self.to_keep_directory = ""
@@ -89,7 +107,31 @@ class MainWindow(QWidget):
         self.layout = QVBoxLayout(self)
 
         self.show_welcome_label()
-        QTimer.singleShot(5000, self.show_device_popup_and_main_page)
+        QTimer.singleShot(0, self.start_device_discovery)
+
+
+    def start_device_discovery(self):
+        # scanning and firmware flashing run on background threads and report back through signals
+        self.device_scanner = DeviceScanner(self)
+        self.device_scanner.devices_scanned.connect(self.on_devices_scanned)
+        self.device_scanner.scan_failed.connect(self.show_error_popup)
+
+        self.firmware_loader = FirmwareLoader(self)
+        self.firmware_loader.device_ready.connect(self.on_device_ready)
+        self.firmware_loader.device_failed.connect(self.on_device_failed)
+        self.firmware_loader.progress.connect(self.on_firmware_progress)
+        self.firmware_loader.finished.connect(self.on_firmware_loaded)
+
+        self.device_scanner.scan()
+
+
+    def on_devices_scanned(self, device_descriptor_list):
+        self.scanned_devices = device_descriptor_list
+        if not self.device_popup_shown:
+            self.device_popup_shown = True
+            self.show_device_popup_and_main_page()
+        else:
+            self.show_scanned_devices(device_descriptor_list)
 
 
     def show_welcome_label(self):
@@ -102,37 +144,60 @@ class MainWindow(QWidget):
 
     def close_connection_page(self):
         print("closing device connection page")
-        device_descriptors = kp.core.scan_devices()
-        if device_descriptors.device_descriptor_number > 0:
-            for device in device_descriptors.device_descriptor_list:
-                self.parse_and_store_devices(device_descriptors.device_descriptor_list)
-                kp.core.connect_devices(usb_port_ids=[device.usb_port_id])
         self.load_firmware()
         self.popup_window.close()
 
     
     def load_firmware(self):
         print("loading firmware")
-        for device in self.connected_devices:
-            device_group = kp.core.connect_devices(usb_port_ids=[device.get["usb_port_id"]])
-            kp.core.set_timeout(device_group=device_group, milliseconds=5000)
-            SCPU_FW_PATH = f'../../external/res/firmware/{device.get["product_id"]}/fw_scpu.bin'
-            NCPU_FW_PATH = f'../../external/res/firmware/{device.get["product_id"]}/fw_ncpu.bin'
-            kp.core.load_firmware_from_file(device_group=device_group,
-                                            scpu_fw_path=SCPU_FW_PATH,
-                                            ncpu_fw_path=NCPU_FW_PATH)
+        self.firmware_load_requested = True
+        self.stop_live_inference()
+        if self.device_pool is not None:
+            self.device_pool.close()
+            self.device_pool = None
+            self.model_registry = None
+        if self.scanned_devices:
+            # the loader's workers add each dongle to the pool and keep the idle ones busy
+            # warming up the toolbox models, off the GUI thread
+            self.device_pool = DevicePool(devices=[])
+            self.model_registry = ModelRegistry(self.device_pool)
+            self.firmware_loader.load(self.scanned_devices, self.model_registry,
+                                      [path for path in LIVE_MODEL_PATHS.values() if os.path.exists(path)])
+        else:
+            self.main_page()
+
+
+    def on_device_ready(self, device):
+        print(f"device ready at USB port ID {device.usb_port_id}")
+        # the main page appears as soon as the first dongle is usable
+        self.main_page()
+
+
+    def on_device_failed(self, usb_port_id, message):
+        print(f"Error: could not load firmware on device at USB port ID {usb_port_id}: {message}")
+
+
+    def on_firmware_progress(self, done, total):
+        print(f"firmware loaded on {done}/{total} devices")
+
+
+    def on_firmware_loaded(self):
+        if self.device_pool is not None and len(self.device_pool) == 0:
+            self.device_pool = None
+            self.model_registry = None
+        if self.device_pool is None:
+            self.main_page()
+            self.show_error_popup("Could not connect to any Kneron device.")
     
 
-# TODO: load models on multiple dongles (needs new kp api version)
-    def load_models(self, device_group, model_path):
+    def load_models(self, model_path):
         print("loading models")
-        model_nef_descriptor = kp.core.load_model_from_file(device_group=device_group,
-                                                        file_path=model_path)
+        return self.device_pool.load_model(model_path)
 
 # TODO: implement function. general post processing of raw results
     def run_inference(self, image_file_path, device_group, model_nef_descriptor):
-        img_bgr565 = preprocess_image(image_file_path)
-        inf_node_output_list = perform_inference(device_group, model_nef_descriptor, img_bgr565)
+        img_bgr565 = model_preprocessor(model_nef_descriptor)(image_file_path)
+        inf_node_output_list = perform_inference(device_group, model_nef_descriptor, img_bgr565, device_resize=False)
         return inf_node_output_list
 
 
@@ -159,13 +224,15 @@ class MainWindow(QWidget):
 
     def check_available_device(self):
         print("checking available devices")
-        device_descriptors = kp.core.scan_devices()
+        self.device_scanner.scan()
+
+
+    def show_scanned_devices(self, device_descriptor_list):
         self.clear_device_layout(self.device_layout)
 
-        if device_descriptors.device_descriptor_number > 0:
-            if device_descriptors.device_descriptor_number > 0:
-                self.parse_and_store_devices(device_descriptors.device_descriptor_list)
-                self.display_devices(device_descriptors.device_descriptor_list)
+        if device_descriptor_list:
+            self.parse_and_store_devices(device_descriptor_list)
+            self.display_devices(device_descriptor_list)
         else:
             self.show_no_device_gif()
 
@@ -282,18 +349,30 @@ class MainWindow(QWidget):
 
         self.popup_window.show()
 
-        self.check_available_device()
+        self.show_scanned_devices(self.scanned_devices)
 
 
     def show_device_popup_and_main_page(self):
+        # the main page is shown by on_device_ready once the first dongle has its firmware
+        self.firmware_load_requested = False
         self.show_device_connection_popup()
-        self.popup_window.finished.connect(self.main_page)
+        # closing the popup with X or Esc loads the firmware too, not only the Done button
+        self.popup_window.finished.connect(self.on_device_popup_finished)
+
+
+    def on_device_popup_finished(self):
+        if not self.firmware_load_requested:
+            self.load_firmware()
 
 
 
     def clear_device_layout(self, layout):
         for i in reversed(range(layout.count())):
-            layout.itemAt(i).widget().deleteLater()
+            item = layout.takeAt(i)
+            if item.widget() is not None:
+                item.widget().deleteLater()
+            elif item.layout() is not None:
+                self.clear_device_layout(item.layout())
 
     
     def clear_layout(self):
@@ -349,6 +428,7 @@ class MainWindow(QWidget):
 
 
     def stop_camera(self):
+        self.stop_live_inference()
         self.camera.stop()
 
         self.right_layout.replaceWidget(self.video_widget, self.canvas_label)
@@ -387,24 +467,76 @@ class MainWindow(QWidget):
         print(f"Screenshot saved as {file_name}")
 
 
-    def run_face_detection(self):
+    def start_live_inference(self, model_name, model_path=None):
+        model_path = model_path or LIVE_MODEL_PATHS[model_name]
+        if self.device_pool is None:
+            self.show_error_popup("No Kneron device connected.")
+            return
+        if not os.path.exists(model_path):
+            self.show_error_popup(f"Model file not found: {model_path}")
+            return
+
+        self.stop_live_inference()
         self.start_camera()
-        print("Running Face Detection")
+        # the engine leases the dongle on its worker, reusing one that already has this model resident
+        self.live_engine = LiveInferenceEngine(self.camera, self.model_registry, model_path, self)
+        self.live_model_name = model_name
+        self.live_engine.model_ready.connect(self.on_live_model_ready)
+        self.live_engine.failed.connect(self.on_live_inference_failed)
+        self.live_engine.result_ready.connect(self.show_live_result)
+        self.live_engine.stats_updated.connect(self.show_live_stats)
+        self.live_result_label.setText(f"{model_name}: loading model")
+        self.live_result_label.show()
+        self.live_engine.start()
+        print(f"Running {model_name}")
+
+
+    def stop_live_inference(self):
+        if self.live_engine is not None:
+            self.live_engine.stop()
+            self.live_engine = None
+            self.live_result_label.hide()
+
+
+    def on_live_model_ready(self):
+        if self.sender() is not self.live_engine:
+            return
+        self.live_result_label.setText(f"{self.live_model_name}: waiting for frames")
+
+
+    def on_live_inference_failed(self, message):
+        if self.sender() is not self.live_engine:
+            return
+        self.stop_live_inference()
+        self.show_error_popup(f"Could not start {self.live_model_name}: {message}")
+
+
+    def show_live_result(self, inf_node_output_list):
+        # runs on the GUI thread; the signal is queued from the inference worker
+        if self.live_engine is None:
+            return
+        self.live_result_label.setText(f"{self.live_model_name}: {first_output_value(inf_node_output_list):.3f}")
+
+
+    def show_live_stats(self, fps, latency_ms, dropped_frames):
+        self.setWindowTitle(f'Innovedus AI Playground - {fps:.1f} FPS, {latency_ms:.0f} ms latency')
+        print(f"{fps:.1f} FPS, {latency_ms:.0f} ms latency, {dropped_frames} stale frames dropped")
+
+
+    def run_face_detection(self):
+        self.start_live_inference('Face Detection')
 
 
     def run_gender_age_detection(self):
-        self.start_camera()
-        print("Running Gender/Age Detection")
+        self.start_live_inference('Gender/Age Detection')
 
 
     def run_object_detection(self):
-        self.start_camera()
-        print("Running Object Detection")
+        self.start_live_inference('Object Detection')
 
 
     def run_mask_detection(self):
-        self.start_camera()
-        print("Running Mask Detection")
+        self.start_live_inference('Mask Detection')
 
 
     def choose_folder(self):
@@ -569,6 +701,9 @@ class MainWindow(QWidget):
 
 
     def main_page(self):
+        if self.main_page_shown:
+            return
+        self.main_page_shown = True
         self.clear_device_layout(self.layout)
         self.setWindowTitle('Innovedus AI Playground')
         self.setGeometry(100, 100, *WINDOW_SIZE)
@@ -667,6 +802,12 @@ class MainWindow(QWidget):
         self.canvas_label.setStyleSheet("border: 1px transparent; background: gray; border-radius: 20px; ")  
         self.right_layout.addWidget(self.canvas_label)
 
+        self.live_result_label = QLabel(self)
+        self.live_result_label.setAlignment(Qt.AlignCenter)
+        self.live_result_label.setStyleSheet("color: white; background: black; border-radius: 10px; padding: 5px;")
+        self.live_result_label.hide()
+        self.right_layout.addWidget(self.live_result_label)
+
         button_overlay_layout = QVBoxLayout()
         button_overlay_layout.setContentsMargins(0, 0, 0, 0)
 
@@ -705,8 +846,10 @@ class MainWindow(QWidget):
             if model_file:
                 if model_file.endswith('.nef'):
                     model_name = os.path.basename(model_file)
-                    self.model_buttons.insert(-1, (model_name, self.run_uploaded_model))
+                    self.model_buttons.insert(-1, (model_name, functools.partial(self.run_uploaded_model, model_file)))
                     print(f"Model uploaded: {model_name}")
+                    if self.model_registry is not None:
+                        self.model_registry.preload([model_file])
                     self.refresh_model_buttons()
                 else:
                     self.show_error_popup("Invalid file format. Please upload a .nef file.")
@@ -723,8 +866,9 @@ class MainWindow(QWidget):
         self.add_model_buttons(layout)
 
 
-    def run_uploaded_model(self):
+    def run_uploaded_model(self, model_file, checked=False):
         print("Running uploaded model")
+        self.start_live_inference(os.path.basename(model_file), model_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+import itertools
+import os
+import threading
+import numpy as np
+import kp
+from demogui.utils import get_model_input_size, perform_inference
+
+
+class NefModel:
+    """A NEF read from disk once; its bytes are reused for every upload to a dongle."""
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.name = os.path.basename(model_path)
+        with open(model_path, 'rb') as f:
+            self.nef_buffer = f.read()
+        self.size = len(self.nef_buffer)
+
+
+class ModelLease:
+    """Exclusive use of a dongle with a model resident on it, held until release() so it is not evicted mid-use."""
+
+    def __init__(self, registry, device, model_nef_descriptor):
+        self.registry = registry
+        self.device = device
+        self.device_group = device.device_group
+        self.model_nef_descriptor = model_nef_descriptor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def release(self):
+        if self.device is not None:
+            self.registry._release(self.device)
+            self.device = None
+
+
+class ModelRegistry:
+    """Tracks which NEF is resident on which dongle of a DevicePool and evicts least-recently-used ones.
+
+    Uploading a NEF replaces whatever the dongle held before, so each dongle hosts one NEF and the
+    LRU runs across dongles: with N sticks, the N most recently used models stay resident and
+    switching between them costs nothing. Newly loaded models get a warm-up inference so the
+    first real request does not pay the cold-start cost.
+    device_memory_limits optionally maps product id to the bytes available for a NEF on that chip.
+    Model loads and preload failures are reported to log.
+    """
+
+    def __init__(self, device_pool, device_memory_limits=None, warm_up=True, log=print):
+        self.device_pool = device_pool
+        self.log = log
+        self.device_memory_limits = device_memory_limits or {}
+        self.warm_up = warm_up
+        self.models = {}
+        self.condition = threading.Condition()
+        self.clock = itertools.count(1)
+        self.busy = {}
+        self.last_used = {}
+        self.preloading = set()
+
+    def register(self, model_path):
+        """Read and remember a NEF; registering the same path again is free."""
+        model_path = os.path.abspath(model_path)
+        with self.condition:
+            model = self.models.get(model_path)
+            if model is None:
+                model = NefModel(model_path)
+                self.models[model_path] = model
+            return model
+
+    def resident_models(self):
+        """Map of usb_port_id -> resident model path."""
+        return {device.usb_port_id: device.model_path for device in self.device_pool.devices}
+
+    def _fits(self, device, model):
+        limit = self.device_memory_limits.get(device.product_id)
+        return limit is None or model.size <= limit
+
+    def _choose_device(self, model):
+        """Pick a device for model: where it is resident, else an empty one, else the least recently used."""
+        devices = [device for device in self.device_pool.devices if self._fits(device, model)]
+        if not devices:
+            raise ValueError(f"{model.name} ({model.size} bytes) does not fit on any connected device")
+        idle = [device for device in devices if not self.busy.get(device.usb_port_id)]
+        resident = [device for device in idle if device.model_path == model.model_path]
+        if resident:
+            return resident[0], True
+        if not idle:
+            return None, False
+        empty = [device for device in idle if device.model_path is None]
+        if empty:
+            return empty[0], False
+        return min(idle, key=lambda d: self.last_used.get(d.usb_port_id, 0)), False
+
+    def acquire(self, model_path, cancel=None):
+        """Return a ModelLease for a dongle with model_path resident, loading it if needed.
+
+        Blocks while every suitable dongle is leased by someone else. With a cancel event, the wait
+        ends once it is set and None is returned instead.
+        """
+        model = self.register(model_path)
+        with self.condition:
+            while True:
+                device, resident = self._choose_device(model)
+                if device is not None:
+                    break
+                if cancel is not None and cancel.is_set():
+                    return None
+                self.condition.wait(timeout=None if cancel is None else 0.1)
+            self.busy[device.usb_port_id] = self.busy.get(device.usb_port_id, 0) + 1
+            self.last_used[device.usb_port_id] = next(self.clock)
+
+        if not resident:
+            try:
+                self._load(device, model)
+            except Exception:
+                self._release(device)
+                raise
+        return ModelLease(self, device, device.model_nef_descriptor)
+
+    def acquire_all(self, model_paths):
+        """Lease every idle dongle, shared out between model_paths; returns a list of ModelLeases per model.
+
+        The dongles are dealt out to the models in turn, so every model gets about the same number.
+        A model takes a dongle it is already resident on if there is one, else an empty one, else the
+        least recently used one that holds none of the other models. Blocks until at least one dongle
+        per model is idle; the models missing on their dongles are loaded in parallel.
+        """
+        models = [self.register(model_path) for model_path in model_paths]
+        wanted = {model.model_path for model in models}
+        with self.condition:
+            while True:
+                idle = [device for device in self.device_pool.devices if not self.busy.get(device.usb_port_id)]
+                if len(idle) >= len(models):
+                    break
+                self.condition.wait()
+            assigned = [[] for _ in models]
+            while idle:
+                dealt = False
+                for model, devices in zip(models, assigned):
+                    candidates = [device for device in idle if self._fits(device, model)]
+                    if not candidates:
+                        continue
+                    resident = [device for device in candidates if device.model_path == model.model_path]
+                    empty = [device for device in candidates if device.model_path is None]
+                    unwanted = [device for device in candidates if device.model_path not in wanted]
+                    device = (resident or empty or
+                              [min(unwanted or candidates, key=lambda d: self.last_used.get(d.usb_port_id, 0))])[0]
+                    idle.remove(device)
+                    devices.append(device)
+                    dealt = True
+                    if not idle:
+                        break
+                if not dealt:
+                    break
+            for model, devices in zip(models, assigned):
+                if not devices:
+                    raise ValueError(f"{model.name} ({model.size} bytes) does not fit on any idle device")
+            for devices in assigned:
+                for device in devices:
+                    self.busy[device.usb_port_id] = self.busy.get(device.usb_port_id, 0) + 1
+                    self.last_used[device.usb_port_id] = next(self.clock)
+
+        errors = []
+
+        def load(device, model):
+            try:
+                self._load(device, model)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load, args=(device, model), daemon=True)
+                   for model, devices in zip(models, assigned) for device in devices
+                   if device.model_path != model.model_path]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            for devices in assigned:
+                for device in devices:
+                    self._release(device)
+            raise errors[0]
+        return [[ModelLease(self, device, device.model_nef_descriptor) for device in devices] for devices in assigned]
+
+    def _release(self, device):
+        with self.condition:
+            self.busy[device.usb_port_id] -= 1
+            self.condition.notify_all()
+
+    def _load(self, device, model):
+        self.log(f"loading {model.name} on device at USB port ID {device.usb_port_id}")
+        device.model_path = None
+        device.model_nef_descriptor = kp.core.load_model(device_group=device.device_group, nef_buffer=model.nef_buffer)
+        device.model_path = model.model_path
+        if self.warm_up:
+            self._warm_up(device)
+
+    def _warm_up(self, device):
+        width, height = get_model_input_size(device.model_nef_descriptor)
+        blank_bgr565 = np.zeros((height, width, 2), dtype=np.uint8)
+        perform_inference(device.device_group, device.model_nef_descriptor, blank_bgr565, device_resize=False)
+
+    def preload(self, model_paths):
+        """Load models that are not resident anywhere onto idle, empty dongles in the background.
+
+        Returns the background thread at once: the NEFs are read from disk and uploaded off the
+        calling thread, so the GUI can call this from a slot.
+        """
+        thread = threading.Thread(target=self._preload, args=(list(model_paths),), name="preload", daemon=True)
+        thread.start()
+        return thread
+
+    def _preload(self, model_paths):
+        threads = []
+        for model_path in model_paths:
+            try:
+                model = self.register(model_path)
+            except OSError as e:
+                self.log(f"Error: could not preload {model_path}: {e}")
+                continue
+            with self.condition:
+                if (model.model_path in self.preloading
+                        or any(device.model_path == model.model_path for device in self.device_pool.devices)):
+                    continue
+                empty = [device for device in self.device_pool.devices
+                         if device.model_path is None and not self.busy.get(device.usb_port_id)
+                         and self._fits(device, model)]
+                if not empty:
+                    break
+                device = empty[0]
+                self.busy[device.usb_port_id] = self.busy.get(device.usb_port_id, 0) + 1
+                self.last_used[device.usb_port_id] = next(self.clock)
+                self.preloading.add(model.model_path)
+
+            def load(device=device, model=model):
+                try:
+                    self._load(device, model)
+                except Exception as e:
+                    self.log(f"Error: could not preload {model.name}: {e}")
+                finally:
+                    with self.condition:
+                        self.preloading.discard(model.model_path)
+                    self._release(device)
+
+            thread = threading.Thread(target=load, name=f"preload-{model.name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,158 @@
+import collections
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from demogui import tracing
+
+HASH_SIZE = 8
+NEAR_DUPLICATE_DISTANCE = 4
+HASH_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+HASH_INDEX_VERSION = 1
+
+
+def dhash(gray, hash_size=HASH_SIZE):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a (hash_size+1) x hash_size thumbnail."""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return _pack_bits(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray, hash_size=HASH_SIZE):
+    """DCT hash: whether each low-frequency DCT coefficient of a 32 x 32 thumbnail is above their median."""
+    small = cv2.resize(gray, (4 * hash_size, 4 * hash_size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size].reshape(-1)
+    # the DC term only carries overall brightness
+    return _pack_bits(low > np.median(low[1:]))
+
+
+HASH_FUNCTIONS = {'dhash': dhash, 'phash': phash}
+
+
+def _pack_bits(bits):
+    return int.from_bytes(np.packbits(bits.reshape(-1)).tobytes(), 'big')
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+
+def image_hash(image_file_path, method='dhash'):
+    """Perceptual hash of an image file.
+
+    The image is decoded at 1/8 scale in grayscale, which libjpeg does in the DCT domain, so this costs
+    a fraction of the full decode that preprocessing does.
+    """
+    with tracing.span('cv2.imread.reduced'):
+        gray = cv2.imread(image_file_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        raise ValueError(f"could not decode image {image_file_path}")
+    return HASH_FUNCTIONS[method](gray)
+
+
+class PerceptualHashIndex:
+    """On-disk table of perceptual hashes keyed by path, size and mtime, so unchanged photos are hashed once."""
+
+    def __init__(self, cache_directory, method='dhash', workers=HASH_WORKERS):
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"unknown hash method {method!r}, expected one of {sorted(HASH_FUNCTIONS)}")
+        self.method = method
+        self.workers = workers
+        self.index_path = os.path.join(cache_directory, f"perceptual_hashes_{method}.json")
+        self.lock = threading.Lock()
+        self.hashes = {}  # path -> [size, mtime_ns, hash as hex]
+        self.computed = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get('version') == HASH_INDEX_VERSION:
+                self.hashes = index['hashes']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def hash(self, image_file_path, stat_result=None):
+        if stat_result is None:
+            stat_result = os.stat(image_file_path)
+        known = self.hashes.get(image_file_path)
+        if known is not None and known[0] == stat_result.st_size and known[1] == stat_result.st_mtime_ns:
+            return int(known[2], 16)
+        hash_value = image_hash(image_file_path, self.method)
+        with self.lock:
+            self.hashes[image_file_path] = [stat_result.st_size, stat_result.st_mtime_ns, format(hash_value, 'x')]
+            self.computed += 1
+        return hash_value
+
+    def hash_images(self, image_file_paths, stat_results=None):
+        """Yield (image_file_path, hash) in input order, hashing on a thread pool a bounded distance ahead.
+
+        image_file_paths may be a generator; it is consumed only as fast as hashing keeps up.
+        Images that cannot be decoded get the hash None.
+        """
+        stat_results = stat_results or {}
+
+        def hash_or_none(image_file_path):
+            try:
+                return self.hash(image_file_path, stat_results.get(image_file_path))
+            except (OSError, ValueError):
+                return None
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='phash') as executor:
+            for image_file_path in image_file_paths:
+                pending.append((image_file_path, executor.submit(hash_or_none, image_file_path)))
+                if len(pending) >= 4 * self.workers:
+                    image_file_path, future = pending.popleft()
+                    yield image_file_path, future.result()
+            while pending:
+                image_file_path, future = pending.popleft()
+                yield image_file_path, future.result()
+
+    def flush(self):
+        with self.lock:
+            hashes = dict(self.hashes)
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': HASH_INDEX_VERSION, 'method': self.method, 'hashes': hashes}, f)
+            os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+
+
+class NearDuplicateGrouper:
+    """Groups images whose perceptual hashes differ in at most max_distance bits, one image at a time.
+
+    The first image of a group is its representative; add() returns the representative a new image
+    belongs to, which is the image itself when nothing close was seen before. Hashes are split into
+    max_distance + 1 bands and bucketed by each band: two hashes within max_distance bits agree
+    exactly on at least one band, so only images sharing a bucket are compared and grouping stays
+    near linear in the album size.
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE, hash_bits=HASH_SIZE * HASH_SIZE):
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        band_bits = -(-hash_bits // num_bands)
+        self.bands = [(offset, (1 << min(band_bits, hash_bits - offset)) - 1)
+                      for offset in range(0, hash_bits, band_bits)]
+        self.buckets = [{} for _ in self.bands]
+        self.representatives = {}  # representative -> hash
+        self.groups = {}  # representative -> [members, excluding the representative]
+
+    def add(self, key, hash_value):
+        keys = [(hash_value >> offset) & mask for offset, mask in self.bands]
+        for band, band_key in enumerate(keys):
+            for representative in self.buckets[band].get(band_key, ()):
+                if hamming_distance(hash_value, self.representatives[representative]) <= self.max_distance:
+                    self.groups[representative].append(key)
+                    return representative
+        self.representatives[key] = hash_value
+        self.groups[key] = []
+        for band, band_key in enumerate(keys):
+            self.buckets[band].setdefault(band_key, []).append(key)
+        return key
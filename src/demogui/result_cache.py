@@ -0,0 +1,168 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'demogui')
+HASH_CHUNK_SIZE = 1 << 20
+DIGEST_SIZE = 16
+
+
+def file_digest(file_path):
+    """Hash the contents of a file."""
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_identity(model_path):
+    """Identify a NEF by its contents so a rebuilt model with the same file name invalidates the cache."""
+    return file_digest(model_path)
+
+
+class ResultCache:
+    """Content-addressed, size-bounded on-disk cache of per-image model outputs.
+
+    Entries are keyed by the image content hash, the NEF model identity and the preprocessing
+    parameters. Each (model, preprocessing) pair gets its own directory holding a fixed-width
+    float32 memory-mapped value store plus a JSON index kept in least-recently-used order.
+    A path+size+mtime table lets unchanged files skip re-hashing on later runs.
+    The digest owning each slot is stored next to its values and checked on every get(), so an
+    index left behind by a crash never serves a slot that was since evicted and reused.
+    Hit and miss counts go to log on close(), if given.
+    """
+
+    def __init__(self, cache_directory, model_path, width=1, preprocess_params=None, max_entries=200000, log=None):
+        params = json.dumps(preprocess_params or {}, sort_keys=True)
+        namespace = model_identity(model_path)[:16] + '_' + hashlib.blake2b(params.encode(), digest_size=8).hexdigest()
+        self.directory = os.path.join(cache_directory, namespace)
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.values_path = os.path.join(self.directory, 'values.f32')
+        self.digests_path = os.path.join(self.directory, 'digests.bin')
+        self.width = width
+        self.log = log
+        self.capacity = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.entries = collections.OrderedDict()  # digest -> slot, oldest first
+        self.stat_digests = {}  # path -> [size, mtime_ns, digest]
+        index = None
+        if all(os.path.exists(path) for path in (self.index_path, self.values_path, self.digests_path)):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get('width') != width or index.get('capacity') != max_entries:
+                index = None
+
+        mode = 'w+' if index is None else 'r+'
+        self.values = np.memmap(self.values_path, dtype=np.float32, mode=mode, shape=(self.capacity, width))
+        self.digests = np.memmap(self.digests_path, dtype=np.uint8, mode=mode, shape=(self.capacity, DIGEST_SIZE))
+        if index is not None:
+            self.entries.update(index['entries'])
+            self.stat_digests = index['stat_digests']
+        used = set(self.entries.values())
+        self.free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def digest(self, image_file_path, stat_result=None):
+        """Content digest of an image, reusing the stored one when path, size and mtime are unchanged."""
+        if stat_result is None:
+            stat_result = os.stat(image_file_path)
+        known = self.stat_digests.get(image_file_path)
+        if known is not None and known[0] == stat_result.st_size and known[1] == stat_result.st_mtime_ns:
+            return known[2]
+        digest = file_digest(image_file_path)
+        with self.lock:
+            self.stat_digests[image_file_path] = [stat_result.st_size, stat_result.st_mtime_ns, digest]
+        return digest
+
+    def get(self, image_file_path, stat_result=None):
+        """Return a copy of the cached values for an image, or None."""
+        digest = self.digest(image_file_path, stat_result)
+        with self.lock:
+            slot = self.entries.get(digest)
+            if slot is not None and self.digests[slot].tobytes() != bytes.fromhex(digest):
+                # the slot was reused after the index on disk was written
+                del self.entries[digest]
+                self.free_slots.append(slot)
+                slot = None
+            if slot is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return np.array(self.values[slot])
+
+    def put(self, image_file_path, values, stat_result=None):
+        digest = self.digest(image_file_path, stat_result)
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        if values.size != self.width:
+            raise ValueError(f"expected {self.width} values, got {values.size}")
+        with self.lock:
+            slot = self.entries.get(digest)
+            if slot is None:
+                if self.free_slots:
+                    slot = self.free_slots.pop()
+                else:
+                    _, slot = self.entries.popitem(last=False)
+                self.entries[digest] = slot
+            else:
+                self.entries.move_to_end(digest)
+            # claim the slot before overwriting its values, so a crash in between cannot pair old values with
+            # the new digest or new values with the old one
+            self.digests[slot] = np.frombuffer(bytes.fromhex(digest), dtype=np.uint8)
+            self.values[slot] = values
+
+    def process_images(self, image_file_paths, compute):
+        """Yield (image_file_path, values) for every path, calling compute(missing_paths) only for cache misses.
+
+        compute must yield (image_file_path, values) pairs. Cache hits are yielded first.
+        """
+        missing = []
+        for image_file_path in image_file_paths:
+            values = self.get(image_file_path)
+            if values is None:
+                missing.append(image_file_path)
+            else:
+                yield image_file_path, values
+        if missing:
+            for image_file_path, values in compute(missing):
+                self.put(image_file_path, values)
+                yield image_file_path, np.asarray(values, dtype=np.float32).reshape(-1)
+
+    def flush(self):
+        with self.lock:
+            self.digests.flush()
+            self.values.flush()
+            live = set(self.entries)
+            stat_digests = {path: known for path, known in self.stat_digests.items() if known[2] in live}
+            index = {
+                'width': self.width,
+                'capacity': self.capacity,
+                'entries': self.entries,
+                'stat_digests': stat_digests,
+            }
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+        if self.log is not None:
+            self.log(f"Result cache {self.directory}: {self.hits} hits, {self.misses} misses, "
+                     f"{len(self.entries)} entries")
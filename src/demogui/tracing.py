@@ -0,0 +1,197 @@
+import array
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+TRACE_ENVIRONMENT_VARIABLE = 'DEMOGUI_TRACE'
+MAX_EVENTS = 1000000
+
+_enabled = False
+_lock = threading.Lock()
+_events = []
+_durations = {}
+_thread_names = {}
+_dropped = 0
+_origin_ns = time.perf_counter_ns()
+
+
+class _NullSpan:
+    """What span() returns while tracing is off: entering and leaving it does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+def _record(name, start_ns, duration_ns, args):
+    global _dropped
+    thread_id = threading.get_ident()
+    with _lock:
+        durations = _durations.get(name)
+        if durations is None:
+            durations = _durations[name] = array.array('q')
+        durations.append(duration_ns)
+        if len(_events) < MAX_EVENTS:
+            _events.append((name, start_ns, duration_ns, thread_id, args))
+            if thread_id not in _thread_names:
+                _thread_names[thread_id] = threading.current_thread().name
+        else:
+            _dropped += 1
+
+
+def span(name, **args):
+    """Time the enclosed block as stage name, e.g. ``with tracing.span('cv2.imread'):``.
+
+    While tracing is disabled this returns a shared no-op object, so an instrumented block costs one
+    function call and a flag check.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args or None)
+
+
+def traced(name):
+    """Decorator form of span() for whole functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forget everything recorded so far."""
+    global _dropped
+    with _lock:
+        _events.clear()
+        _durations.clear()
+        _thread_names.clear()
+        _dropped = 0
+
+
+def chrome_trace():
+    """The recorded spans in Chrome trace event format (chrome://tracing, ui.perfetto.dev)."""
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+        dropped = _dropped
+    trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}}
+                    for thread_id, thread_name in thread_names.items()]
+    for name, start_ns, duration_ns, thread_id, args in events:
+        event = {'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': thread_id,
+                 'ts': (start_ns - _origin_ns) / 1000, 'dur': duration_ns / 1000}
+        if args:
+            event['args'] = args
+        trace_events.append(event)
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': {'dropped_events': dropped}}
+
+
+def write_chrome_trace(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(), f)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def stage_summary():
+    """Per-stage count, total and latency percentiles in ms, plus a power-of-two histogram of durations.
+
+    The histogram maps the upper bound of each bucket in microseconds to the number of spans in it.
+    """
+    with _lock:
+        snapshot = {name: sorted(durations) for name, durations in _durations.items()}
+    summary = {}
+    for name, durations in snapshot.items():
+        histogram = {}
+        for duration_ns in durations:
+            bucket = 1 << max(0, (duration_ns // 1000).bit_length())
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        total = sum(durations)
+        summary[name] = {
+            'count': len(durations),
+            'total_ms': total / 1e6,
+            'mean_ms': total / len(durations) / 1e6,
+            'p50_ms': _percentile(durations, 0.50) / 1e6,
+            'p90_ms': _percentile(durations, 0.90) / 1e6,
+            'p99_ms': _percentile(durations, 0.99) / 1e6,
+            'max_ms': durations[-1] / 1e6,
+            'histogram_us': {str(bucket): count for bucket, count in sorted(histogram.items())},
+        }
+    return summary
+
+
+def write_summary(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stage_summary(), f, indent=2)
+
+
+def format_summary():
+    """Stage summary as a text table, slowest total first."""
+    summary = stage_summary()
+    lines = [f"{'stage':45s} {'count':>8s} {'total ms':>11s} {'mean ms':>9s} {'p50 ms':>9s} {'p99 ms':>9s}"]
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total_ms']):
+        lines.append(f"{name:45s} {stats['count']:8d} {stats['total_ms']:11.1f} {stats['mean_ms']:9.3f} "
+                     f"{stats['p50_ms']:9.3f} {stats['p99_ms']:9.3f}")
+    return '\n'.join(lines)
+
+
+def trace_to_file(path):
+    """Enable tracing now and write the Chrome trace to path, and the stage summary next to it, at exit."""
+    def write():
+        write_chrome_trace(path)
+        write_summary(os.path.splitext(path)[0] + '.summary.json')
+
+    enable()
+    atexit.register(write)
+
+
+if os.environ.get(TRACE_ENVIRONMENT_VARIABLE):
+    trace_to_file(os.environ[TRACE_ENVIRONMENT_VARIABLE])
@@ -1,41 +1,332 @@
+import collections.abc
+import functools
 import os
+import queue
+import re
+import threading
 import cv2
 import kp
 import numpy as np
-import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 from sklearn.cluster import DBSCAN
+from demogui import tracing
 
 
 # -------------------- General Dongle Connection -------------------------------#
+FIRMWARE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'external', 'res', 'firmware')
+PRODUCT_ID_TO_CHIP = {
+    0x100: 'KL520',
+    0x720: 'KL720',
+    0x630: 'KL630',
+    0x732: 'KL730',
+}
+
+
+def get_firmware_paths(product_id):
+    """Return (scpu_fw_path, ncpu_fw_path) for a dongle product id, or None if it boots from flash."""
+    chip = PRODUCT_ID_TO_CHIP.get(product_id, 'KL520')
+    scpu_fw_path = os.path.join(FIRMWARE_DIRECTORY, chip, 'fw_scpu.bin')
+    ncpu_fw_path = os.path.join(FIRMWARE_DIRECTORY, chip, 'fw_ncpu.bin')
+    if os.path.exists(scpu_fw_path) and os.path.exists(ncpu_fw_path):
+        return scpu_fw_path, ncpu_fw_path
+    return None
+
+
+def connect_device(usb_port_id, product_id, timeout_ms=5000):
+    """Connect a single dongle and load its firmware; returns the device group."""
+    device_group = kp.core.connect_devices(usb_port_ids=[usb_port_id])
+    kp.core.set_timeout(device_group=device_group, milliseconds=timeout_ms)
+    firmware_paths = get_firmware_paths(product_id)
+    if firmware_paths is not None:
+        scpu_fw_path, ncpu_fw_path = firmware_paths
+        kp.core.load_firmware_from_file(device_group=device_group,
+                                        scpu_fw_path=scpu_fw_path,
+                                        ncpu_fw_path=ncpu_fw_path)
+    return device_group
+
+
 def connect_and_load_firmware(device_descriptors):
     # device_descriptors = kp.core.scan_devices()
     if 0 < device_descriptors.device_descriptor_number:
+        device_groups = []
         for device in device_descriptors.device_descriptor_list:
-            usb_port_id = device.usb_port_id
-            device_group = kp.core.connect_devices(usb_port_ids=[usb_port_id])
-            kp.core.set_timeout(device_group=device_group, milliseconds=5000)
-            SCPU_FW_PATH = '../../res/firmware/KL520/fw_scpu.bin'
-            NCPU_FW_PATH = '../../res/firmware/KL520/fw_ncpu.bin'
-            kp.core.load_firmware_from_file(device_group=device_group,
-                                            scpu_fw_path=SCPU_FW_PATH,
-                                            ncpu_fw_path=NCPU_FW_PATH)
+            device_groups.append(connect_device(device.usb_port_id, device.product_id))
+        return device_groups
     else:
         print('Error: no Kneron device connect.')
         exit(0)
 
 
-def list_image_files(directory):
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+WATCH_INTERVAL = 2.0
+
+
+def list_image_files(directory, recursive=False):
     """List all image files in a given directory."""
-    valid_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif') 
-    return [os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(valid_extensions)]
+    return [image_file_path for image_file_path, _ in scan_image_files(directory, recursive=recursive)]
+
+
+def _scan_directory(directory, recursive, exclude, directories, log=print):
+    """Depth-first os.scandir walk yielding (image_file_path, stat_result); records directory mtimes."""
+    stack = [directory]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                if directories is not None:
+                    directories[path] = os.stat(path).st_mtime_ns
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and os.path.realpath(entry.path) not in exclude:
+                                stack.append(entry.path)
+                        elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        # removed or unreadable while we walked past it
+                        continue
+        except OSError as e:
+            if path == directory:
+                raise
+            log(f"Warning: skipping {path}: {e}")
+
+
+def scan_image_files(directory, recursive=True, exclude=None, log=print):
+    """Yield (image_file_path, stat_result) for the images under directory while the walk is running.
+
+    The tree is walked with os.scandir, so the stat result comes with the directory listing where
+    the platform provides it and costs one stat otherwise; pass it on (e.g. to ResultCache) instead
+    of statting again. Directories in exclude, such as output directories inside the album, and
+    symlinked directories are not entered. Order is the order of the directory listings.
+    Subdirectories that cannot be listed are skipped with a warning sent to log.
+    """
+    exclude = {os.path.realpath(path) for path in exclude or ()}
+    return _scan_directory(directory, recursive, exclude, None, log)
+
+
+class ImageDirectoryWatcher:
+    """Finds images added to a directory tree since the last look, without rescanning the whole tree.
+
+    scan() walks the tree once like scan_image_files and remembers the mtime of every directory.
+    poll() then stats only the directories; the ones whose mtime changed are listed again, so an
+    idle tree of a few hundred thousand photos in date folders costs one stat per folder. A new file
+    is only reported once its size and mtime are the same on two consecutive polls, so photos that
+    are still being copied in are not picked up half-written.
+    """
+
+    def __init__(self, directory, exclude=None, log=print):
+        self.directory = directory
+        self.log = log
+        self.exclude = {os.path.realpath(path) for path in exclude or ()}
+        self.directories = {}
+        self.seen = set()
+        self.settling = {}
+
+    def scan(self):
+        """Walk the whole tree, yielding (image_file_path, stat_result) for every image found."""
+        photos = _scan_directory(self.directory, True, self.exclude, self.directories, self.log)
+        for image_file_path, stat_result in photos:
+            self.seen.add(image_file_path)
+            yield image_file_path, stat_result
+
+    def _new_files(self):
+        for path, mtime_ns in list(self.directories.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                del self.directories[path]
+                continue
+            if current == mtime_ns:
+                continue
+            self.directories[path] = current
+            try:
+                with os.scandir(path) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self.directories and os.path.realpath(entry.path) not in self.exclude:
+                            yield from _scan_directory(entry.path, True, self.exclude, self.directories,
+                                                       self.log)
+                    elif (entry.path not in self.seen and entry.name.lower().endswith(IMAGE_EXTENSIONS)
+                          and entry.is_file()):
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+    def poll(self):
+        """Return [(image_file_path, stat_result)] for images that appeared and settled since the last poll."""
+        settled = []
+        for image_file_path, previous in list(self.settling.items()):
+            try:
+                stat_result = os.stat(image_file_path)
+            except OSError:
+                del self.settling[image_file_path]
+                continue
+            if (stat_result.st_size, stat_result.st_mtime_ns) == previous:
+                del self.settling[image_file_path]
+                self.seen.add(image_file_path)
+                settled.append((image_file_path, stat_result))
+            else:
+                self.settling[image_file_path] = (stat_result.st_size, stat_result.st_mtime_ns)
+        for image_file_path, stat_result in self._new_files():
+            if image_file_path not in self.settling:
+                self.settling[image_file_path] = (stat_result.st_size, stat_result.st_mtime_ns)
+        return settled
+
+
+def watch_image_files(directory, interval=WATCH_INTERVAL, stop_event=None, exclude=None):
+    """Yield (image_file_path, stat_result) for every image under directory, then for each new one as it appears.
+
+    Polls every interval seconds until stop_event is set; see ImageDirectoryWatcher.
+    """
+    stop_event = stop_event or threading.Event()
+    watcher = ImageDirectoryWatcher(directory, exclude)
+    yield from watcher.scan()
+    while not stop_event.wait(interval):
+        yield from watcher.poll()
+
+
+# -------------------- Raw Frame Input -------------------------------#
+# pixel format token used in raw dump file names -> (kp.ImageFormat member, bytes per pixel)
+RAW_IMAGE_FORMATS = {
+    'rgb565': ('KP_IMAGE_FORMAT_RGB565', 2),
+    'rgba8888': ('KP_IMAGE_FORMAT_RGBA8888', 4),
+    'raw8': ('KP_IMAGE_FORMAT_RAW8', 1),
+    'yuyv': ('KP_IMAGE_FORMAT_YUYV', 2),
+    'yuyv422': ('KP_IMAGE_FORMAT_YUYV', 2),
+    'yuv420p': ('KP_IMAGE_FORMAT_YUV420', 1.5),
+    'cby0cry1': ('KP_IMAGE_FORMAT_YCBCR422_CBY0CRY1', 2),
+    'cby1cry0': ('KP_IMAGE_FORMAT_YCBCR422_CBY1CRY0', 2),
+    'cry0cby1': ('KP_IMAGE_FORMAT_YCBCR422_CRY0CBY1', 2),
+    'cry1cby0': ('KP_IMAGE_FORMAT_YCBCR422_CRY1CBY0', 2),
+    'y0cby1cr': ('KP_IMAGE_FORMAT_YCBCR422_Y0CBY1CR', 2),
+    'y0cry1cb': ('KP_IMAGE_FORMAT_YCBCR422_Y0CRY1CB', 2),
+    'y1cby0cr': ('KP_IMAGE_FORMAT_YCBCR422_Y1CBY0CR', 2),
+    'y1cry0cb': ('KP_IMAGE_FORMAT_YCBCR422_Y1CRY0CB', 2),
+}
+# e.g. bike_cars_street_224x224_cby0cry1.bin, people_talk_in_street_640x640_rgba8888_normalized.bin
+RAW_IMAGE_NAME_PATTERN = re.compile(r'_(\d+)x(\d+)_([a-z0-9]+?)(_normalized)?\.(?:bin|yuv|raw)$', re.IGNORECASE)
+
+
+def parse_raw_image_name(file_path):
+    """Return (width, height, pixel_format, normalized) parsed from a raw dump file name, or None."""
+    match = RAW_IMAGE_NAME_PATTERN.search(os.path.basename(file_path))
+    if match is None or match.group(3).lower() not in RAW_IMAGE_FORMATS:
+        return None
+    return int(match.group(1)), int(match.group(2)), match.group(3).lower(), match.group(4) is not None
+
+
+class PlanarFrame:
+    """A memory-mapped planar frame (YUV420p) and its size.
+
+    kp.GenericInputNodeImage reads the size of an array image from its shape and only accepts 2-D
+    arrays for RAW8, so planar data is handed to it as bytes with an explicit width and height.
+    """
+
+    def __init__(self, data, width, height):
+        self.data = data
+        self.width = width
+        self.height = height
+
+
+def load_raw_image(file_path, width=None, height=None, pixel_format=None):
+    """Memory-map a raw frame dump as the array kp.GenericInputNodeImage expects, without decoding or copying.
+
+    Missing width, height or pixel_format are taken from the file name. Returns (image, image_format);
+    yuv420p frames come back as a PlanarFrame.
+    """
+    if width is None or height is None or pixel_format is None:
+        parsed = parse_raw_image_name(file_path)
+        if parsed is None:
+            raise ValueError(f"cannot infer width, height and pixel format from {file_path}")
+        width = width or parsed[0]
+        height = height or parsed[1]
+        pixel_format = pixel_format or parsed[2]
+    image_format_name, bytes_per_pixel = RAW_IMAGE_FORMATS[pixel_format]
+
+    expected_size = int(width * height * bytes_per_pixel)
+    file_size = os.path.getsize(file_path)
+    if file_size != expected_size:
+        raise ValueError(f"{file_path} is {file_size} bytes, expected {expected_size} "
+                         f"for {width}x{height} {pixel_format}")
+
+    if pixel_format == 'yuv420p':
+        image = PlanarFrame(np.memmap(file_path, dtype=np.uint8, mode='r', shape=(expected_size,)), width, height)
+        return image, getattr(kp.ImageFormat, image_format_name)
+    if bytes_per_pixel == 1:
+        shape = (height, width)
+    else:
+        shape = (height, width, bytes_per_pixel)
+    image = np.memmap(file_path, dtype=np.uint8, mode='r', shape=shape)
+    return image, getattr(kp.ImageFormat, image_format_name)
+
+
+def list_raw_image_files(directory):
+    """List raw frame dumps in a directory whose names carry their size and pixel format."""
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if parse_raw_image_name(f) is not None)
 
 
 # -------------------- Decluttering & Photo Quality Model -------------------------------#
 
-def preprocess_image(image_file_path):
-    maxbytes = 500000
+PREPROCESS_MAX_BYTES = 500000
+PREPROCESS_PARAMS = {'image_format': 'RGB565', 'resize': 'model_input', 'padding': 'corner'}
+FRAME_BUFFERS_PER_SHAPE = 8
+
+
+class FrameBufferPool:
+    """Shape-keyed free lists of preallocated NumPy buffers for the preprocessing path.
+
+    acquire() hands out a free buffer of the requested shape and dtype, allocating only when none is
+    free; release() puts it back. Release buffers once the dongle has consumed them (inference
+    send returned), so a steady stream cycles through the same few buffers instead of allocating
+    per frame. Releasing an array the pool did not hand out is a no-op, so callers can release
+    whatever the preprocessing path returned.
+    """
+
+    def __init__(self, max_free_per_shape=FRAME_BUFFERS_PER_SHAPE):
+        self.max_free_per_shape = max_free_per_shape
+        self.lock = threading.Lock()
+        self.free = {}
+        self.outstanding = {}
+        self.allocations = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            free = self.free.get(key)
+            if free:
+                buffer = free.pop()
+            else:
+                buffer = np.empty(shape, dtype=dtype)
+                self.allocations += 1
+            self.outstanding[id(buffer)] = (key, buffer)
+        return buffer
+
+    def release(self, buffer):
+        with self.lock:
+            entry = self.outstanding.pop(id(buffer), None)
+            if entry is None:
+                return
+            key, buffer = entry
+            free = self.free.setdefault(key, [])
+            if len(free) < self.max_free_per_shape:
+                free.append(buffer)
+
+
+def preprocess_image(image_file_path, buffer_pool=None):
+    """Decode an image, shrink it to about PREPROCESS_MAX_BYTES and convert it to BGR565.
+
+    With a buffer_pool the resize and color conversion write into pooled buffers; release the result
+    to the pool once it has been sent.
+    """
+    maxbytes = PREPROCESS_MAX_BYTES
     file_size = os.path.getsize(image_file_path)
-    img = cv2.imread(filename=image_file_path)
+    with tracing.span('cv2.imread'):
+        img = cv2.imread(filename=image_file_path)
     
     if file_size > maxbytes:
         scale_factor = (maxbytes / file_size) ** 0.5
@@ -43,73 +334,571 @@ def preprocess_image(image_file_path):
         new_height = int(img.shape[0] * scale_factor)
         if new_width % 2 != 0:
             new_width += 1
-        img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        img = _resize(img, new_width, new_height, cv2.INTER_AREA, buffer_pool)
     else:
         if img.shape[1] % 2 != 0:
-            img = cv2.resize(img, (img.shape[1] + 1, img.shape[0]), interpolation=cv2.INTER_AREA)
+            img = _resize(img, img.shape[1] + 1, img.shape[0], cv2.INTER_AREA, buffer_pool)
     
-    img_bgr565 = cv2.cvtColor(src=img, code=cv2.COLOR_BGR2BGR565)
+    img_bgr565 = _to_bgr565(img, buffer_pool)
+    if buffer_pool is not None:
+        buffer_pool.release(img)
     return img_bgr565
 
 
-def perform_inference(device_group, model_nef_descriptor, img_bgr565):
-    generic_inference_input_descriptor = kp.GenericImageInferenceDescriptor(
-        model_id=model_nef_descriptor.models[0].id,
-        inference_number=0,
+def _resize(img, width, height, interpolation, buffer_pool=None):
+    """cv2.resize, writing into a pooled buffer when a buffer_pool is given."""
+    dst = None if buffer_pool is None else buffer_pool.acquire((height, width) + img.shape[2:], img.dtype)
+    with tracing.span('cv2.resize'):
+        return cv2.resize(img, (width, height), dst=dst, interpolation=interpolation)
+
+
+def _to_bgr565(img, buffer_pool=None):
+    """cv2.cvtColor to BGR565, writing into a pooled buffer when a buffer_pool is given."""
+    dst = None if buffer_pool is None else buffer_pool.acquire(img.shape[:2] + (2,), np.uint8)
+    with tracing.span('cv2.cvtColor'):
+        return cv2.cvtColor(src=img, code=cv2.COLOR_BGR2BGR565, dst=dst)
+
+
+def get_model_input_size(model_nef_descriptor, model_index=0):
+    """Return the (width, height) a model in a NEF (the first by default) expects on its input node."""
+    input_node = model_nef_descriptor.models[model_index].input_nodes[0]
+    tensor_shape_info = getattr(input_node, 'tensor_shape_info', None)
+    if tensor_shape_info is not None:
+        # V1 shape info (KL520/KL720/KL630) has shape_npu, V2 (KL730) only shape
+        data = tensor_shape_info.data
+        shape = data.shape_npu if hasattr(data, 'shape_npu') else data.shape
+    else:
+        shape = input_node.shape_npu
+    # [batch, channel, height, width]
+    return int(shape[3]), int(shape[2])
+
+
+def letterbox_image(img, width, height, buffer_pool=None):
+    """Resize img to fit width x height keeping its aspect ratio and pad the bottom/right with black.
+
+    This is the host-side equivalent of KP_RESIZE_ENABLE with KP_PADDING_CORNER.
+    With a buffer_pool the result (and the intermediate resize) lives in pooled buffers.
+    """
+    scale = min(width / img.shape[1], height / img.shape[0])
+    resized_width = max(1, min(width, round(img.shape[1] * scale)))
+    resized_height = max(1, min(height, round(img.shape[0] * scale)))
+    if (resized_width, resized_height) == (width, height) and img.shape[:2] == (height, width):
+        return img
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    if (resized_width, resized_height) == (width, height):
+        return _resize(img, width, height, interpolation, buffer_pool)
+    resized = _resize(img, resized_width, resized_height, interpolation, buffer_pool)
+    if buffer_pool is None:
+        letterboxed = np.zeros((height, width, img.shape[2]), dtype=img.dtype)
+    else:
+        letterboxed = buffer_pool.acquire((height, width, img.shape[2]), img.dtype)
+        letterboxed[resized_height:] = 0
+        letterboxed[:resized_height, resized_width:] = 0
+    letterboxed[:resized_height, :resized_width] = resized
+    if buffer_pool is not None:
+        buffer_pool.release(resized)
+    return letterboxed
+
+
+def preprocess_frame(img, width, height, buffer_pool=None):
+    """Letterbox a decoded BGR frame to width x height and convert it to BGR565.
+
+    With a buffer_pool no new arrays are allocated once the pool is warm; release the returned
+    buffer after it has been sent (perform_inference and perform_inference_pipelined do that when
+    given the same pool).
+    """
+    letterboxed = letterbox_image(img, width, height, buffer_pool)
+    img_bgr565 = _to_bgr565(letterboxed, buffer_pool)
+    if buffer_pool is not None and letterboxed is not img:
+        buffer_pool.release(letterboxed)
+    return img_bgr565
+
+
+def preprocess_image_for_model(image_file_path, width, height, buffer_pool=None):
+    """Decode an image and resize it once, on the host, straight to the model input resolution."""
+    with tracing.span('cv2.imread'):
+        img = cv2.imread(filename=image_file_path)
+    if img is None:
+        raise ValueError(f"could not decode image {image_file_path}")
+    return preprocess_frame(img, width, height, buffer_pool)
+
+
+def model_preprocessor(model_nef_descriptor, buffer_pool=None):
+    """Return a path -> BGR565 function that produces buffers already at the model input size."""
+    width, height = get_model_input_size(model_nef_descriptor)
+    return functools.partial(preprocess_image_for_model, width=width, height=height, buffer_pool=buffer_pool)
+
+
+PREPROCESS_WORKERS = os.cpu_count() or 4
+
+
+class PreprocessPool:
+    """Decodes and converts images on a thread pool into a bounded queue of ready buffers.
+
+    cv2 releases the GIL while decoding, resizing and converting, so threads spread the work over
+    all cores without pickling frames between processes. Workers block once max_queued buffers are
+    waiting, which keeps memory flat when the dongles are the bottleneck. Any number of consumers
+    can call get() concurrently; items are (index, image_file_path, img_bgr565) in completion order.
+    image_file_paths may be a generator, e.g. a directory scan still in progress: workers take the
+    next path from it only when they are free, so the first images are decoded while the rest are
+    still being listed.
+    An image that cannot be preprocessed, e.g. a corrupt JPEG, is reported to log and skipped; its
+    index goes into skipped so consumers restoring input order do not wait for it. Only a failure
+    to list the images stops the pool, and get() then raises it.
+    """
+
+    def __init__(self, image_file_paths, num_workers=PREPROCESS_WORKERS, max_queued=32, preprocess=None, log=print):
+        self.ready = queue.Queue(maxsize=max_queued)
+        self.preprocess = preprocess or preprocess_image
+        self.log = log
+        self.stop = threading.Event()
+        self.error = None
+        self.skipped = set()
+        self.lock = threading.Lock()
+        self.source = enumerate(image_file_paths)
+        self.source_lock = threading.Lock()
+        self.exhausted = False
+        self.taken = 0
+        self.handed_out = 0
+        self.threads = [threading.Thread(target=self._worker, name=f"preprocess-{i}", daemon=True)
+                        for i in range(max(1, num_workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def __len__(self):
+        """Images taken from the source that have not been handed out or skipped yet."""
+        return self.taken - self.handed_out - len(self.skipped)
+
+    def __iter__(self):
+        return iter(self.get, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _next_path(self):
+        with self.source_lock:
+            if self.exhausted:
+                return None
+            try:
+                item = next(self.source)
+            except StopIteration:
+                self.exhausted = True
+                return None
+            self.taken += 1
+            return item
+
+    def _worker(self):
+        while not self.stop.is_set():
+            try:
+                item = self._next_path()
+            except Exception as e:
+                self.error = self.error or RuntimeError(f"could not list the images to preprocess: {e}")
+                self.stop.set()
+                return
+            if item is None:
+                return
+            index, image_file_path = item
+            try:
+                item = (index, image_file_path, self.preprocess(image_file_path))
+            except Exception as e:
+                self.log(f"Warning: skipping {image_file_path}: {e}")
+                with self.source_lock:
+                    self.skipped.add(index)
+                continue
+            while not self.stop.is_set():
+                try:
+                    self.ready.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self):
+        """Return the next ready item, or None once every image has been handed out or the pool is closed."""
+        while True:
+            if self.error is not None:
+                raise self.error
+            with self.lock:
+                if self.exhausted and self.handed_out + len(self.skipped) == self.taken:
+                    return None
+                try:
+                    item = self.ready.get(timeout=0.1)
+                except queue.Empty:
+                    if self.stop.is_set():
+                        return None
+                    continue
+                self.handed_out += 1
+                return item
+
+    def close(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def build_inference_descriptor(model_nef_descriptor, img_bgr565, inference_number=0, device_resize=True,
+                               image_format=None, normalize_mode=None, model_id=None):
+    """Build the generic inference request for one BGR565 image.
+
+    Use device_resize=False for buffers that are already at the model input size
+    (see preprocess_image_for_model) so the dongle skips its own resize and padding.
+    image_format and normalize_mode override the BGR565 / Kneron-normalization defaults for raw frames.
+    model_id selects another model of a multi-model NEF; the first model is used by default.
+    """
+    if model_id is None:
+        model_id = model_nef_descriptor.models[0].id
+    if image_format is None:
+        image_format = kp.ImageFormat.KP_IMAGE_FORMAT_RGB565
+    if normalize_mode is None:
+        normalize_mode = kp.NormalizeMode.KP_NORMALIZE_KNERON
+    if isinstance(img_bgr565, PlanarFrame):
+        image_args = {'image': img_bgr565.data.tobytes(), 'width': img_bgr565.width, 'height': img_bgr565.height}
+    else:
+        image_args = {'image': img_bgr565}
+    if device_resize:
+        resize_mode = kp.ResizeMode.KP_RESIZE_ENABLE
+        padding_mode = kp.PaddingMode.KP_PADDING_CORNER
+    else:
+        resize_mode = kp.ResizeMode.KP_RESIZE_DISABLE
+        padding_mode = kp.PaddingMode.KP_PADDING_DISABLE
+    return kp.GenericImageInferenceDescriptor(
+        model_id=model_id,
+        inference_number=inference_number,
         input_node_image_list=[
             kp.GenericInputNodeImage(
-                image=img_bgr565,
-                image_format=kp.ImageFormat.KP_IMAGE_FORMAT_RGB565,
-                resize_mode=kp.ResizeMode.KP_RESIZE_ENABLE,
-                padding_mode=kp.PaddingMode.KP_PADDING_CORNER,
-                normalize_mode=kp.NormalizeMode.KP_NORMALIZE_KNERON
+                **image_args,
+                image_format=image_format,
+                resize_mode=resize_mode,
+                padding_mode=padding_mode,
+                normalize_mode=normalize_mode
             )
         ]
     )
 
-    kp.inference.generic_image_inference_send(device_group=device_group,
-                                              generic_inference_input_descriptor=generic_inference_input_descriptor)
-    generic_raw_result = kp.inference.generic_image_inference_receive(device_group=device_group)
 
+def retrieve_float_nodes(generic_raw_result):
+    """Convert every output node of a raw inference result to float."""
     inf_node_output_list = []
 
     for node_idx in range(generic_raw_result.header.num_output_node):
-        inference_float_node_output = kp.inference.generic_inference_retrieve_float_node(
-            node_idx=node_idx,
-            generic_raw_result=generic_raw_result,
-            channels_ordering=kp.ChannelOrdering.KP_CHANNEL_ORDERING_CHW
-        )
+        with tracing.span('kp.generic_inference_retrieve_float_node'):
+            inference_float_node_output = kp.inference.generic_inference_retrieve_float_node(
+                node_idx=node_idx,
+                generic_raw_result=generic_raw_result,
+                channels_ordering=kp.ChannelOrdering.KP_CHANNEL_ORDERING_CHW
+            )
         inf_node_output_list.append(inference_float_node_output)
 
     return inf_node_output_list
 
 
+def dequantization_scale(fixed_node):
+    """Multiplier that turns a fixed-point node into floats: 1 / (scale * 2^radix), per tensor or per channel."""
+    quantization_parameters = getattr(fixed_node, 'quantization_parameters', None)
+    if quantization_parameters is None:
+        # kp 2.0 nodes carry a single flat factor instead
+        return np.float32(1.0 / fixed_node.factor)
+    v1 = quantization_parameters.v1
+    factors = np.array([1.0 / (d.scale.value * 2.0 ** d.radix) for d in v1.quantized_fixed_point_descriptor_list],
+                       dtype=np.float32)
+    if len(factors) == 1:
+        return factors[0]
+    # per-channel quantization along quantized_axis of the node's shape
+    ndim = len(fixed_node.shape)
+    return factors.reshape([-1 if axis == v1.quantized_axis else 1 for axis in range(ndim)])
+
+
+def dequantize_fixed_node(fixed_node):
+    """Vectorized float32 conversion of a fixed-point node in a single pass over its data."""
+    ndarray = np.asarray(fixed_node.ndarray).reshape(fixed_node.shape)
+    return np.multiply(ndarray, dequantization_scale(fixed_node), dtype=np.float32)
+
+
+class DequantizedNode:
+    """Float view of a fixed-point output node with the fields of kp's float node output."""
+
+    def __init__(self, fixed_node):
+        self.name = fixed_node.name
+        self.shape = fixed_node.shape
+        self.num_data = fixed_node.num_data
+        self.channels_ordering = fixed_node.channels_ordering
+        self.fixed_node = fixed_node
+        self.ndarray = dequantize_fixed_node(fixed_node)
+
+
+class LazyInferenceOutput(collections.abc.Sequence):
+    """Output nodes of one raw inference result, retrieved and converted only when indexed.
+
+    Behaves like the list retrieve_float_nodes returns, so callers that only read node 0 (or
+    nothing) do not pay for converting the others. With fixed_point=True nodes are fetched as
+    fixed-point and dequantized on the host with NumPy instead of by kp's float retrieval;
+    fixed_node() gives the raw integers.
+    """
+
+    def __init__(self, generic_raw_result, fixed_point=False):
+        self.generic_raw_result = generic_raw_result
+        self.fixed_point = fixed_point and hasattr(kp.inference, 'generic_inference_retrieve_fixed_node')
+        self.nodes = [None] * generic_raw_result.header.num_output_node
+        self.fixed_nodes = [None] * len(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        node = self.nodes[index]
+        if node is None:
+            if self.fixed_point:
+                node = DequantizedNode(self.fixed_node(index))
+            else:
+                with tracing.span('kp.generic_inference_retrieve_float_node'):
+                    node = kp.inference.generic_inference_retrieve_float_node(
+                        node_idx=index % len(self.nodes),
+                        generic_raw_result=self.generic_raw_result,
+                        channels_ordering=kp.ChannelOrdering.KP_CHANNEL_ORDERING_CHW
+                    )
+            self.nodes[index] = node
+        return node
+
+    def fixed_node(self, index):
+        node = self.fixed_nodes[index]
+        if node is None:
+            with tracing.span('kp.generic_inference_retrieve_fixed_node'):
+                node = kp.inference.generic_inference_retrieve_fixed_node(
+                    node_idx=index % len(self.nodes),
+                    generic_raw_result=self.generic_raw_result,
+                    channels_ordering=kp.ChannelOrdering.KP_CHANNEL_ORDERING_CHW
+                )
+            self.fixed_nodes[index] = node
+        return node
+
+
+def perform_inference(device_group, model_nef_descriptor, img_bgr565, device_resize=True, fixed_point=False,
+                      buffer_pool=None):
+    """Run one image and return its output nodes as a LazyInferenceOutput.
+
+    img_bgr565 is released to buffer_pool, if given, as soon as it has been sent.
+    """
+    generic_inference_input_descriptor = build_inference_descriptor(model_nef_descriptor, img_bgr565,
+                                                                    device_resize=device_resize)
+
+    with tracing.span('kp.generic_image_inference_send'):
+        kp.inference.generic_image_inference_send(device_group=device_group,
+                                                  generic_inference_input_descriptor=generic_inference_input_descriptor)
+    if buffer_pool is not None:
+        buffer_pool.release(img_bgr565)
+    with tracing.span('kp.generic_image_inference_receive'):
+        generic_raw_result = kp.inference.generic_image_inference_receive(device_group=device_group)
+
+    return LazyInferenceOutput(generic_raw_result, fixed_point=fixed_point)
+
+
+# inference_number is echoed back by the firmware; it only has to be unique among requests in flight
+INFERENCE_NUMBER_RANGE = 1 << 16
+
+
+def perform_inference_pipelined(device_group, model_nef_descriptor, images, queue_depth=4, ordered=True,
+                                device_resize=True, image_format=None, normalize_mode=None, fixed_point=False,
+                                buffer_pool=None, log=print):
+    """Keep up to queue_depth requests in flight on device_group and yield (key, inf_node_output_list).
+
+    images is an iterable of (key, img_bgr565) pairs, or (key, img_bgr565, model_id) triples to address
+    several models resident in one NEF. It is consumed on a sender thread, so decoding
+    the next image on the host overlaps with the USB transfer and NPU compute of the previous ones.
+    Results are matched back to their inputs through inference_number. With ordered=True they are
+    yielded in input order, otherwise as soon as the device group returns them.
+    Outputs are LazyInferenceOutput, so nodes are only converted when the consumer reads them.
+    Images from buffer_pool are released back to it as soon as the dongle has taken them.
+    A failure to drain the requests left in flight on the way out is reported to log.
+    """
+    if queue_depth < 1 or queue_depth >= INFERENCE_NUMBER_RANGE:
+        raise ValueError(f"queue_depth must be between 1 and {INFERENCE_NUMBER_RANGE - 1}")
+
+    slots = threading.Semaphore(queue_depth)
+    condition = threading.Condition()
+    stop = threading.Event()
+    pending = {}
+    state = {'sent': 0, 'finished': False, 'error': None}
+
+    def sender():
+        try:
+            for seq, (key, img_bgr565, *model_id) in enumerate(images):
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                inference_number = seq % INFERENCE_NUMBER_RANGE
+                with condition:
+                    pending[inference_number] = (seq, key)
+                descriptor = build_inference_descriptor(model_nef_descriptor, img_bgr565, inference_number,
+                                                        device_resize=device_resize, image_format=image_format,
+                                                        normalize_mode=normalize_mode,
+                                                        model_id=model_id[0] if model_id else None)
+                with tracing.span('kp.generic_image_inference_send'):
+                    kp.inference.generic_image_inference_send(device_group=device_group,
+                                                              generic_inference_input_descriptor=descriptor)
+                if buffer_pool is not None:
+                    buffer_pool.release(img_bgr565)
+                with condition:
+                    state['sent'] += 1
+                    condition.notify()
+        except Exception as e:
+            state['error'] = e
+        finally:
+            with condition:
+                state['finished'] = True
+                condition.notify()
+
+    sender_thread = threading.Thread(target=sender, name="kp-inference-sender", daemon=True)
+    sender_thread.start()
+
+    received = 0
+    next_seq = 0
+    reorder_buffer = {}
+    try:
+        while True:
+            with condition:
+                while state['sent'] == received and not state['finished']:
+                    condition.wait()
+                if state['sent'] == received:
+                    break
+
+            with tracing.span('kp.generic_image_inference_receive'):
+                generic_raw_result = kp.inference.generic_image_inference_receive(device_group=device_group)
+            received += 1
+            with condition:
+                seq, key = pending.pop(generic_raw_result.header.inference_number)
+            slots.release()
+            result = (key, LazyInferenceOutput(generic_raw_result, fixed_point=fixed_point))
+
+            if not ordered:
+                yield result
+                continue
+            reorder_buffer[seq] = result
+            while next_seq in reorder_buffer:
+                yield reorder_buffer.pop(next_seq)
+                next_seq += 1
+
+        if state['error'] is not None:
+            raise state['error']
+    finally:
+        stop.set()
+        sender_thread.join()
+        # drain requests still on the device so the device group can be reused by the caller
+        try:
+            while received < state['sent']:
+                kp.inference.generic_image_inference_receive(device_group=device_group)
+                received += 1
+        except Exception as e:
+            log(f"Warning: could not drain {state['sent'] - received} pending inference results: {e}")
+
+
 def post_process_inference(inf_node_output_list):
     """Processes the inference output and returns a mean score."""
     data = inf_node_output_list[0]
-    raw_ndarray = data.ndarray
+    # the mean does not depend on the layout, so no flatten/reshape copies are needed
+    return np.mean(np.asarray(data.ndarray))  # Mean score
 
-    if isinstance(raw_ndarray, np.ndarray):
-        ndarray_np = raw_ndarray
-    else:
-        ndarray_np = np.array(raw_ndarray)
 
-    ndarray_np = ndarray_np.flatten()  
-    ndarray_np = ndarray_np.reshape((data.channel, data.height, data.width))
+def first_output_value(inf_node_output_list):
+    """The number process_image reports: the first value of the first output node."""
+    return float(np.asarray(inf_node_output_list[0].ndarray).flat[0])
 
-    ndarray_np = ndarray_np.flatten()
-    result = np.mean(ndarray_np)  # Mean score
 
-    return result
+def embedding_vector(inf_node_output_list):
+    """The whole first output node as a float32 feature vector, averaged over its spatial positions if it has any."""
+    node = inf_node_output_list[0]
+    data = np.asarray(node.ndarray, dtype=np.float32)
+    if data.ndim == 4 and data.shape[2] * data.shape[3] > 1:
+        # (1, channel, height, width) feature map -> one value per channel
+        return data.mean(axis=(0, 2, 3))
+    return data.reshape(-1)
 
 
 def process_image(device_group, model_nef_descriptor, image_file_path):
     """Full pipeline: preprocess image, perform inference, and post-process to get a score."""
-    img_bgr565 = preprocess_image(image_file_path)
-    inf_node_output_list = perform_inference(device_group, model_nef_descriptor, img_bgr565)
-    nd_array = inf_node_output_list[0].ndarray
-    number = float(nd_array.flatten()[0])
-    return number
+    img_bgr565 = model_preprocessor(model_nef_descriptor)(image_file_path)
+    inf_node_output_list = perform_inference(device_group, model_nef_descriptor, img_bgr565, device_resize=False)
+    return first_output_value(inf_node_output_list)
+
+
+def extract_embedding(device_group, model_nef_descriptor, image_file_path):
+    """Like process_image, but return the full feature vector (see embedding_vector) of a feature extractor."""
+    img_bgr565 = model_preprocessor(model_nef_descriptor)(image_file_path)
+    inf_node_output_list = perform_inference(device_group, model_nef_descriptor, img_bgr565, device_resize=False)
+    return embedding_vector(inf_node_output_list)
+
+
+def process_images_pipelined(device_group, model_nef_descriptor, image_file_paths, queue_depth=4,
+                             preprocess_workers=PREPROCESS_WORKERS, postprocess=first_output_value, log=print):
+    """Pipelined process_image over many files; yields (image_file_path, postprocess(outputs)) in input order.
+
+    Images are decoded by a PreprocessPool, so host preprocessing runs on several cores while the
+    dongle works through the requests already in flight. Each image is resized once on the host to
+    the model input size and sent with device-side resize disabled. The resized and converted
+    buffers come from a FrameBufferPool and are recycled once sent. Images that cannot be decoded
+    are skipped with a warning to log.
+    """
+    max_queued = 32
+    buffer_pool = FrameBufferPool(max_free_per_shape=max_queued + preprocess_workers + queue_depth)
+    preprocess = model_preprocessor(model_nef_descriptor, buffer_pool)
+    with PreprocessPool(image_file_paths, num_workers=preprocess_workers, max_queued=max_queued,
+                        preprocess=preprocess, log=log) as preprocess_pool:
+        images = (((index, image_file_path), img_bgr565) for index, image_file_path, img_bgr565 in preprocess_pool)
+        results = perform_inference_pipelined(device_group, model_nef_descriptor, images, queue_depth=queue_depth,
+                                              ordered=False, device_resize=False, buffer_pool=buffer_pool, log=log)
+        next_index = 0
+        reorder_buffer = {}
+        for (index, image_file_path), inf_node_output_list in results:
+            reorder_buffer[index] = (image_file_path, postprocess(inf_node_output_list))
+            while next_index in reorder_buffer or next_index in preprocess_pool.skipped:
+                if next_index in reorder_buffer:
+                    yield reorder_buffer.pop(next_index)
+                next_index += 1
+        # an image skipped after the last result came back leaves a gap the loop could not pass
+        for index in sorted(reorder_buffer):
+            yield reorder_buffer[index]
+
+
+def embed_images_pipelined(device_group, model_nef_descriptor, image_file_paths, queue_depth=4,
+                           preprocess_workers=PREPROCESS_WORKERS, log=print):
+    """Pipelined extract_embedding over many files; yields (image_file_path, feature_vector) in input order."""
+    return process_images_pipelined(device_group, model_nef_descriptor, image_file_paths, queue_depth=queue_depth,
+                                    preprocess_workers=preprocess_workers, postprocess=embedding_vector, log=log)
+
+
+def process_raw_images_pipelined(device_group, model_nef_descriptor, raw_file_paths, width=None, height=None,
+                                 pixel_format=None, queue_depth=4):
+    """Replay raw frame dumps at full USB speed; yields (raw_file_path, inf_node_output_list) in input order.
+
+    Frames are memory-mapped and handed to the dongle as-is with the matching kp.ImageFormat, so there
+    is no decode or color conversion on the host. All files must share one pixel format; files named
+    *_normalized are sent with device normalization disabled.
+    """
+    raw_file_paths = list(raw_file_paths)
+    if not raw_file_paths:
+        return
+    parsed = parse_raw_image_name(raw_file_paths[0])
+    if pixel_format is None and parsed is None:
+        raise ValueError(f"cannot infer the pixel format from {raw_file_paths[0]}")
+    stream_format = pixel_format or parsed[2]
+    normalized = parsed is not None and parsed[3]
+    image_format = getattr(kp.ImageFormat, RAW_IMAGE_FORMATS[stream_format][0])
+    normalize_mode = kp.NormalizeMode.KP_NORMALIZE_DISABLE if normalized else kp.NormalizeMode.KP_NORMALIZE_KNERON
+
+    def frames():
+        for raw_file_path in raw_file_paths:
+            image, frame_format = load_raw_image(raw_file_path, width, height, pixel_format)
+            if frame_format != image_format:
+                raise ValueError(f"{raw_file_path} is not {stream_format} like the rest of the stream")
+            yield raw_file_path, image
+
+    yield from perform_inference_pipelined(device_group, model_nef_descriptor, frames(), queue_depth=queue_depth,
+                                           image_format=image_format, normalize_mode=normalize_mode)
 
 
 def cosine_similarity(tensor1, tensor2):
@@ -120,38 +909,185 @@ def cosine_similarity(tensor1, tensor2):
     return dot_product / (norm1 * norm2)
 
 
-def compare_images_cosine_similarity(image_paths, device_group, model_nef_descriptor):
-    """Compare the cosine similarity between feature tensors of photos in the given image file paths."""
-    num_images = len(image_paths)
-    features = []
-    for image_path in image_paths:
-        feature = process_image(device_group, model_nef_descriptor, image_path)
-        features.append(feature)
-    
-    similarity_matrix = np.zeros((num_images, num_images))
-    for i in range(num_images):
-        for j in range(num_images):
-            if i != j:
-                similarity_matrix[i, j] = cosine_similarity(features[i], features[j])
+SIMILARITY_BLOCK_SIZE = 2048
+
+
+def normalize_features(features):
+    """Stack features into an (n, d) float32 matrix with L2-normalized rows."""
+    matrix = np.asarray(features, dtype=np.float32)
+    matrix = matrix.reshape(len(matrix), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _float_rows(matrix, start, stop, row_scales):
+    rows = np.asarray(matrix[start:stop], dtype=np.float32)
+    if row_scales is not None:
+        rows = rows * np.asarray(row_scales[start:stop], dtype=np.float32)[:, None]
+    return rows
+
+
+def iter_similarity_blocks(normalized, block_size=SIMILARITY_BLOCK_SIZE, upper_triangle=False, row_scales=None):
+    """Yield (row_start, col_start, block) tiles of normalized @ normalized.T, at most block_size x block_size each.
+
+    With upper_triangle=True only tiles on or above the diagonal are computed. normalized may also
+    be a compact float16 or int8 matrix, e.g. from an EmbeddingStore; each block of rows is then
+    widened to float32 and multiplied by its row_scales just before its matrix product, so the full
+    matrix is never expanded.
+    """
+    num_images = len(normalized)
+    for row_start in range(0, num_images, block_size):
+        rows = _float_rows(normalized, row_start, row_start + block_size, row_scales)
+        first_col = row_start if upper_triangle else 0
+        for col_start in range(first_col, num_images, block_size):
+            if col_start == row_start:
+                cols = rows
             else:
-                similarity_matrix[i, j] = 1.0
+                cols = _float_rows(normalized, col_start, col_start + block_size, row_scales)
+            yield row_start, col_start, rows @ cols.T
+
+
+@tracing.traced('similarity')
+def cosine_similarity_matrix(features, block_size=SIMILARITY_BLOCK_SIZE, upper_triangle=False):
+    """Dense n x n float32 cosine similarity matrix computed as blocked matrix products.
+
+    With upper_triangle=True the entries below the diagonal are left at zero and never computed.
+    """
+    normalized = normalize_features(features)
+    num_images = len(normalized)
+    similarity_matrix = np.zeros((num_images, num_images), dtype=np.float32)
+    for row_start, col_start, block in iter_similarity_blocks(normalized, block_size, upper_triangle):
+        similarity_matrix[row_start:row_start + block.shape[0], col_start:col_start + block.shape[1]] = block
+    if upper_triangle:
+        similarity_matrix = np.triu(similarity_matrix)
+    np.fill_diagonal(similarity_matrix, 1.0)
     return similarity_matrix
 
 
-def cluster_images_with_dbscan(image_paths, feature_extractor, model_nef_descriptor, similarity_threshold=0.8, min_samples=2):
-    """Cluster images based on cosine similarity using DBSCAN and return clusters as arrays of file paths."""
-    similarity_matrix = compare_images_cosine_similarity(image_paths, feature_extractor, model_nef_descriptor)
-    distance_matrix = 1 - similarity_matrix
-    dbscan = DBSCAN(eps=1-similarity_threshold, min_samples=min_samples, metric='precomputed')
-    labels = dbscan.fit_predict(distance_matrix)
-    
+@tracing.traced('similarity')
+def similar_pairs(features, similarity_threshold, block_size=SIMILARITY_BLOCK_SIZE, normalized=None, row_scales=None):
+    """Return (rows, cols, similarities) for every pair i < j whose cosine similarity is >= similarity_threshold.
+
+    Only one block_size x block_size tile is held in memory at a time, so this scales to albums
+    whose full similarity matrix would not fit in RAM. Pass normalized (and row_scales) instead of
+    features to work on already normalized or quantized rows; see iter_similarity_blocks.
+    """
+    if normalized is None:
+        normalized = normalize_features(features)
+    rows, cols, similarities = [], [], []
+    for row_start, col_start, block in iter_similarity_blocks(normalized, block_size, upper_triangle=True,
+                                                              row_scales=row_scales):
+        block_rows, block_cols = np.nonzero(block >= similarity_threshold)
+        above_diagonal = block_rows + row_start < block_cols + col_start
+        block_rows, block_cols = block_rows[above_diagonal], block_cols[above_diagonal]
+        similarities.append(block[block_rows, block_cols])
+        rows.append(block_rows + row_start)
+        cols.append(block_cols + col_start)
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(similarities)
+
+
+def compare_images_cosine_similarity(image_paths, device_group, model_nef_descriptor, features=None,
+                                     block_size=SIMILARITY_BLOCK_SIZE, upper_triangle=False, similarity_threshold=None):
+    """Compare the cosine similarity between feature tensors of photos in the given image file paths.
+
+    Pass precomputed features (e.g. from a DevicePool) to skip running the feature extractor here.
+    Returns the dense similarity matrix, or the (rows, cols, similarities) of the pairs above
+    similarity_threshold when one is given.
+    """
+    if features is None:
+        features = [feature for _, feature in embed_images_pipelined(device_group, model_nef_descriptor, image_paths)]
+    if len(features) == 0:
+        if similarity_threshold is not None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.zeros((0, 0), dtype=np.float32)
+    if similarity_threshold is not None:
+        return similar_pairs(features, similarity_threshold, block_size=block_size)
+    return cosine_similarity_matrix(features, block_size=block_size, upper_triangle=upper_triangle)
+
+
+def similarity_radius_graph(features, similarity_threshold, block_size=SIMILARITY_BLOCK_SIZE, normalized=None,
+                            row_scales=None):
+    """Sparse symmetric cosine-distance graph holding only the pairs within the epsilon-neighbourhood.
+
+    Memory grows with the number of similar pairs rather than with n^2. Identical images keep an
+    explicitly stored zero distance so they still count as neighbours.
+    """
+    num_images = len(features) if normalized is None else len(normalized)
+    rows, cols, similarities = similar_pairs(features, similarity_threshold, block_size=block_size,
+                                             normalized=normalized, row_scales=row_scales)
+    return radius_graph_from_pairs(num_images, rows, cols, similarities)
+
+
+def radius_graph_from_pairs(num_images, rows, cols, similarities):
+    """The similarity_radius_graph of pairs already found by similar_pairs, e.g. EmbeddingStore.similar_pairs."""
+    distances = np.clip(1 - similarities, 0, None)
+    graph = sparse.coo_matrix((np.concatenate([distances, distances]),
+                               (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+                              shape=(num_images, num_images))
+    return graph.tocsr()
+
+
+def labels_to_clusters(image_paths, labels):
+    """Group image paths by cluster label, dropping DBSCAN noise (-1)."""
     clusters = []
-    unique_labels = set(labels)
-    for label in unique_labels:
+    for label in sorted(set(labels)):
         if label != -1:
-            cluster = [image_paths[i] for i in range(len(labels)) if labels[i] == label]
+            cluster = [image_paths[i] for i in np.flatnonzero(labels == label)]
             clusters.append(cluster)
     return clusters
 
 
+def cluster_features_sparse(image_paths, features, similarity_threshold=0.8, min_samples=2, method='dbscan',
+                            block_size=SIMILARITY_BLOCK_SIZE, normalized=None, row_scales=None):
+    """Cluster precomputed features on the sparse epsilon-neighbourhood graph instead of a dense distance matrix.
+
+    method='dbscan' gives the same clusters as the dense path; method='components' takes the connected
+    components of the graph and drops those smaller than min_samples. Quantized embeddings can be
+    passed as normalized and row_scales instead of features.
+    """
+    if len(image_paths) == 0:
+        return []
+    graph = similarity_radius_graph(features, similarity_threshold, block_size=block_size, normalized=normalized,
+                                    row_scales=row_scales)
+    return cluster_radius_graph(image_paths, graph, similarity_threshold, min_samples, method)
+
+
+def cluster_radius_graph(image_paths, graph, similarity_threshold=0.8, min_samples=2, method='dbscan'):
+    """Cluster image_paths on their sparse epsilon-neighbourhood graph; see cluster_features_sparse for method."""
+    if method == 'dbscan':
+        dbscan = DBSCAN(eps=1-similarity_threshold, min_samples=min_samples, metric='precomputed')
+        with tracing.span('dbscan'):
+            labels = dbscan.fit_predict(graph)
+    elif method == 'components':
+        with tracing.span('connected_components'):
+            _, labels = connected_components(graph, directed=False)
+        sizes = np.bincount(labels)
+        labels[sizes[labels] < min_samples] = -1
+    else:
+        raise ValueError(f"unknown clustering method: {method}")
+    return labels_to_clusters(image_paths, labels)
+
+
+def cluster_images_with_dbscan(image_paths, feature_extractor, model_nef_descriptor, similarity_threshold=0.8,
+                               min_samples=2, features=None, sparse_graph=False, method='dbscan'):
+    """Cluster images based on cosine similarity using DBSCAN and return clusters as arrays of file paths.
 
+    sparse_graph=True builds only the epsilon-neighbourhood graph, which keeps memory proportional to
+    the number of similar pairs and makes albums of 100k+ photos fit in RAM.
+    """
+    if sparse_graph:
+        if features is None:
+            features = [feature for _, feature in embed_images_pipelined(feature_extractor, model_nef_descriptor,
+                                                                         image_paths)]
+        return cluster_features_sparse(image_paths, features, similarity_threshold, min_samples, method=method)
+
+    similarity_matrix = compare_images_cosine_similarity(image_paths, feature_extractor, model_nef_descriptor,
+                                                         features=features)
+    distance_matrix = np.clip(1 - similarity_matrix, 0, None)
+    dbscan = DBSCAN(eps=1-similarity_threshold, min_samples=min_samples, metric='precomputed')
+    with tracing.span('dbscan'):
+        labels = dbscan.fit_predict(distance_matrix)
+    return labels_to_clusters(image_paths, labels)
@@ -0,0 +1,306 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+import cv2
+from demogui import tracing
+from demogui.device_pool import DevicePool
+from demogui.utils import FrameBufferPool, first_output_value, get_model_input_size, preprocess_frame
+
+DECODE_QUEUE_SIZE = 8
+WRITER_QUEUE_SIZE = 16
+FRAME_STRIDE = 1
+REPORT_SECONDS = 5.0
+DEFAULT_FOURCC = 'mp4v'
+
+
+class VideoFrameReader:
+    """Decodes a video file on its own thread into a bounded queue of frames.
+
+    Every stride-th frame is decoded into a pooled buffer; the frames in between are only grabbed,
+    which skips the colour conversion and copy. Like PreprocessPool, any number of consumers can
+    call get() concurrently; items are (index, frame_index, frame), where index counts the decoded
+    frames and frame_index is the position in the file. Release frames to buffer_pool when done.
+    """
+
+    def __init__(self, video_path, stride=FRAME_STRIDE, max_queued=DECODE_QUEUE_SIZE, buffer_pool=None,
+                 max_frames=None):
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        self.capture = cv2.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            raise ValueError(f"could not open video {video_path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.stride = stride
+        self.max_frames = max_frames
+        self.buffer_pool = buffer_pool
+        self.ready = queue.Queue(maxsize=max_queued)
+        self.stop = threading.Event()
+        self.finished = False
+        self.error = None
+        self.frames_read = 0
+        self.thread = threading.Thread(target=self._run, name="video-decode", daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        return iter(self.get, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        index = 0
+        try:
+            while not self.stop.is_set():
+                if self.max_frames is not None and self.frames_read >= self.max_frames:
+                    break
+                frame_index = self.frames_read
+                if frame_index % self.stride:
+                    with tracing.span('cv2.VideoCapture.grab'):
+                        ok = self.capture.grab()
+                    if not ok:
+                        break
+                    self.frames_read += 1
+                    continue
+                buffer = None
+                if self.buffer_pool is not None and self.width and self.height:
+                    buffer = self.buffer_pool.acquire((self.height, self.width, 3))
+                with tracing.span('cv2.VideoCapture.read'):
+                    ok, frame = self.capture.read(image=buffer)
+                if buffer is not None and frame is not buffer:
+                    self.buffer_pool.release(buffer)
+                if not ok:
+                    break
+                self.frames_read += 1
+                if not self._put((index, frame_index, frame)):
+                    break
+                index += 1
+        except Exception as e:
+            self.error = RuntimeError(f"could not decode frame {self.frames_read}: {e}")
+        finally:
+            self.capture.release()
+            self.finished = True
+
+    def get(self):
+        """Return the next decoded frame, or None once the video has ended or the reader is closed."""
+        while True:
+            # read the flag first: if decoding had finished before the queue came up empty, it stays empty
+            finished = self.finished
+            try:
+                return self.ready.get(timeout=0.1)
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+                if finished or self.stop.is_set():
+                    return None
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+
+class AnnotatedVideoWriter:
+    """Encodes frames with cv2.VideoWriter on its own thread behind a bounded queue.
+
+    write() only blocks when max_queued frames are waiting, so encoding overlaps with decoding and
+    inference instead of adding to every frame's latency. Written frames are released to
+    buffer_pool.
+    """
+
+    def __init__(self, output_path, fps, frame_size, fourcc=DEFAULT_FOURCC, max_queued=WRITER_QUEUE_SIZE,
+                 buffer_pool=None):
+        self.writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, frame_size)
+        if not self.writer.isOpened():
+            raise ValueError(f"could not open {output_path} for writing with codec {fourcc}")
+        self.buffer_pool = buffer_pool
+        self.frames = queue.Queue(maxsize=max_queued)
+        self.error = None
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name="video-writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    return
+                try:
+                    if self.error is None:
+                        with tracing.span('cv2.VideoWriter.write'):
+                            self.writer.write(frame)
+                        self.written += 1
+                except Exception as e:
+                    # keep draining so write() never blocks on a dead writer
+                    self.error = e
+                finally:
+                    if self.buffer_pool is not None:
+                        self.buffer_pool.release(frame)
+        finally:
+            self.writer.release()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.frames.put(frame)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.frames.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def annotate_frame(frame, frame_index, inf_node_output_list):
+    """Default annotation: the frame number and the model's first output value, top left."""
+    text = f"#{frame_index}  {first_output_value(inf_node_output_list):.3f}"
+    for color, thickness in (((0, 0, 0), 4), ((255, 255, 255), 2)):
+        cv2.putText(frame, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, thickness, cv2.LINE_AA)
+
+
+def process_video(video_path, device_pool, output_path=None, stride=FRAME_STRIDE, queue_depth=4,
+                  annotate=annotate_frame, on_result=None, max_frames=None, fourcc=DEFAULT_FOURCC, log=print):
+    """Run the model loaded on device_pool over every stride-th frame of video_path; returns run statistics.
+
+    Decoding, inference on every dongle of the pool and encoding each run on their own threads
+    connected by bounded queues, so the slowest stage sets the pace and memory stays flat.
+    on_result(frame_index, inf_node_output_list) is called for each inferred frame in order. With
+    output_path, each inferred frame is passed through annotate(frame, frame_index,
+    inf_node_output_list) and written at the source frame rate divided by stride.
+    """
+    input_width, input_height = get_model_input_size(device_pool.devices[0].model_nef_descriptor)
+    in_flight = DECODE_QUEUE_SIZE + WRITER_QUEUE_SIZE + (queue_depth + 1) * len(device_pool.devices)
+    buffer_pool = FrameBufferPool(max_free_per_shape=in_flight)
+
+    def preprocess(frame):
+        return preprocess_frame(frame, input_width, input_height, buffer_pool)
+
+    reader = VideoFrameReader(video_path, stride=stride, buffer_pool=buffer_pool, max_frames=max_frames)
+    writer = None
+    results = None
+    frames = 0
+    start = window_start = time.perf_counter()
+    window_frames = 0
+    try:
+        if output_path is not None:
+            writer = AnnotatedVideoWriter(output_path, reader.fps / stride, (reader.width, reader.height), fourcc,
+                                          buffer_pool=buffer_pool)
+        results = device_pool.infer_stream(reader, preprocess=preprocess, queue_depth=queue_depth,
+                                           buffer_pool=buffer_pool)
+        for frame_index, frame, inf_node_output_list in results:
+            if on_result is not None:
+                on_result(frame_index, inf_node_output_list)
+            if writer is not None:
+                if annotate is not None:
+                    with tracing.span('video.annotate'):
+                        annotate(frame, frame_index, inf_node_output_list)
+                writer.write(frame)
+            else:
+                buffer_pool.release(frame)
+            frames += 1
+            window_frames += 1
+            now = time.perf_counter()
+            if now - window_start >= REPORT_SECONDS:
+                log(f"Frame {frame_index}: {window_frames / (now - window_start):.1f} fps")
+                window_start = now
+                window_frames = 0
+    finally:
+        # stop decoding first so the device threads run out of work, then let them drain
+        reader.close()
+        if results is not None:
+            results.close()
+        if writer is not None:
+            writer.close()
+
+    seconds = time.perf_counter() - start
+    video_seconds = reader.frames_read / reader.fps
+    stats = {
+        'video': video_path,
+        'frames_read': reader.frames_read,
+        'frames_inferred': frames,
+        'frames_written': writer.written if writer is not None else 0,
+        'stride': stride,
+        'devices': len(device_pool.devices),
+        'seconds': seconds,
+        'fps': frames / seconds if seconds > 0 else None,
+        'source_fps': reader.fps,
+        'realtime_factor': video_seconds / seconds if seconds > 0 else None,
+        'buffer_allocations': buffer_pool.allocations,
+    }
+    log(f"Processed {frames} of {reader.frames_read} frames in {seconds:.1f} s: {stats['fps'] or 0:.1f} fps, "
+        f"{stats['realtime_factor'] or 0:.2f}x real time")
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a model over a video file on Kneron dongles.")
+    parser.add_argument('video', help="video file to process")
+    parser.add_argument('-m', '--model', required=True, help="NEF to run on every processed frame")
+    parser.add_argument('-o', '--output', help="write the annotated frames to this video file")
+    parser.add_argument('--stride', type=int, default=FRAME_STRIDE,
+                        help=f"process every n-th frame (default {FRAME_STRIDE})")
+    parser.add_argument('--queue-depth', type=int, default=4, help="requests kept in flight per dongle")
+    parser.add_argument('--max-frames', type=int, help="stop after this many frames of the video")
+    parser.add_argument('--fourcc', default=DEFAULT_FOURCC, help=f"output codec (default {DEFAULT_FOURCC})")
+    parser.add_argument('--usb-port-ids', type=int, nargs='+', help="only use the dongles on these USB ports")
+    parser.add_argument('--trace', metavar='TRACE_JSON',
+                        help="record per-stage spans and write a Chrome trace here, plus <name>.summary.json")
+    parser.add_argument('-q', '--quiet', action='store_true', help="do not log progress to stderr")
+    args = parser.parse_args(argv)
+    if args.stride < 1:
+        parser.error("--stride must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    def log(message):
+        if not args.quiet:
+            print(message, file=sys.stderr, flush=True)
+
+    if args.trace:
+        tracing.trace_to_file(args.trace)
+    try:
+        device_pool = DevicePool(usb_port_ids=args.usb_port_ids)
+    except RuntimeError as e:
+        log(str(e))
+        return 1
+    with device_pool:
+        device_pool.load_model(args.model)
+        try:
+            stats = process_video(args.video, device_pool, args.output, stride=args.stride,
+                                  queue_depth=args.queue_depth, max_frames=args.max_frames, fourcc=args.fourcc, log=log)
+        except ValueError as e:
+            log(f"Error: {e}")
+            return 2
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import cv2
+import numpy as np
+import pytest
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+# Four emulated KL520s without modelled delays; every model has one 64-value output node
+EMULATOR_CONFIG = {'devices': 4, 'time_scale': 0, 'models': {'default': {'outputs': [[64, 1, 1]]}}}
+NEF_NAMES = ('photo_scorer_520.nef', 'resnet34_feature_extractor.nef')
+
+# The kp module is replaced before any demogui module imports it
+os.environ['DEMOGUI_KP_BACKEND'] = 'emulator'
+os.environ['DEMOGUI_KP_EMULATOR_CONFIG'] = json.dumps(EMULATOR_CONFIG)
+sys.path.insert(0, SRC_DIRECTORY)
+import demogui  # noqa: E402,F401
+
+
+def write_photo(path, seed, size=(96, 128)):
+    """Write a noise JPEG; the same seed always gives the same picture."""
+    img = np.random.default_rng(seed).integers(0, 256, size + (3,), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (9, 9), 0)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(path, img)
+    return path
+
+
+@pytest.fixture
+def album(tmp_path):
+    """Twelve distinct photos in an album directory."""
+    directory = tmp_path / 'album'
+    return [write_photo(str(directory / f'photo_{i:02d}.jpg'), seed=i) for i in range(12)]
+
+
+@pytest.fixture
+def nef_paths(tmp_path):
+    """Stand-in NEF files; the emulator only hashes their bytes to derive the model ids."""
+    paths = []
+    for name in NEF_NAMES:
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 64)
+        paths.append(str(path))
+    return paths
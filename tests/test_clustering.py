@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from demogui.benchmark import synthetic_features
+from demogui.embedding_store import quantize_embeddings
+from demogui.incremental_cluster import IncrementalClusterer
+from demogui.utils import cluster_features_sparse, cluster_images_with_dbscan, cosine_similarity_matrix, similar_pairs
+
+NUM_IMAGES = 203
+
+
+@pytest.fixture
+def features():
+    # groups of four near-duplicates; the last group gets the three images left over
+    return synthetic_features(NUM_IMAGES, dim=32, group_size=4, noise=0.05, seed=1)
+
+
+@pytest.fixture
+def image_paths():
+    return [f'photo_{i:03d}.jpg' for i in range(NUM_IMAGES)]
+
+
+def as_sets(clusters):
+    return {frozenset(cluster) for cluster in clusters}
+
+
+def test_blocked_similarity_matches_the_full_product(features):
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    expected = normalized @ normalized.T
+    np.fill_diagonal(expected, 1.0)
+
+    assert np.allclose(cosine_similarity_matrix(features, block_size=17), expected, atol=1e-5)
+    assert np.allclose(cosine_similarity_matrix(features, block_size=17, upper_triangle=True), np.triu(expected),
+                       atol=1e-5)
+
+
+def test_similar_pairs_match_the_dense_matrix(features):
+    dense = cosine_similarity_matrix(features)
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(dense, k=1) >= 0.8))}
+
+    rows, cols, similarities = similar_pairs(features, 0.8, block_size=17)
+
+    assert set(zip(rows.tolist(), cols.tolist())) == expected
+    assert np.allclose(similarities, dense[rows, cols], atol=1e-5)
+
+
+def test_dense_sparse_and_incremental_clusters_agree(features, image_paths):
+    dense = cluster_images_with_dbscan(image_paths, None, None, features=features)
+    assert len(dense) == -(-NUM_IMAGES // 4)
+
+    sparse = cluster_images_with_dbscan(image_paths, None, None, features=features, sparse_graph=True)
+    blocked = cluster_features_sparse(image_paths, features, block_size=17)
+    components = cluster_features_sparse(image_paths, features, method='components')
+
+    clusterer = IncrementalClusterer(block_size=17)
+    for start in range(0, NUM_IMAGES, 50):
+        clusterer.add(image_paths[start:start + 50], features[start:start + 50])
+
+    for clusters in (sparse, blocked, components, clusterer.clusters()):
+        assert as_sets(clusters) == as_sets(dense)
+
+
+def test_quantized_rows_cluster_like_float_features(features, image_paths):
+    dense = cluster_images_with_dbscan(image_paths, None, None, features=features)
+    for dtype in ('int8', 'float16'):
+        values, row_scales = quantize_embeddings(features, dtype)
+
+        sparse = cluster_features_sparse(image_paths, None, normalized=values, row_scales=row_scales, block_size=17)
+        clusterer = IncrementalClusterer()
+        clusterer.add(image_paths[:100], normalized=values[:100], row_scales=row_scales[:100])
+        clusterer.add(image_paths[100:], normalized=values[100:], row_scales=row_scales[100:])
+
+        assert as_sets(sparse) == as_sets(dense)
+        assert as_sets(clusterer.clusters()) == as_sets(dense)
+
+
+def test_incremental_cluster_ids_are_stable(features, image_paths):
+    clusterer = IncrementalClusterer()
+    clusterer.add(image_paths[:100], features[:100])
+    before = clusterer.cluster_ids()
+    clusterer.add(image_paths[100:], features[100:])
+
+    assert clusterer.cluster_ids()[:100].tolist() == before.tolist()
+
+
+def test_incremental_state_round_trips(features, image_paths, tmp_path):
+    clusterer = IncrementalClusterer()
+    clusterer.add(image_paths[:100], features[:100])
+    state_path = str(tmp_path / 'clusters.npz')
+    clusterer.save(state_path)
+
+    restored = IncrementalClusterer.load(state_path)
+    restored.add(image_paths[100:], features[100:])
+    clusterer.add(image_paths[100:], features[100:])
+
+    assert as_sets(restored.clusters()) == as_sets(clusterer.clusters())
@@ -0,0 +1,56 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from conftest import EMULATOR_CONFIG, SRC_DIRECTORY
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_cli(cwd, env, *args):
+    return subprocess.Popen([sys.executable, '-m', 'demogui.declutter_cli', 'album', 'keep', 'delete',
+                             '--cache-directory', 'cache', '-o', 'journal.jsonl', '--checkpoint-every', '1', *args],
+                            cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def test_run_stopped_with_sigterm_resumes_where_it_left_off(tmp_path, album, nef_paths):
+    # One dongle with a slow model, so the run is still scoring when it is stopped
+    config = dict(EMULATOR_CONFIG, devices=1, time_scale=1.0,
+                  models={'default': dict(EMULATOR_CONFIG['models']['default'], npu_ms=150)})
+    env = dict(os.environ, DEMOGUI_KP_EMULATOR_CONFIG=json.dumps(config),
+               PYTHONPATH=os.pathsep.join(filter(None, [SRC_DIRECTORY, os.environ.get('PYTHONPATH')])))
+    journal_path = str(tmp_path / 'journal.jsonl')
+
+    process = run_cli(str(tmp_path), env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and process.poll() is None:
+        if os.path.exists(journal_path):
+            if sum(record['type'] == 'image' for record in read_records(journal_path)) >= 3:
+                break
+        time.sleep(0.05)
+    process.send_signal(signal.SIGTERM)
+    _, stderr = process.communicate(timeout=60)
+    assert process.returncode == 128 + signal.SIGTERM, stderr
+    assert 'Interrupted' in stderr
+    scored_before = [record['path'] for record in read_records(journal_path) if record['type'] == 'image']
+    assert 3 <= len(scored_before) < len(album)
+
+    process = run_cli(str(tmp_path), env)
+    _, stderr = process.communicate(timeout=120)
+    assert process.returncode == 0, stderr
+    assert 'Resumed:' in stderr
+
+    records = read_records(journal_path)
+    scored = [record['path'] for record in records if record['type'] == 'image']
+    assert len(scored) == len(set(scored))
+    assert set(scored) == set(album)
+    assert scored[:len(scored_before)] == scored_before
+    assert records[-1] == {'type': 'done', 'images': len(album)}
+    placed = {os.path.basename(path) for directory in ('keep', 'delete')
+              for _, _, names in os.walk(tmp_path / directory) for path in names}
+    assert placed == {os.path.basename(path) for path in album}
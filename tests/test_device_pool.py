@@ -0,0 +1,64 @@
+import time
+import pytest
+from demogui.device_pool import DevicePool
+
+
+def test_connects_the_requested_devices():
+    with DevicePool(usb_port_ids=[3, 1]) as device_pool:
+        assert [device.usb_port_id for device in device_pool.devices] == [1, 3]
+
+
+def test_map_yields_results_in_input_order():
+    def work(device, item):
+        time.sleep(0.005)
+        return item, device.usb_port_id
+
+    with DevicePool() as device_pool:
+        results = list(device_pool.map(work, range(40)))
+
+        assert [item for item, _ in results] == list(range(40))
+        assert {usb_port_id for _, usb_port_id in results} == {1, 2, 3, 4}
+        assert sum(device.completed for device in device_pool.devices) == 40
+
+
+def test_map_unordered_yields_every_result():
+    with DevicePool() as device_pool:
+        assert sorted(device_pool.map(lambda device, item: item * 2, range(40), ordered=False)) == list(range(0, 80, 2))
+
+
+def test_idle_devices_steal_from_a_slow_one():
+    def work(device, item):
+        if device.usb_port_id == 1:
+            time.sleep(0.02)
+        return item
+
+    with DevicePool(usb_port_ids=[1, 2]) as device_pool:
+        assert list(device_pool.map(work, range(40))) == list(range(40))
+        slow, fast = device_pool.devices
+        assert fast.stolen > 0
+        assert fast.completed > slow.completed
+
+
+def test_worker_error_is_raised_to_the_caller():
+    def work(device, item):
+        if item == 7:
+            raise RuntimeError("bad item")
+        return item
+
+    with DevicePool(usb_port_ids=[1, 2]) as device_pool:
+        with pytest.raises(RuntimeError, match="bad item"):
+            list(device_pool.map(work, range(20)))
+
+
+def test_process_images_skips_unreadable_images(album, nef_paths, tmp_path):
+    broken = tmp_path / 'album' / 'broken.jpg'
+    broken.write_bytes(b'not a jpeg')
+    image_file_paths = album[:5] + [str(broken)] + album[5:]
+    messages = []
+
+    with DevicePool(usb_port_ids=[1, 2], log=messages.append) as device_pool:
+        device_pool.load_model(nef_paths[0])
+        results = list(device_pool.process_images(image_file_paths))
+
+    assert [image_file_path for image_file_path, _ in results] == album
+    assert any(str(broken) in message for message in messages)
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+from demogui.embedding_store import EmbeddingStore
+
+
+def embeddings(count, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_get_returns_the_unit_length_embedding(tmp_path, album, nef_paths):
+    features = embeddings(2)
+    with EmbeddingStore(str(tmp_path / 'cache'), nef_paths[1], dtype='float16') as store:
+        store.put(album[0], features[0])
+        assert np.allclose(store.get(album[0]), features[0] / np.linalg.norm(features[0]), atol=1e-3)
+        assert store.get(album[1]) is None
+
+
+def test_compact_drops_rows_of_photos_gone_from_the_album(tmp_path, album, nef_paths):
+    features = embeddings(len(album))
+    cache_directory = str(tmp_path / 'cache')
+    with EmbeddingStore(cache_directory, nef_paths[1]) as store:
+        for image_file_path, feature in zip(album, features):
+            store.put(image_file_path, feature)
+        expected = {image_file_path: store.get(image_file_path) for image_file_path in album}
+        old_files = (store.values_path, store.scales_path)
+
+        live = album[::3]
+        new_rows = store.compact(live)
+
+        assert len(store) == len(live)
+        assert new_rows.tolist() == [i // 3 if i % 3 == 0 else -1 for i in range(len(album))]
+        assert not any(os.path.exists(path) for path in old_files)
+        for image_file_path in live:
+            assert np.array_equal(store.get(image_file_path), expected[image_file_path])
+        assert store.get(album[1]) is None
+
+    with EmbeddingStore(cache_directory, nef_paths[1]) as store:
+        assert len(store) == len(live)
+        assert sorted(store.stat_digests) == sorted(live)
+        for image_file_path in live:
+            assert np.array_equal(store.get(image_file_path), expected[image_file_path])
+        store.put(album[1], features[1])
+        assert len(store) == len(live) + 1
+
+
+def test_compact_leaves_a_mostly_live_store_alone(tmp_path, album, nef_paths):
+    with EmbeddingStore(str(tmp_path / 'cache'), nef_paths[1]) as store:
+        for image_file_path, feature in zip(album, embeddings(len(album))):
+            store.put(image_file_path, feature)
+
+        assert store.compact(album[1:]) is None
+        assert len(store) == len(album)
+        assert store.compact(album[1:], dead_fraction=0).tolist() == [-1] + list(range(len(album) - 1))
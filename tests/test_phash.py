@@ -0,0 +1,54 @@
+import cv2
+from demogui.phash import NearDuplicateGrouper, PerceptualHashIndex, hamming_distance, image_hash
+from conftest import write_photo
+
+
+def test_hashes_within_the_distance_share_a_group():
+    grouper = NearDuplicateGrouper(max_distance=4)
+    base = 0x0123456789abcdef
+
+    assert grouper.add('a', base) == 'a'
+    assert grouper.add('b', base ^ 0b1111) == 'a'
+    assert grouper.add('c', base ^ 0b11111) == 'c'
+    assert grouper.add('d', base ^ (1 << 63)) == 'a'
+    assert grouper.groups == {'a': ['b', 'd'], 'c': []}
+
+
+def test_distance_is_measured_to_the_representative():
+    grouper = NearDuplicateGrouper(max_distance=2)
+    grouper.add('a', 0)
+    grouper.add('b', 0b11)
+
+    # three bits from the representative, even though only one bit from 'b'
+    assert grouper.add('c', 0b111) == 'c'
+
+
+def test_reencoded_photo_groups_with_its_original(tmp_path):
+    original = write_photo(str(tmp_path / 'original.jpg'), seed=1, size=(480, 640))
+    reencoded = str(tmp_path / 'reencoded.jpg')
+    cv2.imwrite(reencoded, cv2.imread(original), [cv2.IMWRITE_JPEG_QUALITY, 60])
+    other = write_photo(str(tmp_path / 'other.jpg'), seed=2, size=(480, 640))
+
+    for method in ('dhash', 'phash'):
+        hashes = {path: image_hash(path, method) for path in (original, reencoded, other)}
+        assert hamming_distance(hashes[original], hashes[reencoded]) <= 4
+
+        grouper = NearDuplicateGrouper(max_distance=4)
+        assert [grouper.add(path, hash_value) for path, hash_value in hashes.items()] == [original, original, other]
+
+
+def test_index_hashes_once_and_gives_none_for_broken_files(tmp_path, album):
+    broken = tmp_path / 'album' / 'broken.jpg'
+    broken.write_bytes(b'not a jpeg')
+    image_file_paths = album + [str(broken)]
+
+    with PerceptualHashIndex(str(tmp_path)) as index:
+        hashes = list(index.hash_images(iter(image_file_paths)))
+    assert [path for path, _ in hashes] == image_file_paths
+    assert hashes[-1][1] is None
+    assert all(hash_value is not None for _, hash_value in hashes[:-1])
+    assert index.computed == len(album)
+
+    with PerceptualHashIndex(str(tmp_path)) as index:
+        assert list(index.hash_images(album)) == hashes[:-1]
+        assert index.computed == 0
@@ -0,0 +1,63 @@
+import pytest
+import kp
+from demogui import utils
+from demogui.device_pool import DevicePool
+from demogui.utils import first_output_value, model_preprocessor, perform_inference, perform_inference_pipelined
+
+
+@pytest.fixture
+def device(nef_paths):
+    with DevicePool(usb_port_ids=[1]) as device_pool:
+        device_pool.load_model(nef_paths[0])
+        yield device_pool.devices[0]
+
+
+def requests(device, album):
+    preprocess = model_preprocessor(device.model_nef_descriptor)
+    return [(image_file_path, preprocess(image_file_path)) for image_file_path in album]
+
+
+def test_ordered_results_match_single_inference(device, album):
+    images = requests(device, album)
+    expected = [first_output_value(perform_inference(device.device_group, device.model_nef_descriptor, img_bgr565,
+                                                     device_resize=False))
+                for _, img_bgr565 in images]
+
+    results = list(perform_inference_pipelined(device.device_group, device.model_nef_descriptor, images,
+                                               queue_depth=4, device_resize=False))
+
+    assert [key for key, _ in results] == album
+    assert [first_output_value(outputs) for _, outputs in results] == expected
+
+
+def test_unordered_results_cover_every_image(device, album):
+    results = perform_inference_pipelined(device.device_group, device.model_nef_descriptor, requests(device, album),
+                                          queue_depth=4, ordered=False, device_resize=False)
+
+    assert sorted(key for key, _ in results) == album
+
+
+def test_inference_number_wraps_around(device, album, monkeypatch):
+    monkeypatch.setattr(utils, 'INFERENCE_NUMBER_RANGE', 4)
+    images = requests(device, album) * 3
+    sent = []
+    send = kp.inference.generic_image_inference_send
+
+    def record(device_group, generic_inference_input_descriptor):
+        sent.append(generic_inference_input_descriptor.inference_number)
+        return send(device_group=device_group, generic_inference_input_descriptor=generic_inference_input_descriptor)
+
+    monkeypatch.setattr(kp.inference, 'generic_image_inference_send', record)
+    results = list(perform_inference_pipelined(device.device_group, device.model_nef_descriptor, images,
+                                               queue_depth=3, device_resize=False))
+
+    assert sent == [seq % 4 for seq in range(len(images))]
+    assert [key for key, _ in results] == [key for key, _ in images]
+    outputs = [first_output_value(outputs) for _, outputs in results]
+    assert outputs[:len(album)] == outputs[len(album):2 * len(album)] == outputs[2 * len(album):]
+
+
+def test_queue_depth_must_leave_inference_numbers_free(device, album):
+    with pytest.raises(ValueError):
+        list(perform_inference_pipelined(device.device_group, device.model_nef_descriptor, requests(device, album),
+                                         queue_depth=utils.INFERENCE_NUMBER_RANGE))
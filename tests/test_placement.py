@@ -0,0 +1,109 @@
+import errno
+import json
+import os
+import shutil
+import pytest
+from demogui import declutter
+from demogui.declutter import PLACEMENT_MODES, PhotoPlacer
+
+
+def place_all(placement, album, output_directory, log=print):
+    records = []
+    with PhotoPlacer(placement, records.append, log=log) as placer:
+        for i, image_file_path in enumerate(album):
+            placer.place(image_file_path, str(output_directory), 'keep', cluster_index=i)
+    return placer, records
+
+
+@pytest.mark.parametrize('placement', [mode for mode in PLACEMENT_MODES if mode != 'manifest'])
+def test_each_mode_places_the_photo(placement, album, tmp_path, monkeypatch):
+    if placement == 'reflink':
+        # tmp_path may or may not be on a filesystem that clones; the fallback has its own test
+        monkeypatch.setattr(declutter, 'reflink_file', shutil.copyfile)
+    output_directory = tmp_path / 'keep'
+
+    _, records = place_all(placement, album[:3], output_directory)
+
+    assert [record['path'] for record in records] == album[:3]
+    for image_file_path, record in zip(album[:3], records):
+        destination_path = str(output_directory / os.path.basename(image_file_path))
+        assert record['destination'] == destination_path
+        with open(destination_path, 'rb') as placed, open(image_file_path, 'rb') as original:
+            assert placed.read() == original.read()
+        if placement == 'symlink':
+            assert os.readlink(destination_path) == os.path.abspath(image_file_path)
+        elif placement == 'hardlink':
+            assert os.path.samefile(destination_path, image_file_path)
+        else:
+            assert not os.path.islink(destination_path)
+            assert not os.path.samefile(destination_path, image_file_path)
+
+
+def test_manifest_mode_touches_no_files(album, tmp_path):
+    output_directory = tmp_path / 'keep'
+    placer, records = place_all('manifest', album[:3], output_directory)
+    manifest_path = str(tmp_path / 'manifest.json')
+    placer.write_manifest(manifest_path, str(tmp_path / 'album'))
+
+    assert not output_directory.exists()
+    assert len(records) == 3
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    assert manifest['placement'] == 'manifest'
+    assert [decision['path'] for decision in manifest['decisions']] == album[:3]
+
+
+def test_reflink_falls_back_to_copy_with_one_warning(album, tmp_path, monkeypatch):
+    def no_clone(source_path, destination_path):
+        raise OSError(errno.EOPNOTSUPP, "cloning not supported", source_path)
+
+    monkeypatch.setattr(declutter, 'reflink_file', no_clone)
+    messages = []
+
+    place_all('reflink', album[:3], tmp_path / 'keep', log=messages.append)
+
+    assert len(messages) == 1 and 'copying instead' in messages[0]
+    for image_file_path in album[:3]:
+        destination_path = str(tmp_path / 'keep' / os.path.basename(image_file_path))
+        assert os.path.isfile(destination_path) and not os.path.islink(destination_path)
+
+
+def test_hardlink_across_filesystems_falls_back_to_copy(album, tmp_path, monkeypatch):
+    def cross_device(source_path, destination_path):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(declutter.os, 'link', cross_device)
+    messages = []
+
+    place_all('hardlink', album[:2], tmp_path / 'keep', log=messages.append)
+
+    assert len(messages) == 1
+    assert not os.path.samefile(str(tmp_path / 'keep' / os.path.basename(album[0])), album[0])
+
+
+@pytest.mark.parametrize('placement', ['copy', 'hardlink', 'symlink'])
+def test_existing_destination_is_replaced(placement, album, tmp_path):
+    output_directory = tmp_path / 'keep'
+    output_directory.mkdir()
+    destination_path = output_directory / os.path.basename(album[0])
+    os.symlink(album[1], destination_path)
+
+    place_all(placement, album[:1], output_directory)
+
+    with open(destination_path, 'rb') as placed, open(album[0], 'rb') as original:
+        assert placed.read() == original.read()
+    with open(album[1], 'rb') as untouched, open(album[1], 'rb') as original:
+        assert untouched.read() == original.read()
+
+
+def test_remove_takes_back_a_placement(album, tmp_path):
+    records = []
+    with PhotoPlacer('copy', records.append) as placer:
+        placer.place(album[0], str(tmp_path / 'keep'), 'keep')
+        placer.flush()
+        destination_path = placer.destination(album[0], str(tmp_path / 'keep'))
+        placer.remove(album[0], destination_path)
+
+    assert not os.path.exists(destination_path)
+    assert os.path.exists(album[0])
+    assert [record['type'] for record in records] == ['placed', 'removed']
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import kp
+from demogui.device_pool import DevicePool
+from demogui.utils import (PlanarFrame, build_inference_descriptor, list_raw_image_files, load_raw_image,
+                           parse_raw_image_name, process_raw_images_pipelined)
+
+
+def write_frame(directory, name, num_bytes, seed=0):
+    path = directory / name
+    path.write_bytes(np.random.default_rng(seed).integers(0, 256, num_bytes, dtype=np.uint8).tobytes())
+    return str(path)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('bike_cars_street_224x224_cby0cry1.bin', (224, 224, 'cby0cry1', False)),
+    ('people_talk_in_street_640x640_rgba8888_normalized.bin', (640, 640, 'rgba8888', True)),
+    ('/some/dir/cam_1280x720_YUV420P.yuv', (1280, 720, 'yuv420p', False)),
+    ('gray_64x48_raw8.raw', (64, 48, 'raw8', False)),
+    ('photo.jpg', None),
+    ('frame_224x224_bgr24.bin', None),
+    ('frame_224x224_rgb565.png', None),
+])
+def test_parse_raw_image_name(name, expected):
+    assert parse_raw_image_name(name) == expected
+
+
+def test_packed_frame_is_mapped_with_its_shape(tmp_path):
+    path = write_frame(tmp_path, 'frame_32x24_rgb565.bin', 32 * 24 * 2)
+
+    image, image_format = load_raw_image(path)
+
+    assert image.shape == (24, 32, 2)
+    assert image_format == kp.ImageFormat.KP_IMAGE_FORMAT_RGB565
+    assert isinstance(image, np.memmap)
+
+
+def test_raw8_frame_is_two_dimensional(tmp_path):
+    image, image_format = load_raw_image(write_frame(tmp_path, 'frame_32x24_raw8.bin', 32 * 24))
+
+    assert image.shape == (24, 32)
+    assert image_format == kp.ImageFormat.KP_IMAGE_FORMAT_RAW8
+
+
+def test_planar_frame_carries_its_size(tmp_path):
+    image, image_format = load_raw_image(write_frame(tmp_path, 'frame_32x24_yuv420p.yuv', 32 * 24 * 3 // 2))
+
+    assert isinstance(image, PlanarFrame)
+    assert (image.width, image.height) == (32, 24)
+    assert image_format == kp.ImageFormat.KP_IMAGE_FORMAT_YUV420
+
+
+def test_size_mismatch_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="expected"):
+        load_raw_image(write_frame(tmp_path, 'frame_32x24_rgba8888.bin', 32 * 24 * 3))
+
+
+def test_explicit_size_and_format_override_the_name(tmp_path):
+    image, image_format = load_raw_image(write_frame(tmp_path, 'dump.bin', 16 * 8 * 2), 16, 8, 'yuyv')
+
+    assert image.shape == (8, 16, 2)
+    assert image_format == kp.ImageFormat.KP_IMAGE_FORMAT_YUYV
+
+
+def test_descriptor_uses_the_frame_format(tmp_path, nef_paths):
+    frame, image_format = load_raw_image(write_frame(tmp_path, 'frame_32x24_yuv420p.yuv', 32 * 24 * 3 // 2))
+    with DevicePool(usb_port_ids=[1]) as device_pool:
+        model_nef_descriptor = device_pool.load_model(nef_paths[0])
+
+    descriptor = build_inference_descriptor(model_nef_descriptor, frame, inference_number=5,
+                                            image_format=image_format,
+                                            normalize_mode=kp.NormalizeMode.KP_NORMALIZE_DISABLE)
+
+    assert descriptor.inference_number == 5
+    node = descriptor.input_node_image_list[0]
+    assert node.image_format == kp.ImageFormat.KP_IMAGE_FORMAT_YUV420
+    assert node.normalize_mode == kp.NormalizeMode.KP_NORMALIZE_DISABLE
+    assert (node.width, node.height) == (32, 24)
+
+
+def test_raw_frames_replay_in_order(tmp_path, nef_paths):
+    paths = [write_frame(tmp_path, f'frame{i}_32x24_rgb565.bin', 32 * 24 * 2, seed=i) for i in range(6)]
+    write_frame(tmp_path, 'notes.txt', 4)
+    assert list_raw_image_files(str(tmp_path)) == sorted(paths)
+
+    with DevicePool(usb_port_ids=[1]) as device_pool:
+        model_nef_descriptor = device_pool.load_model(nef_paths[0])
+        device_group = device_pool.devices[0].device_group
+        results = list(process_raw_images_pipelined(device_group, model_nef_descriptor, paths))
+        assert [path for path, _ in results] == paths
+
+        mixed = paths[:2] + [write_frame(tmp_path, 'other_32x24_rgba8888.bin', 32 * 24 * 4)]
+        with pytest.raises(ValueError, match="rgb565"):
+            list(process_raw_images_pipelined(device_group, model_nef_descriptor, mixed))
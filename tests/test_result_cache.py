@@ -0,0 +1,72 @@
+import os
+import shutil
+import numpy as np
+from demogui.result_cache import ResultCache
+
+
+def test_hit_and_miss(tmp_path, album, nef_paths):
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[0]) as cache:
+        assert cache.get(album[0]) is None
+        cache.put(album[0], [0.25])
+        assert cache.get(album[0]).tolist() == [0.25]
+        assert cache.get(album[1]) is None
+        assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entries_survive_a_reopen(tmp_path, album, nef_paths):
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[0], width=2) as cache:
+        cache.put(album[0], [0.25, 0.5])
+
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[0], width=2) as cache:
+        assert cache.get(album[0]).tolist() == [0.25, 0.5]
+
+
+def test_entries_are_keyed_by_content(tmp_path, album, nef_paths):
+    copy_path = str(tmp_path / 'copy.jpg')
+    shutil.copy(album[0], copy_path)
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[0]) as cache:
+        cache.put(album[0], [0.25])
+        assert cache.get(copy_path).tolist() == [0.25]
+
+        # rewriting the file changes its size or mtime, so the digest is computed again
+        shutil.copy(album[1], album[0])
+        os.utime(album[0], ns=(1, 1))
+        assert cache.get(album[0]) is None
+
+
+def test_other_model_has_its_own_entries(tmp_path, album, nef_paths):
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[0]) as cache:
+        cache.put(album[0], [0.25])
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[1]) as cache:
+        assert cache.get(album[0]) is None
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, album, nef_paths):
+    with ResultCache(str(tmp_path / 'cache'), nef_paths[0], max_entries=2) as cache:
+        cache.put(album[0], [0.0])
+        cache.put(album[1], [1.0])
+        cache.get(album[0])
+        cache.put(album[2], [2.0])
+
+        assert cache.get(album[1]) is None
+        assert cache.get(album[0]).tolist() == [0.0]
+        assert cache.get(album[2]).tolist() == [2.0]
+
+
+def test_slot_reused_after_the_index_was_written_is_a_miss(tmp_path, album, nef_paths):
+    cache_directory = str(tmp_path / 'cache')
+    with ResultCache(cache_directory, nef_paths[0], max_entries=1) as cache:
+        cache.put(album[0], [0.25])
+
+    # a second run evicts the entry and reuses its slot, then dies before writing its index
+    crashed = ResultCache(cache_directory, nef_paths[0], max_entries=1)
+    crashed.put(album[1], [0.75])
+    crashed.digests.flush()
+    crashed.values.flush()
+    del crashed
+
+    with ResultCache(cache_directory, nef_paths[0], max_entries=1) as cache:
+        assert cache.get(album[0]) is None
+        assert len(cache) == 0
+        cache.put(album[0], [0.5])
+        assert np.allclose(cache.get(album[0]), [0.5])